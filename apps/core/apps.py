@@ -3,4 +3,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.core'
-    verbose_name = 'Ядро системы'
\ No newline at end of file
+    verbose_name = 'Ядро системы'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+        from .profiling import instrument_templates
+        from . import checks  # noqa: F401 — регистрация системных проверок
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='core_sqlite_pragmas')
+        instrument_templates()
@@ -0,0 +1,325 @@
+"""
+SQLite backup helpers shared by the backup_db and restore_db commands.
+
+A backup set lives in one directory and consists of archives plus JSON
+manifests next to them:
+
+* full backup        ``<prefix>_<ts>.zip``      -- the whole database file
+* incremental backup ``<prefix>_<ts>.inc.zip``  -- pages changed since the
+  previous backup of the chain
+* manifest           ``<prefix>_<ts>.json``     -- checksums, page layout,
+  integrity_check result and the name of the base backup
+* page digests       ``<prefix>_<ts>.pages``    -- 16-byte digest per page,
+  used to find changed pages for the next incremental backup
+* archive database   ``<prefix>_<ts>.archive.zip`` -- full copy of the attached
+  timesheet archive (settings.SQLITE_ARCHIVE_PATH); described by the
+  ``archive_db`` key of the manifest and reused by later backups of the chain
+  while the archive does not change
+
+Every backup first writes an uncompressed snapshot of the database next to
+the archives (``*.tmp``), then compresses or diffs it and removes it. The
+destination therefore needs free space for the whole database plus the new
+archive; it is checked before the copy starts.
+
+The main database is copied before the archive. archive_months copies rows
+into the archive before deleting them from the main file, so a month moved
+between the two copies is present in both rather than lost.
+"""
+import hashlib
+import json
+import re
+import shutil
+import sqlite3
+import struct
+import zipfile
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+PAGE_RECORD = struct.Struct(">I")
+TS_RE = re.compile(r"_(\d{8}_\d{6})(?:\.inc|\.archive)?\.(zip|sqlite3|json|pages)$")
+
+
+class BackupError(Exception):
+    pass
+
+
+def page_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def snapshot_backup(src_path, dest_path, busy_timeout=5000):
+    """
+    Online copy of src_path into dest_path as of one point in time.
+
+    The whole database is copied in a single backup step inside a read
+    transaction on the source. A copy taken in page batches restarts from
+    page 1 whenever another connection writes between batches, so on a busy
+    database it may never finish; the read transaction pins one snapshot
+    instead. In WAL mode writers are not blocked meanwhile (the WAL file
+    grows until the copy is done); in rollback-journal mode they wait.
+    """
+    dest_path = Path(dest_path)
+    if dest_path.exists():
+        dest_path.unlink()
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True, isolation_level=None)
+    try:
+        src.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        dest = sqlite3.connect(str(dest_path))
+        try:
+            src.backup(dest, pages=-1)
+        finally:
+            dest.close()
+        src.execute("COMMIT")
+    finally:
+        src.close()
+
+
+def database_size(db_path):
+    """Size of the database file plus its WAL, an upper bound for a copy"""
+    db_path = Path(db_path)
+    wal = Path(str(db_path) + "-wal")
+    return db_path.stat().st_size + (wal.stat().st_size if wal.exists() else 0)
+
+
+def check_free_space(dest_dir, needed):
+    """Raise BackupError unless dest_dir has `needed` bytes free"""
+    free = shutil.disk_usage(dest_dir).free
+    if free < needed:
+        raise BackupError(
+            f"Not enough free space in {dest_dir}: {needed // 2**20} MiB needed, {free // 2**20} MiB free"
+        )
+
+
+def integrity_check(db_path):
+    """Run PRAGMA integrity_check; return (ok, message, page_size, page_count)"""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        rows = [r[0] for r in conn.execute("PRAGMA integrity_check").fetchall()]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        conn.close()
+    ok = rows == ["ok"]
+    return ok, "ok" if ok else "; ".join(rows[:20]), page_size, page_count
+
+
+def iter_pages(db_path, page_size):
+    with open(db_path, "rb") as f:
+        pgno = 0
+        while True:
+            data = f.read(page_size)
+            if not data:
+                return
+            pgno += 1
+            yield pgno, data
+
+
+def write_full_archive(db_path, archive_path, arcname, page_size):
+    """
+    Stream the database file into a zip archive in one pass, computing the
+    file checksum and per-page digests on the way.
+    """
+    db_hash = hashlib.sha256()
+    digests = bytearray()
+    with zipfile.ZipFile(str(archive_path), mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(arcname, mode="w", force_zip64=True) as out:
+            for _, data in iter_pages(db_path, page_size):
+                db_hash.update(data)
+                digests += page_digest(data)
+                out.write(data)
+    return db_hash.hexdigest(), bytes(digests)
+
+
+def write_incremental_archive(db_path, archive_path, page_size, base_digests):
+    """
+    Store only pages whose digest differs from base_digests.
+
+    Archive member ``pages.bin`` is a sequence of (uint32 page number, page bytes).
+    Returns (db sha256, new digests, changed page count).
+    """
+    db_hash = hashlib.sha256()
+    digests = bytearray()
+    changed = 0
+    with zipfile.ZipFile(str(archive_path), mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("pages.bin", mode="w", force_zip64=True) as out:
+            for pgno, data in iter_pages(db_path, page_size):
+                db_hash.update(data)
+                digest = page_digest(data)
+                digests += digest
+                offset = (pgno - 1) * DIGEST_SIZE
+                if base_digests[offset:offset + DIGEST_SIZE] != digest:
+                    out.write(PAGE_RECORD.pack(pgno))
+                    out.write(data)
+                    changed += 1
+    return db_hash.hexdigest(), bytes(digests), changed
+
+
+def hash_pages(db_path, page_size):
+    """Checksum and per-page digests of an uncompressed copy"""
+    db_hash = hashlib.sha256()
+    digests = bytearray()
+    for _, data in iter_pages(db_path, page_size):
+        db_hash.update(data)
+        digests += page_digest(data)
+    return db_hash.hexdigest(), bytes(digests)
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_path_for(archive_path):
+    name = Path(archive_path).name
+    for suffix in (".inc.zip", ".archive.zip", ".zip", ".sqlite3"):
+        if name.endswith(suffix):
+            return Path(archive_path).with_name(name[: -len(suffix)] + ".json")
+    return Path(archive_path).with_suffix(".json")
+
+
+def read_manifest(path):
+    path = Path(path)
+    if path.suffix != ".json":
+        path = manifest_path_for(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BackupError(f"Cannot read manifest {path}: {e}")
+    manifest["_path"] = str(path)
+    return manifest
+
+
+def write_manifest(path, manifest):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp.replace(path)
+
+
+def backup_timestamp(path):
+    m = TS_RE.search(Path(path).name)
+    return m.group(1) if m else None
+
+
+def list_manifests(dest_dir, prefix):
+    """Manifests of a backup set, newest first (by timestamp in the name)"""
+    items = []
+    for p in Path(dest_dir).glob(f"{prefix}_*.json"):
+        ts = backup_timestamp(p)
+        if ts:
+            items.append((ts, p))
+    items.sort(reverse=True)
+    return [p for _, p in items]
+
+
+def backup_chain(manifest, dest_dir):
+    """Manifests from the full backup to `manifest`, in apply order"""
+    chain = [manifest]
+    seen = {manifest.get("archive")}
+    while chain[0].get("type") == "incremental":
+        base = chain[0].get("base")
+        if not base or base in seen:
+            raise BackupError("Broken incremental chain")
+        seen.add(base)
+        chain.insert(0, read_manifest(Path(dest_dir) / base))
+    return chain
+
+
+def restore_chain(chain, dest_dir, out_path):
+    """Rebuild the database file described by the last manifest of `chain`"""
+    dest_dir = Path(dest_dir)
+    full = chain[0]
+    archive = dest_dir / full["archive"]
+    if file_sha256(archive) != full["archive_sha256"]:
+        raise BackupError(f"Checksum mismatch: {archive.name}")
+    if full.get("member"):
+        with zipfile.ZipFile(str(archive)) as zf, zf.open(full["member"]) as src, open(out_path, "wb") as out:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                out.write(chunk)
+    else:
+        with open(archive, "rb") as src, open(out_path, "wb") as out:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                out.write(chunk)
+
+    for manifest in chain[1:]:
+        archive = dest_dir / manifest["archive"]
+        if file_sha256(archive) != manifest["archive_sha256"]:
+            raise BackupError(f"Checksum mismatch: {archive.name}")
+        page_size = manifest["page_size"]
+        with zipfile.ZipFile(str(archive)) as zf, zf.open("pages.bin") as src, open(out_path, "r+b") as out:
+            while True:
+                header = src.read(PAGE_RECORD.size)
+                if not header:
+                    break
+                (pgno,) = PAGE_RECORD.unpack(header)
+                out.seek((pgno - 1) * page_size)
+                out.write(src.read(page_size))
+            out.truncate(manifest["page_count"] * page_size)
+
+    if file_sha256(out_path) != chain[-1]["db_sha256"]:
+        raise BackupError("Restored database checksum does not match the manifest")
+
+
+def backup_attached_database(src_path, dest_dir, name, base_entry=None):
+    """
+    Back up a secondary database file (the timesheet archive) into
+    ``dest_dir/<name>.zip`` and return its ``archive_db`` manifest entry.
+
+    If the copy is identical to `base_entry` (the entry of the base backup),
+    no new archive is written and the base entry is returned.
+    """
+    dest_dir = Path(dest_dir)
+    tmp_copy = dest_dir / f"{name}.tmp"
+    out_path = dest_dir / f"{name}.zip"
+    # Uncompressed copy plus, at worst, an archive of the same size
+    check_free_space(dest_dir, 2 * database_size(src_path))
+    try:
+        snapshot_backup(src_path, tmp_copy)
+        ok, message, page_size, page_count = integrity_check(tmp_copy)
+        if not ok:
+            raise BackupError(f"integrity_check failed on the archive database copy: {message}")
+        db_sha256, _ = hash_pages(tmp_copy, page_size)
+        if base_entry and base_entry.get("db_sha256") == db_sha256 and (dest_dir / base_entry["archive"]).exists():
+            return base_entry
+        write_full_archive(tmp_copy, out_path, f"{name}.sqlite3", page_size)
+    except BaseException:
+        out_path.unlink(missing_ok=True)
+        raise
+    finally:
+        tmp_copy.unlink(missing_ok=True)
+    return {
+        "source": str(src_path),
+        "archive": out_path.name,
+        "member": f"{name}.sqlite3",
+        "page_size": page_size,
+        "page_count": page_count,
+        "integrity_check": message,
+        "db_sha256": db_sha256,
+        "archive_sha256": file_sha256(out_path),
+        "archive_size": out_path.stat().st_size,
+    }
+
+
+def restore_attached_database(entry, dest_dir, out_path):
+    """Extract and verify a database described by an ``archive_db`` manifest entry"""
+    restore_chain([entry], dest_dir, out_path)
+
+
+def copy_database(src_path, dest_path, pages=1024, sleep=0.05):
+    """Copy a database file into another (possibly live) database via the backup API"""
+    src = sqlite3.connect(str(src_path))
+    try:
+        dest = sqlite3.connect(str(dest_path), timeout=30)
+        try:
+            src.backup(dest, pages=pages, sleep=sleep)
+        finally:
+            dest.close()
+    finally:
+        src.close()
@@ -0,0 +1,22 @@
+"""
+Бэкенд кеша с подсчетом попаданий и промахов для метрик (apps.core.metrics).
+"""
+from django.core.cache.backends.locmem import LocMemCache
+
+from .metrics import record_cache
+
+_MISSING = object()
+
+
+class InstrumentedLocMemCache(LocMemCache):
+    """LocMemCache, учитывающий каждое чтение как hit или miss (get_many и get_or_set читают через get)"""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.metrics_alias = name or 'default'
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        record_cache(self.metrics_alias, value is not _MISSING)
+        return default if value is _MISSING else value
+
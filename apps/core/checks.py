@@ -0,0 +1,32 @@
+from django.core.checks import Error, Warning, register
+
+
+@register()
+def check_sqlite_profile(app_configs, **kwargs):
+    """Проверка профиля SQLite при запуске (manage.py check, runserver, migrate)"""
+    from django.conf import settings
+    from .db import get_sqlite_pragmas
+
+    if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+        return []
+    try:
+        pragmas = dict(get_sqlite_pragmas())
+    except (TypeError, ValueError) as e:
+        return [Error(str(e), hint='Проверьте переменные окружения DJANGO_SQLITE_*', id='core.E001')]
+    messages = []
+    if pragmas.get('journal_mode') != 'WAL':
+        messages.append(Warning(
+            'SQLite работает без WAL: чтение блокируется на время записи',
+            hint='DJANGO_SQLITE_JOURNAL_MODE=WAL', id='core.W001',
+        ))
+    if pragmas.get('busy_timeout', 0) <= 0:
+        messages.append(Warning(
+            'busy_timeout не задан: параллельные записи сразу завершатся ошибкой «database is locked»',
+            hint='DJANGO_SQLITE_BUSY_TIMEOUT=5000', id='core.W002',
+        ))
+    if pragmas.get('synchronous') == 'OFF':
+        messages.append(Warning(
+            'synchronous=OFF: возможна потеря данных при сбое питания',
+            hint='DJANGO_SQLITE_SYNCHRONOUS=NORMAL', id='core.W003',
+        ))
+    return messages
@@ -0,0 +1,3 @@
+def read_replica(request):
+    """Состояние реплики для индикатора давности данных (apps.core.replica)"""
+    return {'read_replica': getattr(request, 'read_replica', None)}
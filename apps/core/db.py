@@ -0,0 +1,117 @@
+"""
+Профиль SQLite: PRAGMA из settings.SQLITE_PRAGMAS для каждого соединения.
+
+Параметры journal_mode и synchronous влияют на конкурентный доступ (WAL
+позволяет читать во время записи), busy_timeout — на ожидание блокировки
+вместо немедленной ошибки «database is locked».
+
+Если задан settings.SQLITE_ARCHIVE_PATH, файл архива табелей подключается
+к соединению как схема archive (ATTACH) до применения PRAGMA, поэтому
+journal_mode действует и на него.
+"""
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger('apps')
+
+PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+INTEGER_PRAGMAS = ('busy_timeout', 'mmap_size', 'cache_size')
+SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+ARCHIVE_SCHEMA = 'archive'
+
+_journal_mode_warned = False
+
+
+def get_sqlite_pragmas():
+    """Проверенный набор PRAGMA из настроек: (имя, значение) в порядке применения"""
+    configured = getattr(settings, 'SQLITE_PRAGMAS', {}) or {}
+    pragmas = []
+    for name, value in configured.items():
+        if name in PRAGMA_CHOICES:
+            value = str(value).upper()
+            if value not in PRAGMA_CHOICES[name]:
+                raise ValueError(f'Недопустимое значение SQLITE_PRAGMAS[{name!r}]: {value}')
+        elif name in INTEGER_PRAGMAS:
+            value = int(value)
+        else:
+            raise ValueError(f'Неизвестная PRAGMA в SQLITE_PRAGMAS: {name}')
+        pragmas.append((name, value))
+    return pragmas
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Обработчик connection_created: применяет профиль к новому соединению SQLite"""
+    global _journal_mode_warned
+    if connection.vendor != 'sqlite':
+        return
+    from .replica import get_replica_alias
+
+    is_replica = connection.alias == get_replica_alias()
+    with connection.cursor() as cursor:
+        attach_archive(connection, cursor)
+        if is_replica:
+            # Снимок только читается: режим журнала не трогаем, запись запрещаем
+            cursor.execute('PRAGMA query_only = 1')
+        for name, value in get_sqlite_pragmas():
+            if is_replica and name in ('journal_mode', 'synchronous'):
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+            if name == 'journal_mode':
+                actual = str(cursor.fetchone()[0]).upper()
+                # In-memory БД (тесты) всегда в режиме MEMORY — это не ошибка профиля
+                if actual != value and actual != 'MEMORY' and not _journal_mode_warned:
+                    _journal_mode_warned = True
+                    logger.warning(
+                        f'SQLite: journal_mode={value} не применен, активен {actual} '
+                        f'(файловая система не поддерживает режим?)'
+                    )
+
+
+def get_archive_path(connection):
+    """Файл архива для соединения; для in-memory БД (тесты) — тоже in-memory"""
+    path = getattr(settings, 'SQLITE_ARCHIVE_PATH', '') or ''
+    if not path:
+        return None
+    if connection.is_in_memory_db():
+        return ':memory:'
+    return str(path)
+
+
+def attach_archive(connection, cursor):
+    path = get_archive_path(connection)
+    if path is None:
+        return
+    cursor.execute('PRAGMA database_list')
+    if any(row[1] == ARCHIVE_SCHEMA for row in cursor.fetchall()):
+        return
+    cursor.execute(f'ATTACH DATABASE %s AS {ARCHIVE_SCHEMA}', [path])
+
+
+def read_sqlite_status(connection):
+    """Активные PRAGMA и размеры файлов БД для команды sqlite_status"""
+    import os
+
+    status = {}
+    with connection.cursor() as cursor:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size',
+                     'temp_store', 'page_size', 'page_count', 'freelist_count', 'wal_autocheckpoint'):
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            status[name] = row[0] if row else None
+        cursor.execute('SELECT sqlite_version()')
+        status['sqlite_version'] = cursor.fetchone()[0]
+    status['synchronous'] = SYNCHRONOUS_NAMES.get(status['synchronous'], status['synchronous'])
+    status['temp_store'] = TEMP_STORE_NAMES.get(status['temp_store'], status['temp_store'])
+
+    path = str(connection.settings_dict['NAME'])
+    status['path'] = path
+    status['db_size'] = os.path.getsize(path) if os.path.exists(path) else 0
+    status['wal_size'] = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+    return status
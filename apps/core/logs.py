@@ -0,0 +1,236 @@
+"""
+Асинхронный структурированный журнал.
+
+Потоки запросов только кладут запись в очередь (QueueListenerHandler);
+форматирование и запись в файл выполняет поток QueueListener. Файл пишется
+JSON-строками (JsonFormatter) и ротируется по размеру и по времени, старые
+части сжимаются gzip; воркеры согласуют ротацию общего файла через flock.
+DEBUG-записи можно прореживать (SamplingFilter).
+Конфигурация собирается в settings.LOGGING из переменных окружения DJANGO_LOG_*.
+"""
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Стандартные атрибуты LogRecord: все прочие пришли через extra и попадают в JSON
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка; поля extra (request_data и др.) выводятся как есть"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'pid': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей уровня ниже level (по умолчанию DEBUG); остальные — все"""
+
+    def __init__(self, rate=1.0, level='DEBUG'):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+
+    def filter(self, record):
+        if record.levelno > self.level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Ротация по размеру (max_bytes) и по времени (rotate_seconds), старые части
+    сжимаются: app.log.1.gz ... app.log.<backup_count>.gz.
+
+    В один файл пишут все воркеры. Запись идет под разделяемой блокировкой
+    <файл>.lock, ротация — под исключительной: воркер, дождавшийся ее, заново
+    проверяет условие, и файл ротирует только один из них. Перед записью
+    обработчик сверяет inode baseFilename с тем, что открывал сам, и после
+    чужой ротации переоткрывает файл, а не дописывает в переименованный.
+    Без fcntl (Windows) блокировок нет — там пишет один процесс.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=10, rotate_seconds=0, compress=True, encoding='utf-8'):
+        super().__init__(filename, maxBytes=int(max_bytes), backupCount=int(backup_count), encoding=encoding, delay=True)
+        self.rotate_seconds = int(rotate_seconds)
+        self.rollover_at = self._next_rollover(self._opened_at())
+        self._file = self._file_id()
+        self._lock_file = None
+        self._lock_pid = None
+        if compress:
+            self.namer = lambda name: f'{name}.gz'
+            self.rotator = self._compress
+
+    def _opened_at(self):
+        try:
+            return os.path.getmtime(self.baseFilename)
+        except OSError:
+            return time.time()
+
+    def _next_rollover(self, since):
+        return since + self.rotate_seconds if self.rotate_seconds else None
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Блокировка между процессами; файл блокировки открывается заново после fork"""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_pid != os.getpid():
+            self._lock_file = open(self.baseFilename + '.lock', 'a')
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _file_id(self):
+        try:
+            stat = os.stat(self.baseFilename)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _open(self):
+        stream = super()._open()
+        self._file = self._file_id()
+        return stream
+
+    def _sync_with_file(self):
+        """Файл ротировал другой процесс: закрыть старый поток и начать отсчет времени заново"""
+        current = self._file_id()
+        if current == self._file:
+            return
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self._file = current
+        self.rollover_at = self._next_rollover(time.time())
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at and os.path.exists(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+    def emit(self, record):
+        try:
+            with self._locked(exclusive=False):
+                self._sync_with_file()
+                if not self.shouldRollover(record):
+                    logging.FileHandler.emit(self, record)
+                    return
+            with self._locked(exclusive=True):
+                self._sync_with_file()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None and self._lock_pid == os.getpid():
+            self._lock_file.close()
+        self._lock_file = None
+        self._lock_pid = None
+
+
+class QueueListenerHandler(logging.handlers.QueueHandler):
+    """
+    Кладет записи в ограниченную очередь; поток QueueListener передает их
+    обработчикам handlers. При переполнении очереди запись отбрасывается
+    (dropped), запрос не ждет диска. После fork поток слушателя перезапускается.
+    """
+
+    def __init__(self, handlers, queue_size=10000, respect_handler_level=True):
+        super().__init__(queue.Queue(int(queue_size)))
+        # Элементы ConvertingList (cfg://handlers.x) превращаются в обработчики только при индексации
+        self.targets = [handlers[i] for i in range(len(handlers))]
+        self.respect_handler_level = respect_handler_level
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = logging.handlers.QueueListener(
+                self.queue, *self.targets, respect_handler_level=self.respect_handler_level,
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Сообщение и трассировку фиксируем в потоке запроса, форматирует слушатель
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Дописать очередь и остановить поток (при выходе из процесса)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
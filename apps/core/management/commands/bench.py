@@ -0,0 +1,383 @@
+import calendar
+import csv
+import json
+import logging
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import date
+from io import StringIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Count, Max, Q
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.core.profiling import RequestProfile
+from apps.timesheet.models import ItrTimesheet, Timesheet
+from apps.users.models import Employee, User
+
+SCENARIOS = (
+    'grid_master', 'grid_planner', 'print', 'statistics', 'submit_month',
+    'fill_range', 'export', 'staff_import', 'backup',
+)
+# Сценарии, изменяющие данные: каждая итерация откатывается
+MUTATING = {'submit_month', 'fill_range', 'staff_import'}
+COMPARED_METRICS = ('p50_ms', 'queries', 'peak_kib')
+
+
+class RollbackIteration(Exception):
+    """Откат транзакции итерации изменяющего сценария"""
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу: для малых выборок без интерполяции"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * share // 1))
+    return ordered[int(rank) - 1]
+
+
+def compare_results(current, baseline, threshold):
+    """
+    Сравнение результатов с базовыми: список регрессий (сценарий, метрика,
+    база, текущее, прирост). Регрессия — рост метрики больше threshold.
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or 'error' in result or 'error' in base:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            growth = new / old - 1
+            if growth > threshold:
+                regressions.append((name, metric, old, new, growth))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер производительности горячих путей табеля на текущей БД "
+        "(данные — generate_load_data): задержка p50/p95, число запросов, "
+        "пиковая память (tracemalloc) и строк/с. Результаты пишутся в JSON и "
+        "сравниваются с базовыми (--baseline); при регрессии команда завершается с ошибкой"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=None,
+                            help='Сценарии (по умолчанию все)')
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=2, help='Прогревочных итераций (не учитываются)')
+        parser.add_argument('--cold-cache', action='store_true', default=False,
+                            help='Очищать кэш перед каждой итерацией')
+        parser.add_argument('--master', type=str, default=None,
+                            help='Логин мастера (по умолчанию — мастер с наибольшим числом сотрудников)')
+        parser.add_argument('--planner', type=str, default=None,
+                            help='Логин плановика (по умолчанию — плановик с наибольшим числом мастеров)')
+        parser.add_argument('--month', type=str, default=None,
+                            help='Месяц ГГГГ-ММ (по умолчанию — последний месяц с табелями)')
+        parser.add_argument('--output', type=str, default=None,
+                            help='Файл результатов JSON (по умолчанию logs/bench/bench_<время>.json)')
+        parser.add_argument('--baseline', type=str, default=None, help='Базовые результаты JSON для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p50, числа запросов и памяти относительно базы (доля)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['warmup'] < 0:
+            raise CommandError('--iterations должно быть >= 1, --warmup >= 0')
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = json.loads(Path(options['baseline']).read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Не удалось прочитать базовые результаты: {e}')
+
+        self._prepare(options)
+        self.iterations = options['iterations']
+        self.warmup = options['warmup']
+        self.cold_cache = options['cold_cache']
+
+        results = {
+            'meta': self._meta(options),
+            'scenarios': {},
+        }
+        # Журнал запросов (LoggingMiddleware) на время замеров — только ошибки
+        logger = logging.getLogger('apps')
+        log_level = logger.level
+        logger.setLevel(logging.ERROR)
+        # Тестовый клиент ходит на хост testserver
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name in options['scenarios'] or SCENARIOS:
+                    try:
+                        result = self._run(name)
+                    except Exception as e:
+                        result = {'error': f'{type(e).__name__}: {e}'}
+                    results['scenarios'][name] = result
+                    self._report(name, result)
+        finally:
+            logger.setLevel(log_level)
+            if self.staff_dir is not None:
+                shutil.rmtree(self.staff_dir, ignore_errors=True)
+
+        output = Path(options['output']) if options['output'] else (
+            Path(settings.BASE_DIR) / 'logs' / 'bench'
+            / f"bench_{timezone.localtime().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(f'Результаты: {output}')
+
+        failed = [name for name, result in results['scenarios'].items() if 'error' in result]
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['threshold'])
+            for name, metric, old, new, growth in regressions:
+                self.stdout.write(self.style.ERROR(
+                    f'  Регрессия {name}.{metric}: {old} -> {new} (+{growth:.0%})'
+                ))
+            if regressions:
+                raise CommandError(
+                    f"Регрессий: {len(regressions)} (порог {options['threshold']:.0%}, база {options['baseline']})"
+                )
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базы нет'))
+        if failed:
+            raise CommandError(f"Сценарии завершились с ошибкой: {', '.join(failed)}")
+
+    # --- Подготовка ----------------------------------------------------------------
+
+    def _prepare(self, options):
+        if options['month']:
+            try:
+                year, month = (int(part) for part in options['month'].split('-'))
+                date(year, month, 1)
+            except ValueError:
+                raise CommandError('--month: ожидается ГГГГ-ММ')
+        else:
+            last = Timesheet.objects.aggregate(last=Max('date'))['last']
+            if last is None:
+                raise CommandError('В БД нет табелей: сначала запустите generate_load_data')
+            year, month = last.year, last.month
+        self.year, self.month = year, month
+        self.month_start = date(year, month, 1)
+        self.month_end = date(year, month, calendar.monthrange(year, month)[1])
+
+        masters = User.objects.filter(role='master', is_itr_master=False)
+        if options['master']:
+            self.master = masters.filter(username=options['master']).first()
+        else:
+            self.master = masters.annotate(
+                staff=Count('managed_employees', filter=Q(managed_employees__is_active=True))
+            ).order_by('-staff', 'id').first()
+        if self.master is None:
+            raise CommandError('Мастер для замеров не найден')
+
+        planners = User.objects.filter(role='planner')
+        if options['planner']:
+            self.planner = planners.filter(username=options['planner']).first()
+        else:
+            self.planner = planners.annotate(masters=Count('allowed_masters')).order_by('-masters', 'id').first()
+        if self.planner is None:
+            raise CommandError('Плановик для замеров не найден')
+
+        self.employee = Employee.objects.filter(master=self.master, is_active=True).order_by('id').first()
+        month_rows = Timesheet.objects.filter(date__range=(self.month_start, self.month_end))
+        self.rows = {
+            'master_month': month_rows.filter(master=self.master).count(),
+            'planner_month': month_rows.filter(master__in=self.planner.allowed_masters.all()).count(),
+            'month': month_rows.count(),
+            'total': Timesheet.objects.count() + ItrTimesheet.objects.count(),
+        }
+        self.staff_dir = None
+        self.master_client = self._client(self.master)
+        self.planner_client = self._client(self.planner)
+
+    def _client(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def _meta(self, options):
+        return {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'db_vendor': connection.vendor,
+            'month': f'{self.year}-{self.month:02d}',
+            'master': self.master.username,
+            'planner': self.planner.username,
+            'employees': Employee.objects.filter(is_active=True).count(),
+            'timesheet_rows': self.rows['total'],
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'cold_cache': options['cold_cache'],
+        }
+
+    # --- Запуск сценариев ----------------------------------------------------------
+
+    def _run(self, name):
+        """
+        Прогрев, замер времени и запросов по итерациям, затем отдельная
+        итерация под tracemalloc: трассировка памяти замедляет код и не
+        должна попадать в задержки
+        """
+        scenario = getattr(self, f'_scenario_{name}')
+        for _ in range(self.warmup):
+            self._iteration(name, scenario)
+
+        timings, profiles, rows = [], [], 0
+        for _ in range(self.iterations):
+            elapsed, profile, rows = self._iteration(name, scenario)
+            timings.append(elapsed)
+            profiles.append(profile)
+
+        tracemalloc.start()
+        try:
+            self._iteration(name, scenario)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        p50 = statistics.median(timings)
+        return {
+            'iterations': len(timings),
+            'p50_ms': round(p50 * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 2),
+            'max_ms': round(max(timings) * 1000, 2),
+            'queries': int(statistics.median(p.queries for p in profiles)),
+            'db_ms': round(statistics.median(p.db_time for p in profiles) * 1000, 2),
+            'peak_kib': round(peak / 1024, 1),
+            'rows': rows,
+            'rows_per_s': round(rows / p50, 1) if p50 > 0 else None,
+        }
+
+    def _iteration(self, name, scenario):
+        """Одна итерация: (время, профиль запросов, обработанные строки)"""
+        if self.cold_cache:
+            cache.clear()
+        # Счетчик SQL из профилирования запросов; время шаблонов учитывает
+        # профиль LoggingMiddleware, поэтому здесь только запросы и время БД
+        profile = RequestProfile()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(profile))
+            if name in MUTATING:
+                try:
+                    with transaction.atomic():
+                        started = time.perf_counter()
+                        rows = scenario()
+                        elapsed = time.perf_counter() - started
+                        raise RollbackIteration
+                except RollbackIteration:
+                    pass
+            else:
+                started = time.perf_counter()
+                rows = scenario()
+                elapsed = time.perf_counter() - started
+        return elapsed, profile, rows
+
+    def _report(self, name, result):
+        if 'error' in result:
+            self.stdout.write(self.style.ERROR(f"  {name}: {result['error']}"))
+            return
+        self.stdout.write(
+            f"  {name}: p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, "
+            f"запросов {result['queries']} ({result['db_ms']} мс), память {result['peak_kib']} КиБ, "
+            f"{result['rows_per_s']} строк/с"
+        )
+
+    def _check(self, response, label):
+        if response.status_code != 200:
+            raise CommandError(f'{label}: HTTP {response.status_code}')
+        return response
+
+    # --- Сценарии: возвращают число обработанных строк -----------------------------
+
+    def _month_params(self, **extra):
+        return {'year': self.year, 'month': self.month, **extra}
+
+    def _scenario_grid_master(self):
+        self._check(self.master_client.get(reverse('timesheet:monthly_table'), self._month_params()), 'grid_master')
+        return self.rows['master_month']
+
+    def _scenario_grid_planner(self):
+        self._check(self.planner_client.get(reverse('timesheet:monthly_table'), self._month_params()), 'grid_planner')
+        return self.rows['planner_month']
+
+    def _scenario_print(self):
+        self._check(self.planner_client.get(
+            reverse('timesheet:print_monthly_table'), self._month_params(master=self.master.id)
+        ), 'print')
+        return self.rows['master_month']
+
+    def _scenario_statistics(self):
+        self._check(self.planner_client.get(reverse('timesheet:get_statistics'), self._month_params()), 'statistics')
+        return self.rows['planner_month']
+
+    def _scenario_submit_month(self):
+        url = reverse('timesheet:submit_month') + f'?year={self.year}&month={self.month}'
+        self._check(self.master_client.post(url), 'submit_month')
+        return self.rows['master_month']
+
+    def _scenario_fill_range(self):
+        if self.employee is None:
+            raise CommandError('fill_range: у мастера нет сотрудников')
+        self._check(self.master_client.post(reverse('timesheet:fill_range'), {
+            'employee_id': self.employee.id, 'date_from': self.month_start.isoformat(),
+            'date_to': self.month_end.isoformat(), 'value': '8',
+        }), 'fill_range')
+        return self.month_end.day
+
+    def _scenario_export(self):
+        response = self._check(self.planner_client.post(reverse('timesheet:export'), {
+            'start_date': self.month_start.isoformat(), 'end_date': self.month_end.isoformat(), 'status': 'all',
+        }), 'export')
+        return max(0, response.content.count(b'\n') - 1)
+
+    def _scenario_staff_import(self):
+        if self.staff_dir is None:
+            self.staff_dir = Path(tempfile.mkdtemp(prefix='bench_'))
+            self._staff_file, self._staff_rows = self._write_staff_file(self.staff_dir / 'staff.csv')
+        call_command(
+            'import_timesheet_staff', str(self._staff_file),
+            year=self.year, month=self.month, stdout=StringIO(),
+        )
+        return self._staff_rows
+
+    def _write_staff_file(self, path):
+        """CSV в формате файла табеля из сотрудников мастеров плановика"""
+        employees = Employee.objects.filter(
+            is_active=True, master__in=self.planner.allowed_masters.all()
+        ).select_related('master', 'department_own', 'user')
+        rows = 0
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Табельный', 'ФИО', 'Отдел', 'Должность', 'Мастер'])
+            for emp in employees.iterator():
+                writer.writerow([
+                    emp.employee_id, emp.full_name, emp.department.name if emp.department else '',
+                    emp.position, emp.master.get_full_name(),
+                ])
+                rows += 1
+        return path, rows
+
+    def _scenario_backup(self):
+        with tempfile.TemporaryDirectory(prefix='bench_backup_') as dest_dir:
+            call_command('backup_db', dest_dir=dest_dir, keep=1, stdout=StringIO())
+        return self.rows['total']
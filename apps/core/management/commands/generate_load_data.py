@@ -0,0 +1,430 @@
+import calendar
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from operator import itemgetter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.timesheet.models import Holiday, ItrTimesheet, Timesheet, WorkdaySwap
+from apps.timesheet.utils import bump_calendar_cache_version
+from apps.timesheet.web_views import generate_default_table, get_foundry_day_value, get_ic_day_value
+from apps.users.models import Department, Employee, EmployeeAssignment, User
+from apps.users.utils import bump_autocomplete_cache_version
+
+ABSENCE_CODES = (('О', 14), ('Б', 5), ('К', 3), ('А', 1))
+LOAD_CACHE_KIB = 256 * 1024
+TIMESHEET_COLUMNS = (
+    "date", "employee_id", "master_id", "value", "status", "created_at", "updated_at", "approved_by_id", "approved_at",
+)
+
+
+def month_range(end_year, end_month, months):
+    """Список (год, месяц) длиной months, заканчивающийся end_year-end_month"""
+    total = end_year * 12 + end_month - 1
+    return [((total - i) // 12, (total - i) % 12 + 1) for i in range(months - 1, -1, -1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерация синтетических данных производственного объема для нагрузочного тестирования: "
+        "отделы, мастера, сотрудники, назначения со сменой мастера, праздники, переносы и табели. "
+        "Данные воспроизводимы (--seed) и пишутся пачками через bulk_create"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--masters", type=int, default=100, help="Количество мастеров")
+        parser.add_argument("--employees-per-master", type=int, default=50)
+        parser.add_argument("--planners", type=int, default=5)
+        parser.add_argument("--departments", type=int, default=10)
+        parser.add_argument("--foundry-share", type=float, default=0.15, help="Доля литейных мастеров")
+        parser.add_argument("--ic-share", type=float, default=0.15, help="Доля мастеров ИЦ")
+        parser.add_argument("--itr-share", type=float, default=0.1,
+                            help="Доля мастеров ИТР (их сотрудники ведутся в табеле ИТР)")
+        parser.add_argument("--months", type=int, default=24, help="Месяцев истории табелей")
+        parser.add_argument("--end-month", type=str, default=None,
+                            help="Последний месяц истории ГГГГ-ММ (по умолчанию — текущий)")
+        parser.add_argument("--churn", type=float, default=0.03,
+                            help="Доля сотрудников, переходящих к другому мастеру каждый месяц")
+        parser.add_argument("--absence-rate", type=float, default=0.05,
+                            help="Вероятность начала отсутствия (отпуск, больничный) в рабочий день")
+        parser.add_argument("--holidays-per-year", type=int, default=14)
+        parser.add_argument("--swaps-per-year", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--prefix", type=str, default="load",
+                            help="Префикс логинов и кодов отделов сгенерированных данных")
+        parser.add_argument("--password", type=str, default=None,
+                            help="Пароль пользователей (по умолчанию вход по паролю отключен)")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--clear", action="store_true", default=False,
+                            help="Удалить ранее сгенерированные данные с этим префиксом и выйти")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"].strip().lower()
+        if not prefix or len(prefix) > 6 or not prefix.isalnum():
+            raise CommandError("--prefix: от 1 до 6 латинских букв или цифр")
+        self.prefix = prefix
+        self.batch_size = max(1, options["batch_size"])
+
+        if options["clear"]:
+            self._clear()
+            return
+        if User.objects.filter(username__startswith=f"{prefix}_").exists():
+            raise CommandError(f"Данные с префиксом {prefix} уже есть: запустите с --clear или смените --prefix")
+        for name in ("foundry_share", "ic_share", "itr_share", "churn", "absence_rate"):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f"--{name.replace('_', '-')} должен быть от 0 до 1")
+        if options["foundry_share"] + options["ic_share"] + options["itr_share"] > 1:
+            raise CommandError("Сумма долей литейных, ИЦ и ИТР мастеров больше 1")
+        if min(options["masters"], options["employees_per_master"], options["months"], options["departments"]) < 1:
+            raise CommandError("--masters, --employees-per-master, --months и --departments должны быть >= 1")
+
+        if options["end_month"]:
+            try:
+                end_year, end_month = (int(part) for part in options["end_month"].split("-"))
+                date(end_year, end_month, 1)
+            except ValueError:
+                raise CommandError("--end-month: ожидается ГГГГ-ММ")
+        else:
+            today = timezone.localdate()
+            end_year, end_month = today.year, today.month
+        months = month_range(end_year, end_month, options["months"])
+
+        self.rng = random.Random(options["seed"])
+        self.password = make_password(options["password"]) if options["password"] else make_password(None)
+        started = time.monotonic()
+        with transaction.atomic():
+            self._step("Календарь", lambda: self._calendar(months, options))
+        # Таблица автозаполнения зависит от праздников — считаем после их записи
+        self.default_tables = {(y, m): generate_default_table(y, m) for y, m in months}
+        with transaction.atomic():
+            self._step("Отделы и пользователи", lambda: self._people(months[0], options))
+            self._step("Назначения", lambda: self._assignments(months, options))
+        with self._deferred_indexes(Timesheet, ItrTimesheet):
+            self._step("Табели", lambda: self._timesheets(months, options))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {elapsed:.1f} с: мастеров {len(self.masters)}, сотрудников {len(self.employees)}, "
+            f"назначений {self.assignment_count}, табелей {self.timesheet_count} "
+            f"({self.timesheet_count / max(elapsed, 1e-9):.0f} строк/с)"
+        ))
+
+    def _step(self, title, func):
+        started = time.monotonic()
+        result = func()
+        self.stdout.write(f"  {title}: {result} ({time.monotonic() - started:.1f} с)")
+
+    # --- Календарь -----------------------------------------------------------------
+
+    def _calendar(self, months, options):
+        years = sorted({year for year, _ in months})
+        holidays, swaps = [], []
+        for year in years:
+            weekdays = [
+                date(year, 1, 1) + timedelta(days=i)
+                for i in range(366 if calendar.isleap(year) else 365)
+                if (date(year, 1, 1) + timedelta(days=i)).weekday() < 5
+            ]
+            for day in self.rng.sample(weekdays, min(options["holidays_per_year"], len(weekdays))):
+                holidays.append(Holiday(date=day, name="Праздник (синт.)", type="holiday"))
+                eve = day - timedelta(days=1)
+                if eve.weekday() < 5:
+                    holidays.append(Holiday(date=eve, name="Предпраздничный (синт.)", type="preholiday"))
+            # Перенос: суббота перед понедельником становится рабочей, понедельник — выходным
+            mondays = [d for d in weekdays if d.weekday() == 0]
+            for monday in self.rng.sample(mondays, min(options["swaps_per_year"], len(mondays))):
+                swaps.append(WorkdaySwap(date_a=monday - timedelta(days=2), date_b=monday))
+        # Даты могут совпасть с уже загруженным календарем — такие пропускаем
+        Holiday.objects.bulk_create(holidays, batch_size=self.batch_size, ignore_conflicts=True)
+        WorkdaySwap.objects.bulk_create(swaps, batch_size=self.batch_size, ignore_conflicts=True)
+        bump_calendar_cache_version()
+        return f"праздников {len(holidays)}, переносов {len(swaps)}"
+
+    # --- Люди ----------------------------------------------------------------------
+
+    def _people(self, first_month, options):
+        prefix, rng = self.prefix, self.rng
+        departments = Department.objects.bulk_create([
+            Department(name=f"Цех {i + 1} ({prefix})", code=f"{prefix}{i + 1:03d}")
+            for i in range(options["departments"])
+        ], batch_size=self.batch_size)
+        Department.rebuild_paths()
+
+        n = options["masters"]
+        kinds = (
+            ["foundry"] * round(n * options["foundry_share"])
+            + ["ic"] * round(n * options["ic_share"])
+            + ["itr"] * round(n * options["itr_share"])
+        )[:n]
+        kinds += ["regular"] * (n - len(kinds))
+        rng.shuffle(kinds)
+        anchor = date(*first_month, 1)
+        masters = []
+        for i, kind in enumerate(kinds):
+            masters.append(User(
+                username=f"{prefix}_m{i + 1}", employee_id=f"{prefix.upper()}-M{i + 1}", role="master",
+                password=self.password, last_name=f"Мастер{i + 1}", first_name="Тест",
+                department=departments[i % len(departments)],
+                is_foundry_master=kind == "foundry",
+                foundry_anchor_date=anchor + timedelta(days=rng.randrange(17)) if kind == "foundry" else None,
+                is_ic_master=kind == "ic",
+                ic_anchor_date=anchor + timedelta(days=rng.randrange(14)) if kind == "ic" else None,
+                is_itr_master=kind == "itr",
+            ))
+        self._fill_search_text(masters)
+        self.masters = User.objects.bulk_create(masters, batch_size=self.batch_size)
+        self.master_kinds = {m.id: kind for m, kind in zip(self.masters, kinds)}
+
+        planners = self._fill_search_text([
+            User(username=f"{prefix}_p{i + 1}", employee_id=f"{prefix.upper()}-P{i + 1}", role="planner",
+                 password=self.password, last_name=f"Плановик{i + 1}", first_name="Тест",
+                 department=departments[i % len(departments)])
+            for i in range(options["planners"])
+        ])
+        planners = User.objects.bulk_create(planners, batch_size=self.batch_size)
+        # Каждому плановику — свои мастера, как в цехах
+        through = User.allowed_masters.through
+        links = [
+            through(from_user_id=planner.id, to_user_id=master.id)
+            for p, planner in enumerate(planners)
+            for m, master in enumerate(self.masters) if m % len(planners) == p
+        ]
+        through.objects.bulk_create(links, batch_size=self.batch_size)
+
+        employees = []
+        hire_floor = anchor - timedelta(days=3650)
+        for m, master in enumerate(self.masters):
+            kind = self.master_kinds[master.id]
+            for e in range(options["employees_per_master"]):
+                number = m * options["employees_per_master"] + e + 1
+                # Часть сотрудников принята в течение периода
+                if rng.random() < 0.1:
+                    hire_date = anchor + timedelta(days=rng.randrange(max(1, 30 * options["months"])))
+                else:
+                    hire_date = hire_floor + timedelta(days=rng.randrange(3000))
+                employees.append(Employee(
+                    master=master, hire_date=hire_date,
+                    last_name=f"Работник{number}", first_name="Тест",
+                    employee_id_own=f"{prefix.upper()}-{number}", position_own="Рабочий",
+                    department_own=master.department,
+                    is_foundry=kind == "foundry",
+                    is_itr_employee=kind == "itr",
+                    ic_schedule_override=rng.choice(("inherit", "inherit", "inherit", "opposite"))
+                    if kind == "ic" else "inherit",
+                ))
+        self._fill_search_text(employees)
+        self.employees = Employee.objects.bulk_create(employees, batch_size=self.batch_size)
+        bump_autocomplete_cache_version()
+        return f"отделов {len(departments)}, мастеров {len(self.masters)}, плановиков {len(planners)}, " \
+               f"сотрудников {len(self.employees)}"
+
+    @staticmethod
+    def _fill_search_text(objs):
+        # bulk_create не вызывает save(), строку поиска заполняем сами
+        for obj in objs:
+            obj.search_text = obj.get_search_text()
+        return objs
+
+    # --- Назначения ----------------------------------------------------------------
+
+    def _assignments(self, months, options):
+        """
+        Назначения с перемещениями между мастерами того же вида на границах месяцев.
+
+        self.periods: сотрудник -> [(начало, конец или None, мастер)] для генерации табелей.
+        """
+        rng = self.rng
+        by_kind = {}
+        for master in self.masters:
+            by_kind.setdefault(self.master_kinds[master.id], []).append(master)
+        start = date(*months[0], 1)
+        current = {emp.id: emp.master for emp in self.employees}
+        opened = {emp.id: start for emp in self.employees}
+        self.periods = {emp.id: [] for emp in self.employees}
+        moved = []
+        for year, month in months[1:]:
+            first = date(year, month, 1)
+            for emp in self.employees:
+                if rng.random() >= options["churn"]:
+                    continue
+                candidates = by_kind[self.master_kinds[current[emp.id].id]]
+                if len(candidates) < 2:
+                    continue
+                new_master = rng.choice(candidates)
+                if new_master.id == current[emp.id].id:
+                    continue
+                self.periods[emp.id].append((opened[emp.id], first - timedelta(days=1), current[emp.id]))
+                current[emp.id], opened[emp.id] = new_master, first
+                moved.append(emp)
+        assignments = []
+        for emp in self.employees:
+            self.periods[emp.id].append((opened[emp.id], None, current[emp.id]))
+            for period_start, period_end, master in self.periods[emp.id]:
+                assignments.append(EmployeeAssignment(
+                    employee_id=emp.id, master_id=master.id, start_date=period_start, end_date=period_end
+                ))
+            emp.master = current[emp.id]
+        EmployeeAssignment.objects.bulk_create(assignments, batch_size=self.batch_size)
+        Employee.objects.bulk_update({emp.id: emp for emp in moved}.values(), ["master"], batch_size=self.batch_size)
+        self.assignment_count = len(assignments)
+        return f"назначений {len(assignments)}, переводов {len(moved)}"
+
+    # --- Табели --------------------------------------------------------------------
+
+    def _month_pattern(self, master, year, month):
+        """Значения дней месяца по графику мастера (без отсутствий)"""
+        key = (master.id, year, month)
+        if key in self._patterns:
+            return self._patterns[key]
+        default_table = self.default_tables[(year, month)]
+        kind = self.master_kinds[master.id]
+        days = calendar.monthrange(year, month)[1]
+        values = []
+        for day in range(1, days + 1):
+            day_date = date(year, month, day)
+            holiday_value = default_table.get(day, "")
+            if kind == "foundry":
+                value = "В" if holiday_value == "В" and day_date.weekday() < 5 else \
+                    get_foundry_day_value(day_date, master.foundry_anchor_date)
+            elif kind == "ic":
+                value = get_ic_day_value(day_date, master.ic_anchor_date, holiday_value, False, None)
+            else:
+                value = holiday_value or "8"
+            values.append(value)
+        self._patterns[key] = values
+        return values
+
+    @contextmanager
+    def _deferred_indexes(self, *models):
+        """
+        На время загрузки убрать неуникальные индексы SQLite и построить их
+        заново в конце: сортировка готовых данных дешевле, чем поддержание
+        семи B-деревьев на каждую вставленную строку. Уникальные индексы
+        остаются — они защищают данные уже при загрузке
+        """
+        if connection.vendor != "sqlite":
+            yield
+            return
+        tables = [model._meta.db_table for model in models]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                f"AND sql NOT LIKE 'CREATE UNIQUE%%' AND tbl_name IN ({', '.join(['%s'] * len(tables))})",
+                tables,
+            )
+            indexes = cursor.fetchall()
+            # Кэш страниц и сортировка индексов в памяти только на время загрузки
+            saved = {}
+            for name, value in (("cache_size", -LOAD_CACHE_KIB), ("temp_store", "MEMORY")):
+                cursor.execute(f"PRAGMA {name}")
+                saved[name] = cursor.fetchone()[0]
+                cursor.execute(f"PRAGMA {name} = {value}")
+            for name, _ in indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+        try:
+            yield
+        finally:
+            started = time.monotonic()
+            with transaction.atomic(), connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+            with connection.cursor() as cursor:
+                for name, value in saved.items():
+                    cursor.execute(f"PRAGMA {name} = {int(value)}")
+            self.stdout.write(f"  Индексы табелей: {len(indexes)} ({time.monotonic() - started:.1f} с)")
+
+    def _insert_sql(self, model):
+        """
+        INSERT для табелей: bulk_create на SQLite ограничен 999 параметрами
+        на запрос и создает объект модели на каждую строку, поэтому миллионы
+        строк пишем через executemany кортежами
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ", ".join(connection.ops.quote_name(name) for name in TIMESHEET_COLUMNS)
+        return f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(TIMESHEET_COLUMNS))})"
+
+    def _timesheets(self, months, options):
+        rng = self.rng
+        self._patterns = {}
+        self.timesheet_count = 0
+        last_month = months[-1]
+        # Значения готовим сразу в формате БД, как это сделал бы ORM
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        approver = self.masters[0].id
+        absence_codes = [code for code, _ in ABSENCE_CODES]
+        absence_weights = [weight for _, weight in ABSENCE_CODES]
+        absence_chance = options["absence_rate"] / 10
+        statements = {model: self._insert_sql(model) for model in (Timesheet, ItrTimesheet)}
+        absences = {}
+
+        # Месяц за месяцем: строки месяца сортируются по (дата, сотрудник) —
+        # в порядке индексов табеля, так вставка не прыгает по B-дереву
+        for year, month in months:
+            month_start = date(year, month, 1)
+            month_end = date(year, month, calendar.monthrange(year, month)[1])
+            # Прошлые месяцы утверждены; последний месяц в работе — у каждого мастера свой статус
+            if (year, month) == last_month:
+                statuses = {m.id: rng.choice(("draft", "draft", "submitted")) for m in self.masters}
+            else:
+                statuses = dict.fromkeys((m.id for m in self.masters), "approved")
+            buffers = {Timesheet: [], ItrTimesheet: []}
+            for emp in self.employees:
+                rows = buffers[ItrTimesheet if emp.is_itr_employee else Timesheet]
+                absence_left, absence_code = absences.get(emp.id, (0, None))
+                for period_start, period_end, master in self.periods[emp.id]:
+                    first_day = max(period_start, emp.hire_date or period_start)
+                    if month_end < first_day or (period_end and month_start > period_end):
+                        continue
+                    status = statuses[master.id]
+                    approved_by, approved_at = (approver, now) if status == "approved" else (None, None)
+                    for day, value in enumerate(self._month_pattern(master, year, month), start=1):
+                        day_date = month_start.replace(day=day)
+                        if day_date < first_day or (period_end and day_date > period_end):
+                            continue
+                        if absence_left:
+                            absence_left -= 1
+                            value = absence_code
+                        elif value != "В" and rng.random() < absence_chance:
+                            absence_code = rng.choices(absence_codes, absence_weights)[0]
+                            absence_left = rng.randint(1, 14 if absence_code == "О" else 5) - 1
+                            value = absence_code
+                        rows.append((day_date.isoformat(), emp.id, master.id, value, status,
+                                     now, now, approved_by, approved_at))
+                absences[emp.id] = (absence_left, absence_code)
+            with transaction.atomic(), connection.cursor() as cursor:
+                for model, rows in buffers.items():
+                    rows.sort(key=itemgetter(0, 1))
+                    for start in range(0, len(rows), self.batch_size):
+                        cursor.executemany(statements[model], rows[start:start + self.batch_size])
+                    self.timesheet_count += len(rows)
+        return f"табелей {self.timesheet_count}"
+
+    # --- Очистка -------------------------------------------------------------------
+
+    def _clear(self):
+        prefix = self.prefix
+        employees = Employee.objects.filter(employee_id_own__startswith=f"{prefix.upper()}-", user__isnull=True)
+        with transaction.atomic():
+            counts = {
+                "табелей": Timesheet.objects.filter(employee__in=employees).delete()[0],
+                "табелей ИТР": ItrTimesheet.objects.filter(employee__in=employees).delete()[0],
+                "назначений": EmployeeAssignment.objects.filter(employee__in=employees).delete()[0],
+            }
+            counts["сотрудников"] = employees.delete()[0]
+            counts["пользователей"] = User.objects.filter(
+                username__startswith=f"{prefix}_", is_superuser=False
+            ).delete()[0]
+            counts["отделов"] = Department.objects.filter(code__regex=rf"^{prefix}\d{{3}}$").delete()[0]
+            counts["праздников"] = Holiday.objects.filter(name__endswith="(синт.)").delete()[0]
+        bump_calendar_cache_version()
+        bump_autocomplete_cache_version()
+        if connection.vendor == "sqlite":
+            self.stdout.write("Место в файле БД освободится после VACUUM")
+        self.stdout.write(self.style.SUCCESS(
+            "Удалено: " + ", ".join(f"{name} {count}" for name, count in counts.items())
+        ))
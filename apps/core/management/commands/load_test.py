@@ -0,0 +1,381 @@
+import calendar
+import http.cookiejar
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Q
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.timesheet.models import Timesheet
+from apps.users.models import Employee, User
+
+# Границы корзин гистограммы задержек, мс
+HISTOGRAM_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Смесь действий: (endpoint, вес)
+MASTER_MIX = (('quick_edit', 60), ('fill_range', 15), ('monthly_table', 20), ('submit_month', 5))
+PLANNER_MIX = (('monthly_table', 40), ('print_monthly_table', 60))
+OUTCOMES = ('ok', 'rejected', 'locked', 'overloaded', 'error')
+
+
+def classify(status_code, body):
+    """
+    Исход запроса: ok, rejected (4xx — отказ по правилам, например сданный
+    табель), overloaded (503 очереди записи), locked (database is locked),
+    error (прочие 5xx)
+    """
+    if b'database is locked' in body:
+        return 'locked'
+    if status_code < 400:
+        return 'ok'
+    if status_code == 503:
+        return 'overloaded'
+    if status_code < 500:
+        return 'rejected'
+    return 'error'
+
+
+class LoadStats:
+    """Задержки и исходы по endpoint (потокобезопасно)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.outcomes = {}
+
+    def record(self, endpoint, elapsed, outcome):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            counts = self.outcomes.setdefault(endpoint, dict.fromkeys(OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def summary(self, wall_time):
+        with self._lock:
+            endpoints = {}
+            for endpoint, latencies in sorted(self.latencies.items()):
+                endpoints[endpoint] = self._endpoint_summary(latencies, self.outcomes[endpoint], wall_time)
+            total = sum(len(latencies) for latencies in self.latencies.values())
+            totals = {
+                outcome: sum(counts[outcome] for counts in self.outcomes.values()) for outcome in OUTCOMES
+            }
+        return {
+            'wall_time_s': round(wall_time, 2),
+            'requests': total,
+            'throughput_rps': round(totals['ok'] / wall_time, 2) if wall_time else 0.0,
+            'error_rate': round((total - totals['ok'] - totals['rejected']) / total, 4) if total else 0.0,
+            'outcomes': totals,
+            'endpoints': endpoints,
+        }
+
+    @staticmethod
+    def _endpoint_summary(latencies, outcomes, wall_time):
+        ordered = sorted(latencies)
+        histogram = {}
+        position = 0
+        for bound in HISTOGRAM_BUCKETS:
+            while position < len(ordered) and ordered[position] * 1000 <= bound:
+                position += 1
+            histogram[f'le_{bound}ms'] = position
+        histogram['le_inf'] = len(ordered)
+        failed = outcomes['locked'] + outcomes['overloaded'] + outcomes['error']
+        return {
+            'requests': len(ordered),
+            'throughput_rps': round(outcomes['ok'] / wall_time, 2) if wall_time else 0.0,
+            'error_rate': round(failed / len(ordered), 4),
+            'outcomes': outcomes,
+            'p50_ms': round(statistics.median(ordered) * 1000, 1),
+            'p95_ms': round(ordered[max(0, -(-len(ordered) * 95 // 100) - 1)] * 1000, 1),
+            'p99_ms': round(ordered[max(0, -(-len(ordered) * 99 // 100) - 1)] * 1000, 1),
+            'max_ms': round(ordered[-1] * 1000, 1),
+            'histogram': histogram,
+        }
+
+
+class InProcessSession:
+    """Пользователь через тестовый клиент Django (WSGI в этом же процессе)"""
+
+    def __init__(self, user):
+        # Сигнал об исключении представления получают клиенты всех потоков:
+        # не пробрасываем чужие исключения, ошибка видна по ответу 500
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+
+    def request(self, method, path, params):
+        if method == 'POST':
+            response = self.client.post(path, params)
+        else:
+            response = self.client.get(path, params)
+        return response.status_code, response.content
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpSession:
+    """Пользователь живого сервера: вход через форму, сессия и CSRF в cookies"""
+
+    def __init__(self, base_url, username, password, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        login_url = self.base_url + settings.LOGIN_URL
+        self.opener.open(login_url, timeout=timeout).read()
+        status, _ = self._send('POST', login_url, {'username': username, 'password': password})
+        if 'sessionid' not in self._cookie_values():
+            raise CommandError(f'Не удалось войти как {username} (HTTP {status})')
+
+    def _cookie_values(self):
+        return {cookie.name: cookie.value for cookie in self.cookies}
+
+    def _send(self, method, url, params):
+        data = None
+        headers = {}
+        if method == 'POST':
+            csrf = self._cookie_values().get('csrftoken', '')
+            data = urllib.parse.urlencode({**params, 'csrfmiddlewaretoken': csrf}).encode()
+            headers = {'X-CSRFToken': csrf, 'Referer': url}
+        elif params:
+            url = f'{url}?{urllib.parse.urlencode(params)}'
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            return 599, str(e).encode()
+
+    def request(self, method, path, params):
+        return self._send(method, self.base_url + path, params)
+
+    def close(self):
+        self.opener.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон конца месяца: N мастеров и M плановиков в пуле потоков "
+        "редактируют, заполняют диапазоны, сдают месяц, смотрят и печатают табели. "
+        "Считает пропускную способность, долю ошибок (в т.ч. database is locked) и "
+        "гистограммы задержек по endpoint. Изменяет данные — запускайте на копии БД"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--masters', type=int, default=10, help='Одновременных мастеров')
+        parser.add_argument('--planners', type=int, default=3, help='Одновременных плановиков')
+        parser.add_argument('--duration', type=float, default=30.0, help='Длительность прогона, с')
+        parser.add_argument('--think-time', type=float, default=0.5,
+                            help='Средняя пауза пользователя между действиями, с (экспоненциальная)')
+        parser.add_argument('--month', type=str, default=None,
+                            help='Месяц ГГГГ-ММ (по умолчанию — последний месяц с табелями)')
+        parser.add_argument('--url', type=str, default=None,
+                            help='Адрес живого сервера (http://host:port); по умолчанию — тестовый клиент в процессе')
+        parser.add_argument('--password', type=str, default=None,
+                            help='Пароль пользователей для --url (generate_load_data --password)')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Таймаут HTTP-запроса для --url, с')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', type=str, default=None, help='Файл результатов JSON')
+
+    def handle(self, *args, **options):
+        if options['masters'] < 0 or options['planners'] < 0 or options['masters'] + options['planners'] < 1:
+            raise CommandError('Нужен хотя бы один мастер или плановик')
+        if options['duration'] <= 0 or options['think_time'] < 0:
+            raise CommandError('--duration должно быть > 0, --think-time >= 0')
+        if options['url'] and not options['password']:
+            raise CommandError('Для --url нужен --password')
+
+        self._prepare(options)
+        self.options = options
+        self.stats = LoadStats()
+        self.deadline = None
+
+        users = [('master', m) for m in self.masters] + [('planner', p) for p in self.planners]
+        mode = options['url'] or 'тестовый клиент'
+        self.stdout.write(
+            f'Прогон {options["duration"]:.0f} с: мастеров {len(self.masters)}, плановиков {len(self.planners)}, '
+            f'месяц {self.year}-{self.month:02d}, цель: {mode}'
+        )
+        # Журналы запросов на время прогона — только ошибки: отказы 4xx
+        # (сданный табель) при конкурентной правке ожидаемы и попадают в отчет
+        loggers = [logging.getLogger(name) for name in ('apps', 'django.request')]
+        levels = [logger.level for logger in loggers]
+        for logger in loggers:
+            logger.setLevel(logging.ERROR)
+        try:
+            wall_time = self._run(users)
+        finally:
+            for logger, level in zip(loggers, levels):
+                logger.setLevel(level)
+
+        summary = self.stats.summary(wall_time)
+        summary['meta'] = {
+            'created': timezone.now().isoformat(),
+            'target': mode,
+            'masters': len(self.masters),
+            'planners': len(self.planners),
+            'month': f'{self.year}-{self.month:02d}',
+            'think_time': options['think_time'],
+            'seed': options['seed'],
+            'write_queue': bool((getattr(settings, 'SQLITE_WRITE_QUEUE', None) or {}).get('ENABLED')),
+        }
+        self._report(summary)
+        if options['output']:
+            output = Path(options['output'])
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+            self.stdout.write(f'Результаты: {output}')
+
+    def _run(self, users):
+        """Прогон пользователей в пуле потоков до истечения --duration; возвращает фактическое время"""
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            sessions = [self._session(user) for _, user in users]
+            started = time.monotonic()
+            self.deadline = started + self.options['duration']
+            with ThreadPoolExecutor(max_workers=len(users), thread_name_prefix='load') as pool:
+                futures = [
+                    pool.submit(self._worker, role, user, session, random.Random(self.options['seed'] + i))
+                    for i, ((role, user), session) in enumerate(zip(users, sessions))
+                ]
+                for future in futures:
+                    future.result()
+            return time.monotonic() - started
+
+    def _prepare(self, options):
+        if options['month']:
+            try:
+                year, month = (int(part) for part in options['month'].split('-'))
+                date(year, month, 1)
+            except ValueError:
+                raise CommandError('--month: ожидается ГГГГ-ММ')
+        else:
+            last = Timesheet.objects.aggregate(last=Max('date'))['last']
+            if last is None:
+                raise CommandError('В БД нет табелей: сначала запустите generate_load_data')
+            year, month = last.year, last.month
+        self.year, self.month = year, month
+        self.month_start = date(year, month, 1)
+        self.month_end = date(year, month, calendar.monthrange(year, month)[1])
+
+        self.masters = list(
+            User.objects.filter(role='master', is_active=True, is_itr_master=False,
+                                managed_employees__is_active=True)
+            .distinct().order_by('id')[:options['masters']]
+        )
+        self.planners = list(
+            User.objects.filter(role='planner', is_active=True, allowed_masters__isnull=False)
+            .distinct().order_by('id')[:options['planners']]
+        )
+        if len(self.masters) < options['masters'] or len(self.planners) < options['planners']:
+            raise CommandError(
+                f'В БД мастеров с сотрудниками: {len(self.masters)}, плановиков с мастерами: {len(self.planners)}'
+            )
+        # Сотрудники, назначенные мастеру в выбранном месяце
+        self.staff = {}
+        for master in self.masters:
+            self.staff[master.id] = list(
+                Employee.objects.filter(is_active=True, is_itr_employee=False).filter(
+                    Q(master=master) | Q(
+                        assignments__master=master, assignments__start_date__lte=self.month_end,
+                    ) & (Q(assignments__end_date__isnull=True) | Q(assignments__end_date__gte=self.month_start))
+                ).distinct().values_list('id', flat=True)
+            )
+        empty = [master.username for master in self.masters if not self.staff[master.id]]
+        if empty:
+            raise CommandError(f"Нет сотрудников в {year}-{month:02d} у мастеров: {', '.join(empty)}")
+        self.planner_masters = {
+            planner.id: list(planner.allowed_masters.values_list('id', flat=True)) for planner in self.planners
+        }
+
+    def _session(self, user):
+        if self.options['url']:
+            return HttpSession(self.options['url'], user.username, self.options['password'], self.options['timeout'])
+        return InProcessSession(user)
+
+    # --- Действия ------------------------------------------------------------------
+
+    def _worker(self, role, user, session, rng):
+        mix = MASTER_MIX if role == 'master' else PLANNER_MIX
+        endpoints = [endpoint for endpoint, _ in mix]
+        weights = [weight for _, weight in mix]
+        try:
+            while time.monotonic() < self.deadline:
+                endpoint = rng.choices(endpoints, weights)[0]
+                method, path, params = getattr(self, f'_{endpoint}')(user, rng)
+                started = time.monotonic()
+                status_code, body = session.request(method, path, params)
+                self.stats.record(endpoint, time.monotonic() - started, classify(status_code, body))
+                if self.options['think_time']:
+                    time.sleep(min(rng.expovariate(1 / self.options['think_time']),
+                                   max(0.0, self.deadline - time.monotonic())))
+        finally:
+            session.close()
+
+    def _random_day(self, rng):
+        return self.month_start + timedelta(days=rng.randrange(self.month_end.day))
+
+    def _quick_edit(self, user, rng):
+        return 'POST', reverse('timesheet:quick_edit'), {
+            'employee_id': rng.choice(self.staff[user.id]),
+            'date': self._random_day(rng).isoformat(),
+            'value': rng.choice(('8', '8', '7', 'Б', 'О')),
+        }
+
+    def _fill_range(self, user, rng):
+        date_from = self._random_day(rng)
+        date_to = min(self.month_end, date_from + timedelta(days=rng.randint(1, 7)))
+        return 'POST', reverse('timesheet:fill_range'), {
+            'employee_id': rng.choice(self.staff[user.id]),
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'value': '8',
+        }
+
+    def _submit_month(self, user, rng):
+        return 'POST', reverse('timesheet:submit_month') + f'?year={self.year}&month={self.month}', {}
+
+    def _monthly_table(self, user, rng):
+        params = {'year': self.year, 'month': self.month}
+        if user.role == 'planner':
+            params['master'] = rng.choice(self.planner_masters[user.id])
+        return 'GET', reverse('timesheet:monthly_table'), params
+
+    def _print_monthly_table(self, user, rng):
+        return 'GET', reverse('timesheet:print_monthly_table'), {
+            'year': self.year, 'month': self.month, 'master': rng.choice(self.planner_masters[user.id]),
+        }
+
+    # --- Отчет ---------------------------------------------------------------------
+
+    def _report(self, summary):
+        outcomes = summary['outcomes']
+        self.stdout.write(
+            f"Запросов {summary['requests']} за {summary['wall_time_s']} с, "
+            f"успешных {summary['throughput_rps']} в с, доля ошибок {summary['error_rate']:.2%} "
+            f"(database is locked: {outcomes['locked']}, 503: {outcomes['overloaded']}, "
+            f"5xx: {outcomes['error']}, отказов 4xx: {outcomes['rejected']})"
+        )
+        for endpoint, data in summary['endpoints'].items():
+            self.stdout.write(
+                f"  {endpoint}: {data['requests']} запр., {data['throughput_rps']} в с, "
+                f"p50 {data['p50_ms']} мс, p95 {data['p95_ms']} мс, p99 {data['p99_ms']} мс, "
+                f"ошибок {data['error_rate']:.2%}, locked {data['outcomes']['locked']}"
+            )
+            self.stdout.write('    ' + ' '.join(
+                f"{bucket.replace('le_', '≤')}:{count}" for bucket, count in data['histogram'].items()
+            ))
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core.backups import check_free_space, database_size, snapshot_backup
+from apps.core.replica import get_replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        "Обновление снимка основной БД для реплики только для чтения (settings.READ_REPLICA). "
+        "Снимок копируется backup API в одной транзакции чтения (в режиме WAL запись не ждет) "
+        "и атомарно заменяет файл реплики; рядом с репликой нужно место еще на одну копию БД"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--every", type=int, default=0,
+                            help="Повторять каждые N секунд (0 — однократно)")
+
+    def handle(self, *args, **options):
+        alias = get_replica_alias()
+        if alias is None:
+            raise CommandError("Реплика не настроена: задайте DJANGO_SQLITE_REPLICA_PATH")
+        replica = settings.DATABASES[alias]
+        source = settings.DATABASES["default"]
+        if not (replica.get("ENGINE", "").endswith("sqlite3") and source.get("ENGINE", "").endswith("sqlite3")):
+            raise CommandError("Снимок поддерживается только для SQLite; реплику другой СУБД обновляет сервер")
+        src_path = Path(str(source["NAME"])).resolve()
+        dest_path = Path(str(replica["NAME"])).resolve()
+        if src_path == dest_path:
+            raise CommandError("Файл реплики совпадает с основной БД")
+
+        while True:
+            self._refresh(src_path, dest_path)
+            if options["every"] <= 0:
+                break
+            time.sleep(options["every"])
+
+    def _refresh(self, src_path, dest_path):
+        started = time.monotonic()
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest_path.with_name(dest_path.name + ".tmp")
+        try:
+            check_free_space(dest_path.parent, database_size(src_path))
+            snapshot_backup(src_path, tmp_path)
+            # Снимок в режиме rollback-журнала: читателям не нужны -wal/-shm рядом с файлом
+            conn = sqlite3.connect(str(tmp_path))
+            try:
+                conn.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                conn.close()
+            # Открытые соединения дочитывают старый файл, новые откроют свежий снимок
+            os.replace(tmp_path, dest_path)
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            raise CommandError(f"Не удалось обновить реплику: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Реплика обновлена: {dest_path} ({time.monotonic() - started:.2f} с)"
+        ))
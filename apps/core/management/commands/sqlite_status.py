@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from apps.core.db import read_sqlite_status
+
+
+def human_size(num):
+    for unit in ('Б', 'КиБ', 'МиБ', 'ГиБ'):
+        if abs(num) < 1024 or unit == 'ГиБ':
+            return f"{num:.0f} {unit}" if unit == 'Б' else f"{num:.1f} {unit}"
+        num /= 1024
+
+
+class Command(BaseCommand):
+    help = "Активные PRAGMA SQLite и размеры файлов БД и WAL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Алиас базы данных")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"База {options['database']} не SQLite ({connection.vendor})")
+        status = read_sqlite_status(connection)
+        rows = [
+            ("Файл", status['path']),
+            ("SQLite", status['sqlite_version']),
+            ("Размер БД", human_size(status['db_size'])),
+            ("Размер WAL", human_size(status['wal_size'])),
+        ]
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size',
+                     'temp_store', 'page_size', 'page_count', 'freelist_count', 'wal_autocheckpoint'):
+            rows.append((name, status[name]))
+        for label, value in rows:
+            self.stdout.write(f"{label + ':':<20}{value}")
+        if str(status['journal_mode']).lower() != 'wal':
+            self.stdout.write(self.style.WARNING("WAL не активен: читатели блокируются на время записи"))
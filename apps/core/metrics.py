@@ -0,0 +1,395 @@
+"""
+Метрики в формате Prometheus: задержки и число SQL-запросов по представлениям,
+попадания кеша, ошибки блокировки SQLite, очередь записи и бизнес-показатели.
+
+Каждый процесс (воркер gunicorn) копит счетчики в памяти и не чаще
+FLUSH_INTERVAL секунд сбрасывает их в свой файл в каталоге DIR
+(<pid>_<время старта>.json, атомарная замена). /metrics суммирует файлы
+всех процессов, поэтому значения не зависят от того, какой воркер ответил.
+Файл завершившегося процесса, не обновлявшийся дольше STALE_SECONDS,
+вливается в retired.json и удаляется, так что суммы счетчиков после остановки воркера не уменьшаются.
+
+Доступ к /metrics: токен TOKEN, адреса ALLOWED_IPS или администратор. По
+умолчанию список адресов пуст: за обратным прокси на том же хосте REMOTE_ADDR
+всех запросов равен 127.0.0.1, и разрешенный localhost открыл бы метрики всем.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+
+logger = logging.getLogger('apps')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'DIR': None,
+    'FLUSH_INTERVAL': 5.0,
+    'STALE_SECONDS': 86400,
+    'ALLOWED_IPS': (),
+    'TOKEN': '',
+    'BUSINESS_MONTHS': 2,
+    'BUSINESS_CACHE_SECONDS': 60,
+}
+
+RETIRED_FILE = 'retired.json'
+RETIRED_LOCK = 'retired.lock'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 500, 1000, 2500)
+
+HELP = {
+    'http_requests_total': ('counter', 'Обработанные HTTP-запросы'),
+    'http_request_duration_seconds': ('histogram', 'Время обработки запроса'),
+    'http_request_db_queries': ('histogram', 'Число SQL-запросов на HTTP-запрос'),
+    'http_request_db_seconds': ('histogram', 'Время в БД на HTTP-запрос'),
+    'http_request_db_write_seconds': ('histogram', 'Время изменяющих SQL-запросов на HTTP-запрос, включая ожидание блокировки'),
+    'sqlite_lock_errors_total': ('counter', 'Ошибки database is locked'),
+    'cache_requests_total': ('counter', 'Чтения кеша по результату (hit/miss)'),
+    'write_queue_depth': ('gauge', 'Заданий в очереди записи'),
+    'write_queue_jobs_total': ('counter', 'Задания очереди записи по исходу'),
+    'write_queue_wait_seconds_total': ('counter', 'Суммарное ожидание заданий в очереди записи'),
+    'timesheet_cells': ('gauge', 'Ячейки табеля по месяцу и статусу'),
+}
+
+
+def get_config():
+    return {**DEFAULTS, **(getattr(settings, 'METRICS', None) or {})}
+
+
+def get_metrics_dir():
+    config = get_config()
+    return Path(config['DIR'] or Path(settings.BASE_DIR) / 'logs' / 'metrics')
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы процесса (потокобезопасно)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.process_id = f'{os.getpid()}_{int(time.time() * 1000)}'
+        self._last_flush = time.monotonic()
+
+    def inc(self, name, labels, value=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            data = self.histograms.get(key)
+            if data is None:
+                data = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    data['counts'][i] += 1
+                    break
+            data['sum'] += value
+            data['count'] += 1
+
+    def snapshot(self):
+        """Состояние процесса для файла: списки [имя, метки, значение]"""
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [
+                [name, list(labels), {**data, 'counts': list(data['counts'])}]
+                for (name, labels), data in self.histograms.items()
+            ]
+        return {'counters': counters, 'histograms': histograms, 'gauges': _process_gauges()}
+
+    def flush(self):
+        directory = get_metrics_dir()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f'{self.process_id}.json'
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"Cannot write metrics file: {e}")
+        self._last_flush = time.monotonic()
+
+    def flush_if_used(self):
+        """Сброс при выходе: процессы без запросов (check, migrate) файла не оставляют"""
+        if self.counters or self.histograms:
+            self.flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= float(get_config()['FLUSH_INTERVAL']):
+            self.flush()
+
+
+def _process_gauges():
+    """Показатели процесса на момент сброса: очередь записи"""
+    from .write_queue import get_write_queue_metrics
+
+    queue = get_write_queue_metrics()
+    gauges = [['write_queue_depth', [], queue['depth']]]
+    for outcome in ('completed', 'failed', 'rejected', 'timeouts'):
+        gauges.append(['write_queue_jobs_total', [['outcome', outcome]], queue.get(outcome, 0)])
+    started = queue.get('completed', 0) + queue.get('failed', 0)
+    gauges.append(['write_queue_wait_seconds_total', [], queue.get('wait_avg_ms', 0) * started / 1000])
+    return gauges
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+                atexit.register(_registry.flush_if_used)
+    return _registry
+
+
+def record_request(request, response, duration, profile=None):
+    """Метрики HTTP-запроса (вызывается из LoggingMiddleware)"""
+    if not get_config()['ENABLED']:
+        return
+    registry = get_registry()
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match is not None and match.view_name else 'unmatched'
+    labels = {'view': view, 'method': request.method}
+    registry.inc('http_requests_total', {**labels, 'status': f'{response.status_code // 100}xx'})
+    registry.observe('http_request_duration_seconds', labels, duration, LATENCY_BUCKETS)
+    if profile is not None:
+        registry.observe('http_request_db_queries', labels, profile.queries, QUERY_BUCKETS)
+        registry.observe('http_request_db_seconds', labels, profile.db_time, LATENCY_BUCKETS)
+        if profile.write_time:
+            registry.observe('http_request_db_write_seconds', labels, profile.write_time, LATENCY_BUCKETS)
+        if profile.lock_errors:
+            registry.inc('sqlite_lock_errors_total', {'view': view}, profile.lock_errors)
+    registry.maybe_flush()
+
+
+def record_cache(alias, hit):
+    if get_config()['ENABLED']:
+        get_registry().inc('cache_requests_total', {'cache': alias, 'result': 'hit' if hit else 'miss'})
+
+
+def _merge(totals, snapshot):
+    """Добавляет состояние процесса к суммам {имя: {метки: значение}}"""
+    for name, labels, value in snapshot.get('counters', []) + snapshot.get('gauges', []):
+        series = totals.setdefault(name, {})
+        key = tuple(tuple(pair) for pair in labels)
+        series[key] = series.get(key, 0) + value
+    for name, labels, data in snapshot.get('histograms', []):
+        series = totals.setdefault(name, {})
+        key = tuple(tuple(pair) for pair in labels)
+        merged = series.get(key)
+        if merged is None:
+            series[key] = {**data, 'counts': list(data['counts'])}
+        else:
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], data['counts'])]
+            merged['sum'] += data['sum']
+            merged['count'] += data['count']
+
+
+@contextmanager
+def _directory_lock(directory, exclusive):
+    """Блокировка каталога метрик между процессами (без fcntl — пустая)"""
+    if fcntl is None:
+        yield
+        return
+    with open(directory / RETIRED_LOCK, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _process_alive(process_id):
+    """Жив ли процесс <pid>_<время старта> на этом хосте (при сомнении — жив)"""
+    try:
+        os.kill(int(process_id.split('_')[0]), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, OSError):
+        return True
+    return True
+
+
+def _retire_stale(directory, process_id):
+    """
+    Файлы завершившихся процессов, не обновлявшиеся дольше STALE_SECONDS,
+    вливаются в retired.json и удаляются: счетчики и гистограммы Prometheus не
+    должны уменьшаться, а показатели-gauge завершившегося процесса теряют смысл.
+    Файл живого процесса не трогается, даже если тот долго простаивал: при
+    следующем сбросе он записал бы те же счетчики повторно.
+    Без fcntl (Windows) файлы не удаляются.
+    """
+    if fcntl is None:
+        return
+    stale_before = time.time() - float(get_config()['STALE_SECONDS'])
+    stale = [
+        path for path in directory.glob('*.json')
+        if path.name != RETIRED_FILE and path.stem != process_id
+        and path.stat().st_mtime < stale_before and not _process_alive(path.stem)
+    ]
+    if not stale:
+        return
+    with _directory_lock(directory, exclusive=True):
+        retired_path = directory / RETIRED_FILE
+        totals = {}
+        try:
+            _merge(totals, json.loads(retired_path.read_text(encoding='utf-8')))
+        except FileNotFoundError:
+            pass
+        retired = []
+        for path in stale:
+            try:
+                snapshot = json.loads(path.read_text(encoding='utf-8'))
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot read metrics file {path.name}: {e}")
+                continue
+            counters = [entry for entry in snapshot.get('gauges', []) if HELP.get(entry[0], ('gauge',))[0] == 'counter']
+            _merge(totals, {'counters': snapshot.get('counters', []) + counters, 'histograms': snapshot.get('histograms', [])})
+            retired.append(path)
+        if not retired:
+            return
+        data = {'counters': [], 'histograms': []}
+        for name, series in totals.items():
+            for key, value in series.items():
+                kind = 'histograms' if isinstance(value, dict) else 'counters'
+                data[kind].append([name, [list(pair) for pair in key], value])
+        tmp = retired_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data), encoding='utf-8')
+        os.replace(tmp, retired_path)
+        for path in retired:
+            path.unlink()
+
+
+def collect():
+    """
+    Сумма состояний всех процессов: {имя: {метки: значение}}.
+    Текущий процесс берется из памяти, остальные — из их файлов и retired.json.
+    """
+    registry = get_registry()
+    totals = {}
+    _merge(totals, registry.snapshot())
+    directory = get_metrics_dir()
+    if not directory.exists():
+        return totals
+    try:
+        _retire_stale(directory, registry.process_id)
+    except OSError as e:
+        logger.error(f"Cannot retire stale metrics files: {e}")
+    with _directory_lock(directory, exclusive=False):
+        for path in directory.glob('*.json'):
+            if path.stem == registry.process_id:
+                continue
+            try:
+                _merge(totals, json.loads(path.read_text(encoding='utf-8')))
+            except (OSError, ValueError):
+                continue
+    return totals
+
+
+def business_gauges():
+    """Ячейки табелей по месяцу и статусу за последние BUSINESS_MONTHS месяцев (кеш на процесс)"""
+    from django.core.cache import cache
+    from django.db.models import Count
+    from django.db.models.functions import TruncMonth
+    from django.utils import timezone
+    from apps.timesheet.models import ItrTimesheet, Timesheet
+
+    config = get_config()
+    cache_key = 'metrics:timesheet_cells'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    today = timezone.localdate()
+    total = today.year * 12 + today.month - int(config['BUSINESS_MONTHS'])
+    since = today.replace(year=total // 12, month=total % 12 + 1, day=1)
+    series = {}
+    for timesheet_type, model in (('main', Timesheet), ('itr', ItrTimesheet)):
+        rows = (
+            model.objects.filter(date__gte=since)
+            .annotate(month=TruncMonth('date')).values('month', 'status')
+            .annotate(cells=Count('id')).order_by()
+        )
+        for row in rows:
+            labels = (('month', row['month'].strftime('%Y-%m')), ('status', row['status']), ('type', timesheet_type))
+            series[labels] = row['cells']
+    cache.set(cache_key, series, int(config['BUSINESS_CACHE_SECONDS']))
+    return series
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_exposition():
+    """Текст в формате Prometheus exposition 0.0.4"""
+    totals = collect()
+    try:
+        totals['timesheet_cells'] = business_gauges()
+    except Exception as e:
+        logger.error(f"Metrics: business gauges failed: {e}")
+
+    lines = []
+    for name, (metric_type, help_text) in HELP.items():
+        series = totals.get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in sorted(series.items()):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(value['buckets'], value['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_scrape_allowed(request):
+    """Доступ к /metrics: разрешенный адрес, токен Bearer или администратор"""
+    config = get_config()
+    token = config['TOKEN']
+    if token and request.META.get('HTTP_AUTHORIZATION', '') == f'Bearer {token}':
+        return True
+    if request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']:
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and (user.is_superuser or user.is_administrator))
@@ -1,21 +1,82 @@
 import logging
 import time
+from contextlib import ExitStack
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.http import Http404
 from django.conf import settings
+from .profiling import RequestProfile, activate as activate_profile, deactivate as deactivate_profile
+from .profiling import get_config as get_profiling_config
+from .profiling import get_sampler, run_with_cprofile, save_stack_samples, wants_cprofile
+from .metrics import record_request as record_request_metrics
 
 logger = logging.getLogger('apps')
 
 class LoggingMiddleware(MiddlewareMixin):
+    """
+    Журнал действий и медленных запросов с профилем запроса (apps.core.profiling):
+    число SQL-запросов, время в БД и в шаблонах, заголовок Server-Timing.
+    При превышении порога числа запросов в журнал пишутся самые частые из них.
+    Медленные запросы сохраняют выборку стеков, администратор может выполнить
+    запрос под cProfile (?_profile=1). Каждый запрос учитывается в метриках
+    Prometheus (apps.core.metrics).
+    """
+    async_capable = False
+
+    def __call__(self, request):
+        config = get_profiling_config()
+        if not config['ENABLED']:
+            return super().__call__(request)
+        profile = RequestProfile()
+        request.profile = profile
+        token = activate_profile(profile)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile))
+                if wants_cprofile(request):
+                    response, summary_path = run_with_cprofile(request, super().__call__)
+                    logger.info(f"cProfile of {request.method} {request.path} saved: {summary_path}")
+                    return response
+                return self._call_sampled(request, config)
+        finally:
+            deactivate_profile(token)
+
+    def _call_sampled(self, request, config):
+        """Выполнить запрос под сэмплером стеков; стеки медленного запроса сохраняются"""
+        sampler = get_sampler()
+        if sampler is None:
+            return super().__call__(request)
+        started = time.monotonic()
+        sampler.start()
+        try:
+            response = super().__call__(request)
+        finally:
+            samples = sampler.stop()
+        duration = time.monotonic() - started
+        if samples and duration > config['SLOW_REQUEST_SECONDS']:
+            try:
+                path = save_stack_samples(request, samples, duration)
+                logger.warning(f"Stack samples of slow {request.method} {request.path} ({duration:.2f}s): {path}")
+            except OSError as e:
+                logger.error(f"Cannot save stack samples: {e}")
+        return response
+
     def process_request(self, request):
         request.start_time = time.time()
         return None
     
     def process_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        config = get_profiling_config()
+        if profile is not None and config['SERVER_TIMING']:
+            response['Server-Timing'] = profile.server_timing()
+        duration = time.time() - getattr(request, 'start_time', time.time())
+        record_request_metrics(request, response, duration, profile)
+
         if hasattr(request, 'user') and request.user.is_authenticated:
-            duration = time.time() - request.start_time
             
             log_data = {
                 'user': request.user.username,
@@ -27,11 +88,24 @@ class LoggingMiddleware(MiddlewareMixin):
                 'duration': round(duration, 3),
                 'ip': request.META.get('REMOTE_ADDR'),
             }
+            if profile is not None:
+                log_data.update(profile.as_fields())
+            extra = {'request_data': log_data}
             
             if request.method in ['POST', 'PUT', 'PATCH', 'DELETE']:
-                logger.info(f"Action: {log_data}")
-            elif request.method == 'GET' and duration > 2.0:  # Долгие запросы
-                logger.warning(f"Slow request: {log_data}")
+                logger.info(f"Action: {log_data}", extra=extra)
+            elif request.method == 'GET' and duration > config['SLOW_REQUEST_SECONDS']:  # Долгие запросы
+                logger.warning(f"Slow request: {log_data}", extra=extra)
+
+            # Представление «размножает» запросы — показываем, какие именно повторяются
+            if profile is not None and profile.queries >= config['QUERY_COUNT_THRESHOLD']:
+                top = profile.top_queries(config['TOP_SQL'])
+                lines = '\n'.join(f"  {count} x {sql}" for count, sql in top)
+                logger.warning(
+                    f"Query fan-out on {request.method} {request.path}: {profile.queries} queries, "
+                    f"{profile.db_time:.3f}s in DB\n{lines}",
+                    extra={'request_data': {**log_data, 'top_sql': top}},
+                )
         
         return response
 
@@ -0,0 +1,368 @@
+"""
+Профилирование запросов: число SQL-запросов, время в БД и время рендеринга шаблонов.
+
+LoggingMiddleware создает RequestProfile на каждый запрос и подключает его ко
+всем соединениям через connection.execute_wrapper. Время шаблонов
+учитывается оберткой над рендерингом шаблонов Django (instrument_templates),
+которая пишет в профиль текущего запроса. Запросы, выполненные из шаблона
+(ленивые QuerySet), входят и во время БД, и во время шаблона.
+
+Профили Python-кода сохраняются в PROFILE_DIR (по умолчанию logs/profiles/):
+
+* по запросу администратора (?_profile=1 или заголовок X-Profile: 1) запрос
+  выполняется под cProfile, сохраняются дамп pstats (.prof) и HTML-сводка
+  самых затратных функций; ?_profile=html возвращает сводку вместо ответа;
+* StackSampler раз в SAMPLE_INTERVAL снимает стеки потоков, обрабатывающих
+  запросы; для запросов дольше SLOW_REQUEST_SECONDS стеки сохраняются в
+  свернутом формате (.folded — flamegraph.pl, speedscope). Выключен по
+  умолчанию: пока идет хотя бы один запрос, sys._current_frames() обходит
+  стеки всех потоков процесса 100 раз в секунду — включается явно (SAMPLER).
+
+Хранится не больше PROFILE_KEEP последних файлов.
+"""
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+from django.utils.text import slugify
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'QUERY_COUNT_THRESHOLD': 200,
+    'TOP_SQL': 5,
+    'SLOW_REQUEST_SECONDS': 2.0,
+    'ON_DEMAND': True,
+    'SAMPLER': False,
+    'SAMPLE_INTERVAL': 0.01,
+    'PROFILE_DIR': None,
+    'PROFILE_KEEP': 50,
+    'TOP_FUNCTIONS': 40,
+}
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_SUFFIXES = ('.prof', '.html', '.folded')
+WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_current_profile = ContextVar('request_profile', default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \((?:[^()]*, )+[^()]*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def get_config():
+    return {**DEFAULTS, **(getattr(settings, 'REQUEST_PROFILING', None) or {})}
+
+
+def sql_fingerprint(sql):
+    """Текст запроса без литералов и с однотипными списками IN: одинаков для повторов в цикле"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class RequestProfile:
+    """Счетчики одного запроса; вызывается как execute_wrapper соединения"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.by_alias = Counter()
+        self.fingerprints = Counter()
+        self.write_time = 0.0
+        self.lock_errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                self.lock_errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_time += elapsed
+            # Время изменяющих запросов включает ожидание блокировки SQLite (busy timeout)
+            if sql.lstrip()[:7].upper().startswith(WRITE_VERBS):
+                self.write_time += elapsed
+            self.queries += 1
+            self.by_alias[context['connection'].alias] += 1
+            self.fingerprints[sql_fingerprint(sql)] += 1
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def top_queries(self, n):
+        """n самых частых отпечатков SQL: [(количество, отпечаток)]"""
+        return [(count, sql[:300]) for sql, count in self.fingerprints.most_common(n)]
+
+    def as_fields(self):
+        """Поля для записи журнала"""
+        fields = {
+            'db_queries': self.queries,
+            'db_time': round(self.db_time, 3),
+            'template_time': round(self.template_time, 3),
+        }
+        if len(self.by_alias) > 1:
+            fields['db_aliases'] = dict(self.by_alias)
+        return fields
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing (длительности в мс)"""
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ])
+
+
+def activate(profile):
+    return _current_profile.set(profile)
+
+
+def deactivate(token):
+    _current_profile.reset(token)
+
+
+def get_current_profile():
+    return _current_profile.get()
+
+
+def instrument_templates():
+    """Обернуть рендеринг шаблонов бэкенда Django учетом времени в текущем профиле"""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_profiled', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None or profile.rendering:
+            # Вложенный рендеринг уже учтен внешним
+            return original(self, context, request)
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            profile.rendering = False
+            profile.template_time += time.perf_counter() - started
+
+    render._profiled = True
+    Template.render = render
+
+
+# --- Профили Python-кода -------------------------------------------------------------
+
+def get_profile_dir():
+    config = get_config()
+    return Path(config['PROFILE_DIR'] or Path(settings.BASE_DIR) / 'logs' / 'profiles')
+
+
+def rotate_profiles(directory, keep):
+    """Оставить keep последних файлов профилей (по времени изменения)"""
+    files = [p for p in directory.iterdir() if p.is_file() and p.suffix in PROFILE_SUFFIXES]
+    files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in files[keep:]:
+        try:
+            path.unlink()
+        except OSError:
+            continue
+
+
+def _profile_path(prefix, request, suffix):
+    directory = get_profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = timezone.localtime().strftime('%Y%m%d_%H%M%S_%f')
+    name = slugify(request.path.strip('/').replace('/', '-')) or 'root'
+    return directory / f'{prefix}_{stamp}_{name[:60]}{suffix}'
+
+
+def wants_cprofile(request):
+    """Профилирование по запросу доступно только администраторам"""
+    if not get_config()['ON_DEMAND']:
+        return False
+    flag = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if flag not in ('1', 'true', 'html'):
+        return False
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and (user.is_superuser or user.is_administrator))
+
+
+def _function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Встроенные функции
+        return name
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    return f'{filename}:{line}({name})'
+
+
+def render_cprofile_summary(stats, request, elapsed, top):
+    """HTML-таблица самых затратных функций по общему и собственному времени"""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    own = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+
+    def table(items):
+        return format_html(
+            '<table><tr><th>Вызовов</th><th>Собств., мс</th><th>Всего, мс</th><th>Функция</th></tr>{}</table>',
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+                (nc if nc == cc else f'{nc}/{cc}', f'{tt * 1000:.1f}', f'{ct * 1000:.1f}', _function_label(func))
+                for func, (cc, nc, tt, ct, _) in items
+            )),
+        )
+
+    return format_html(
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Профиль {}</title>'
+        '<style>body{{font-family:sans-serif}}table{{border-collapse:collapse;font-size:13px}}'
+        'td,th{{border:1px solid #ccc;padding:2px 6px;text-align:right}}td:last-child{{text-align:left}}</style>'
+        '</head><body><h2>{} {}</h2><p>Время запроса: {} мс, вызовов функций: {}</p>'
+        '<h3>По общему времени</h3>{}<h3>По собственному времени</h3>{}</body></html>',
+        request.path, request.method, request.get_full_path(), f'{elapsed * 1000:.1f}', stats.total_calls,
+        table(rows), table(own),
+    )
+
+
+def run_with_cprofile(request, get_response):
+    """
+    Выполнить запрос под cProfile и сохранить дамп pstats и HTML-сводку.
+
+    Возвращает (ответ, путь к сводке). При ?_profile=html ответом служит сводка.
+    """
+    from django.http import HttpResponse
+
+    config = get_config()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    response = profiler.runcall(get_response, request)
+    elapsed = time.perf_counter() - started
+
+    dump_path = _profile_path('cprofile', request, '.prof')
+    profiler.dump_stats(str(dump_path))
+    stats = pstats.Stats(profiler)
+    html = render_cprofile_summary(stats, request, elapsed, int(config['TOP_FUNCTIONS']))
+    html_path = dump_path.with_suffix('.html')
+    html_path.write_text(html, encoding='utf-8')
+    rotate_profiles(dump_path.parent, int(config['PROFILE_KEEP']))
+
+    flag = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if flag == 'html':
+        response = HttpResponse(html)
+    response['X-Profile'] = html_path.name
+    return response, html_path
+
+
+def _folded_stack(frame):
+    """Стек кадра в свернутом формате: внешние вызовы слева, через «;»"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Выборочный профилировщик: фоновый поток раз в interval снимает стеки
+    потоков, зарегистрированных как обрабатывающие запрос. Пока запросов нет,
+    поток спит на событии, поэтому накладные расходы — только на время запросов.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def start(self):
+        """Начать выборку стеков текущего потока"""
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+        self._wake.set()
+
+    def stop(self):
+        """Закончить выборку текущего потока; возвращает Counter свернутых стеков"""
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None) or Counter()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                thread_ids = list(self._active)
+            if not thread_ids:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            stacks = {tid: _folded_stack(frames[tid]) for tid in thread_ids if tid in frames}
+            with self._lock:
+                for tid, stack in stacks.items():
+                    samples = self._active.get(tid)
+                    if samples is not None:
+                        samples[stack] += 1
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Сэмплер процесса или None, если выключен"""
+    global _sampler
+    config = get_config()
+    if not config['SAMPLER']:
+        return None
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(float(config['SAMPLE_INTERVAL']))
+    return _sampler
+
+
+def save_stack_samples(request, samples, duration):
+    """Сохранить стеки медленного запроса в формате .folded; возвращает путь"""
+    config = get_config()
+    path = _profile_path('sample', request, '.folded')
+    lines = [
+        f'# {request.method} {request.get_full_path()}',
+        f'# duration={duration:.3f}s samples={sum(samples.values())} interval={config["SAMPLE_INTERVAL"]}s',
+    ]
+    lines.extend(f'{stack} {count}' for stack, count in samples.most_common())
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    rotate_profiles(path.parent, int(config['PROFILE_KEEP']))
+    return path
@@ -0,0 +1,103 @@
+"""
+Реплика только для чтения для тяжелых отчетов.
+
+Представления, помеченные @read_replica (табель плановика, печатная форма,
+экспорт, статистика), читают из алиаса settings.READ_REPLICA['ALIAS'], если он
+описан в DATABASES. Для SQLite это снимок основной БД, который периодически
+обновляет команда refresh_replica (backup API); в других СУБД — реплика сервера.
+Так отчеты не конкурируют с сохранением ячеек мастерами за файл основной БД.
+
+Если снимок отсутствует или старше MAX_LAG секунд, представление читает из
+основной БД. Представление можно исключить через READ_REPLICA['EXCLUDE_VIEWS'].
+"""
+import logging
+import os
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger('apps')
+
+DEFAULTS = {
+    'ALIAS': 'replica',
+    'MAX_LAG': 600,
+    'EXCLUDE_VIEWS': (),
+}
+
+_read_alias = ContextVar('read_replica_alias', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **(getattr(settings, 'READ_REPLICA', None) or {})}
+
+
+def get_replica_alias():
+    """Алиас реплики, если он настроен, иначе None"""
+    alias = get_config()['ALIAS']
+    return alias if alias and alias in settings.DATABASES else None
+
+
+def get_current_read_alias():
+    """Алиас, из которого читает текущий запрос (None — основная БД)"""
+    return _read_alias.get()
+
+
+def get_replica_state(alias):
+    """
+    Состояние реплики: {'alias', 'refreshed_at', 'lag'}.
+
+    Для снимка SQLite время обновления — время изменения файла; None, если
+    файла нет. Для прочих СУБД давность неизвестна (refreshed_at и lag — None).
+    """
+    db = settings.DATABASES[alias]
+    state = {'alias': alias, 'refreshed_at': None, 'lag': None}
+    if not db.get('ENGINE', '').endswith('sqlite3'):
+        return state
+    try:
+        mtime = os.path.getmtime(str(db['NAME']))
+    except OSError:
+        return None
+    state['refreshed_at'] = datetime.fromtimestamp(mtime, tz=timezone.get_current_timezone())
+    state['lag'] = max(0, int(timezone.now().timestamp() - mtime))
+    return state
+
+
+def read_replica(view_func=None, *, when=None):
+    """
+    Декоратор представления только для чтения: запросы к БД идут в реплику.
+
+    when(request) — необязательное условие (например, только для плановика).
+    Состояние реплики доступно шаблонам как read_replica (индикатор давности).
+    При ошибке чтения из реплики представление повторяется на основной БД.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            alias = get_replica_alias()
+            config = get_config()
+            if (alias is None or func.__name__ in config['EXCLUDE_VIEWS']
+                    or request.method not in ('GET', 'HEAD', 'POST')
+                    or (when is not None and not when(request))):
+                return func(request, *args, **kwargs)
+            state = get_replica_state(alias)
+            if state is None or (state['lag'] is not None and state['lag'] > int(config['MAX_LAG'])):
+                return func(request, *args, **kwargs)
+            token = _read_alias.set(alias)
+            try:
+                request.read_replica = state
+                return func(request, *args, **kwargs)
+            except DatabaseError as e:
+                logger.warning(f"Read replica '{alias}' failed on {request.path}, using primary: {e}")
+                request.read_replica = None
+            finally:
+                _read_alias.reset(token)
+            return func(request, *args, **kwargs)
+        return wrapper
+
+    if view_func is not None:
+        return decorator(view_func)
+    return decorator
@@ -0,0 +1,60 @@
+"""
+Маршрутизаторы БД: реплика для отчетов и модели архива табелей.
+
+ReadReplicaRouter направляет чтение в реплику, пока выполняется представление
+с декоратором @read_replica (apps.core.replica); запись всегда идет в основную БД.
+
+Архивные модели (ArchivedTimesheet, ArchivedItrTimesheet) читаются через
+основное соединение: их таблицы лежат в подключенной схеме archive
+(apps.core.db.attach_archive). Схемой архива управляет команда
+archive_months, а не миграции.
+"""
+from .replica import get_current_read_alias, get_replica_alias
+
+ARCHIVE_TABLE_PREFIX = 'archive"."'
+
+
+def is_archive_model(model):
+    return model._meta.db_table.startswith(ARCHIVE_TABLE_PREFIX)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return get_current_read_alias()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Объекты из реплики — копии строк основной БД
+        replica = get_replica_alias()
+        if replica and {obj1._state.db, obj2._state.db} <= {'default', replica}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит вместе со снимком основной БД
+        if db == get_replica_alias():
+            return False
+        return None
+
+
+class ArchiveRouter:
+    def db_for_read(self, model, **hints):
+        if is_archive_model(model):
+            return 'default'
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_archive_model(model):
+            return 'default'
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        model = hints.get('model')
+        if model is not None and is_archive_model(model):
+            return False
+        return None
@@ -0,0 +1,215 @@
+"""
+Потоковое чтение табличных файлов (.xlsx, .xls, .csv) для команд импорта.
+
+Строки читаются лениво: .xlsx — через openpyxl в режиме read_only, .csv —
+модулем csv, поэтому память не растет с размером файла. Старый формат .xls
+читает xlrd (лист загружается целиком — формат не поддерживает потоковое
+чтение). Заголовки сопоставляются с полями по списку синонимов, даты
+приводятся к date.
+"""
+import csv
+import io
+import os
+from datetime import date, datetime, time, timedelta
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y', '%d.%m.%y')
+EXCEL_EPOCH = date(1899, 12, 30)
+
+
+class SpreadsheetError(ValueError):
+    """Файл не удалось прочитать или в нем нет ожидаемых колонок"""
+
+
+def get_extension(source, filename=None):
+    name = filename or getattr(source, 'name', None) or (source if isinstance(source, (str, os.PathLike)) else '')
+    return os.path.splitext(str(name))[1].lower()
+
+
+def iter_rows(source, filename=None, sheet_name=None, skip_rows=0, delimiter=None, encoding='utf-8-sig'):
+    """
+    Строки файла как кортежи значений ячеек.
+
+    source — путь или файловый объект (в т.ч. загруженный файл Django);
+    формат определяется по расширению filename или source.name.
+    Значения .xlsx и .xls приходят типизированными (int, float, datetime), .csv — строками.
+    """
+    ext = get_extension(source, filename)
+    if ext == '.xlsx':
+        yield from _iter_xlsx(source, sheet_name, skip_rows)
+    elif ext == '.xls':
+        yield from _iter_xls(source, sheet_name, skip_rows)
+    elif ext == '.csv':
+        yield from _iter_csv(source, skip_rows, delimiter, encoding)
+    else:
+        raise SpreadsheetError(f'Поддерживаются файлы {", ".join(SUPPORTED_EXTENSIONS)}')
+
+
+def _iter_xlsx(source, sheet_name, skip_rows):
+    from openpyxl import load_workbook
+    try:
+        wb = load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise SpreadsheetError(f'Не удалось прочитать файл: {e}')
+    try:
+        try:
+            ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        except KeyError:
+            raise SpreadsheetError(f'Лист «{sheet_name}» не найден')
+        yield from ws.iter_rows(min_row=skip_rows + 1, values_only=True)
+    finally:
+        wb.close()
+
+
+def _iter_xls(source, sheet_name, skip_rows):
+    try:
+        import xlrd
+    except ImportError:
+        raise SpreadsheetError('Для чтения .xls установите пакет xlrd или сохраните файл как .xlsx')
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            book = xlrd.open_workbook(str(source), on_demand=True)
+        else:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            book = xlrd.open_workbook(file_contents=source.read(), on_demand=True)
+    except Exception as e:
+        raise SpreadsheetError(f'Не удалось прочитать файл: {e}')
+    try:
+        try:
+            sheet = book.sheet_by_name(sheet_name) if sheet_name else book.sheet_by_index(0)
+        except xlrd.XLRDError:
+            raise SpreadsheetError(f'Лист «{sheet_name}» не найден')
+        for r in range(skip_rows, sheet.nrows):
+            yield tuple(_xls_value(cell, book.datemode, xlrd) for cell in sheet.row(r))
+    finally:
+        book.release_resources()
+
+
+def _xls_value(cell, datemode, xlrd):
+    """Значение ячейки .xls в типах openpyxl: пустые — None, даты — datetime"""
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate_as_datetime(cell.value, datemode)
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_ERROR:
+        return None
+    return cell.value
+
+
+def _iter_csv(source, skip_rows, delimiter, encoding):
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            f = open(source, newline='', encoding=encoding)
+        except OSError as e:
+            raise SpreadsheetError(f'Не удалось прочитать файл: {e}')
+    else:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        f = io.TextIOWrapper(getattr(source, 'file', source), newline='', encoding=encoding)
+    try:
+        if delimiter is None:
+            sample = f.read(4096)
+            f.seek(0)
+            delimiter = ';' if sample.count(';') >= sample.count(',') else ','
+        for i, row in enumerate(csv.reader(f, delimiter=delimiter)):
+            if i >= skip_rows:
+                yield tuple(row)
+    finally:
+        if isinstance(f, io.TextIOWrapper) and not isinstance(source, (str, os.PathLike)):
+            # Не закрываем чужой файловый объект вместе с оберткой
+            f.detach()
+        else:
+            f.close()
+
+
+def normalize_header(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def map_columns(header, columns, required=()):
+    """
+    Индексы колонок по заголовку: columns = {поле: [синонимы заголовка]}.
+
+    Поиск без учета регистра и лишних пробелов. Если поле из required не
+    найдено — SpreadsheetError.
+    """
+    normalized = [normalize_header(cell) for cell in header]
+    mapping = {}
+    for field, aliases in columns.items():
+        for alias in aliases:
+            alias = normalize_header(alias)
+            if alias in normalized:
+                mapping[field] = normalized.index(alias)
+                break
+    missing = [field for field in required if field not in mapping]
+    if missing:
+        raise SpreadsheetError(f'Не найдены колонки: {", ".join(missing)}')
+    return mapping
+
+
+def iter_records(rows, columns, required=(), dates=()):
+    """
+    Записи-словари из строк, первая строка — заголовок.
+
+    Пустые строки пропускаются; поля из dates приводятся через to_date.
+    Для каждой записи также возвращается номер строки (с 1, включая заголовок).
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    mapping = map_columns(header, columns, required)
+    for row_number, row in enumerate(rows, start=2):
+        if not any(cell not in (None, '') for cell in row):
+            continue
+        record = {}
+        for field, index in mapping.items():
+            value = row[index] if index < len(row) else None
+            record[field] = to_date(value) if field in dates else value
+        yield row_number, record
+
+
+def to_text(value):
+    """Значение ячейки как строка: None -> '', 1234.0 -> '1234'"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == time(0) else value.isoformat()
+    return str(value).strip()
+
+
+def to_date(value):
+    """
+    Значение ячейки как date или None.
+
+    Понимает date/datetime, серийные номера дат Excel и строки
+    ДД.ММ.ГГГГ, ГГГГ-ММ-ДД (в т.ч. с временем), ДД/ММ/ГГГГ, ГГГГММДД.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Серийный номер Excel; малые числа (номера дней, табельные) датами не считаем
+        if 10000 <= value < 2958466:
+            return EXCEL_EPOCH + timedelta(days=int(value))
+        return None
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.split(' ')[0].split('T')[0], fmt).date()
+        except ValueError:
+            continue
+    if len(text) >= 8 and text[:8].isdigit():
+        try:
+            return datetime.strptime(text[:8], '%Y%m%d').date()
+        except ValueError:
+            return None
+    return None
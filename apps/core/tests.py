@@ -1,6 +1,128 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+
+from . import metrics
+from .logs import CompressedRotatingFileHandler
+from .profiling import RequestProfile
+from .write_queue import serialized_write
+
 
 class CoreTests(TestCase):
     def test_sample(self):
         """Пример теста"""
-        self.assertEqual(1 + 1, 2)
\ No newline at end of file
+        self.assertEqual(1 + 1, 2)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        settings_patch = override_settings(METRICS={'DIR': self.dir, 'STALE_SECONDS': 60})
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        registry_patch = mock.patch.object(metrics, '_registry', metrics.MetricsRegistry())
+        registry_patch.start()
+        self.addCleanup(registry_patch.stop)
+
+    def write_process(self, pid, requests, age):
+        path = self.dir / f'{pid}_1.json'
+        path.write_text(json.dumps({
+            'counters': [['http_requests_total', [['view', 'v']], requests]],
+            'histograms': [['http_request_db_queries', [['view', 'v']],
+                            {'buckets': [1, 5], 'counts': [requests, 0], 'sum': requests, 'count': requests}]],
+            'gauges': [['write_queue_depth', [], 3], ['write_queue_jobs_total', [['outcome', 'completed']], 2]],
+        }), encoding='utf-8')
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_dead_process_counters_survive_cleanup(self):
+        stale = self.write_process(self.dead_pid(), 5, age=3600)
+        idle = self.write_process(os.getpid(), 7, age=3600)
+        before = metrics.collect()
+        self.assertFalse(stale.exists())
+        self.assertTrue(idle.exists())
+        self.assertEqual(before['http_requests_total'][(('view', 'v'),)], 12)
+        self.assertEqual(before['http_request_db_queries'][(('view', 'v'),)]['count'], 12)
+        self.assertEqual(before['write_queue_jobs_total'][(('outcome', 'completed'),)], 4)
+        # Gauge завершившегося процесса отбрасывается
+        self.assertEqual(before['write_queue_depth'][()], 3 + metrics._process_gauges()[0][2])
+
+        self.write_process(self.dead_pid(), 1, age=3600)
+        after = metrics.collect()
+        self.assertEqual(after['http_requests_total'][(('view', 'v'),)], 13)
+        self.assertEqual(after['write_queue_jobs_total'][(('outcome', 'completed'),)], 6)
+        self.assertEqual(sorted(p.name for p in self.dir.glob('*.json')), sorted([idle.name, metrics.RETIRED_FILE]))
+
+    def test_scrape_needs_token_or_allowed_address(self):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertFalse(metrics.is_scrape_allowed(request))
+        with override_settings(METRICS={'TOKEN': 'secret'}):
+            self.assertTrue(metrics.is_scrape_allowed(
+                RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            ))
+
+
+def _write_log_records(path, worker, count):
+    handler = CompressedRotatingFileHandler(path, max_bytes=500, backup_count=1000)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    for i in range(count):
+        handler.handle(logging.makeLogRecord({'msg': f'{worker}-{i}', 'levelno': logging.INFO}))
+    handler.close()
+
+
+class LogRotationTests(TestCase):
+    def test_workers_share_rotation_without_losing_records(self):
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        path = str(tmp / 'app.log')
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_write_log_records, args=(path, w, 300)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+        lines = (tmp / 'app.log').read_text(encoding='utf-8').splitlines()
+        parts = sorted(tmp.glob('app.log.*.gz'))
+        self.assertGreater(len(parts), 5)
+        for part in parts:
+            with gzip.open(part, 'rt', encoding='utf-8') as f:
+                lines += f.read().splitlines()
+        self.assertEqual(sorted(lines), sorted(f'{w}-{i}' for w in range(4) for i in range(300)))
+
+
+class WriteQueueProfilingTests(TransactionTestCase):
+    @override_settings(SQLITE_WRITE_QUEUE={'ENABLED': True})
+    def test_writer_thread_queries_reach_request_profile(self):
+        from apps.users.models import Department
+
+        @serialized_write
+        def view(request):
+            Department.objects.create(name='Цех', code='C1')
+            return threading.current_thread().name
+
+        request = RequestFactory().post('/')
+        request.profile = RequestProfile()
+        self.assertEqual(view(request), 'sqlite-writer')
+        self.assertGreater(request.profile.queries, 0)
+        self.assertGreater(request.profile.write_time, 0)
@@ -5,4 +5,6 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
+    path('write-queue/metrics/', views.write_queue_metrics_view, name='write_queue_metrics'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -71,3 +71,20 @@ def error_404(request, exception):
 
 def error_500(request):
     return render(request, '500.html', status=500)
+
+@login_required
+def write_queue_metrics_view(request):
+    """Метрики очереди записи SQLite (только для администраторов)"""
+    from django.http import JsonResponse
+    from .write_queue import get_write_queue_metrics
+    if not request.user.is_administrator:
+        return JsonResponse({'error': 'Доступ запрещен'}, status=403)
+    return JsonResponse(get_write_queue_metrics())
+
+def metrics_view(request):
+    """Метрики в формате Prometheus (адреса METRICS['ALLOWED_IPS'], токен или администратор)"""
+    from django.http import HttpResponse, JsonResponse
+    from .metrics import is_scrape_allowed, render_exposition
+    if not is_scrape_allowed(request):
+        return JsonResponse({'error': 'Доступ запрещен'}, status=403)
+    return HttpResponse(render_exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
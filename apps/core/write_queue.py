@@ -0,0 +1,252 @@
+"""
+Очередь записи в SQLite: один поток-писатель на процесс.
+
+SQLite допускает только одного писателя. При включенной очереди
+(settings.SQLITE_WRITE_QUEUE['ENABLED']) изменяющие представления,
+помеченные @serialized_write, выполняются в отдельном потоке по одному;
+несколько заданий, накопившихся в очереди, объединяются в одну короткую
+транзакцию (каждое — в своей точке сохранения). Очередь ограничена: при
+переполнении или слишком долгом ожидании клиент получает 503 с Retry-After.
+
+При выключенной очереди представления выполняются как обычно.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.http import JsonResponse
+
+logger = logging.getLogger('apps')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_SIZE': 200,
+    'BATCH_SIZE': 20,
+    'TIMEOUT': 10.0,
+    'RETRY_AFTER': 2,
+}
+
+
+class WriteQueueFull(Exception):
+    """Очередь записи переполнена или ожидание превысило TIMEOUT"""
+
+
+def get_config():
+    return {**DEFAULTS, **(getattr(settings, 'SQLITE_WRITE_QUEUE', None) or {})}
+
+
+class WriteQueueMetrics:
+    """Счетчики очереди записи (потокобезопасные)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.submitted = 0
+            self.completed = 0
+            self.failed = 0
+            self.rejected = 0
+            self.timeouts = 0
+            self.batches = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.run_total = 0.0
+
+    def record(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_wait(self, wait):
+        with self._lock:
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self):
+        with self._lock:
+            started = self.completed + self.failed
+            return {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'batches': self.batches,
+                'wait_avg_ms': round(self.wait_total / started * 1000, 2) if started else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 2),
+                'run_avg_ms': round(self.run_total / started * 1000, 2) if started else 0.0,
+            }
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'enqueued_at')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class SerializedWriter:
+    """Поток-писатель с ограниченной очередью заданий"""
+
+    def __init__(self, max_size, batch_size):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = max(1, batch_size)
+        self.metrics = WriteQueueMetrics()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, timeout=None, **kwargs):
+        """Выполнить func в потоке-писателе и вернуть результат (или пробросить исключение)"""
+        self._ensure_started()
+        job = _Job(func, args, kwargs)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.metrics.record(rejected=1)
+            raise WriteQueueFull('Очередь записи переполнена')
+        self.metrics.record(submitted=1)
+        try:
+            return job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Задание еще в очереди — отменяем; если уже выполняется, дожидаемся результата
+            if job.future.cancel():
+                self.metrics.record(timeouts=1)
+                raise WriteQueueFull('Превышено время ожидания очереди записи')
+            return job.future.result()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return [job for job in batch if job.future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            close_old_connections()
+            outcomes = []
+            try:
+                with transaction.atomic():
+                    for job in batch:
+                        started = time.monotonic()
+                        self.metrics.record_wait(started - job.enqueued_at)
+                        try:
+                            with transaction.atomic():
+                                outcomes.append((job, job.func(*job.args, **job.kwargs), None))
+                        except Exception as e:
+                            outcomes.append((job, None, e))
+                        self.metrics.record(run_total=time.monotonic() - started)
+            except Exception as e:
+                # Ошибка фиксации всей пачки — сообщаем каждому заданию
+                logger.exception(f"Write queue: batch of {len(batch)} failed on commit: {e}")
+                outcomes = [(job, None, e) for job in batch]
+            self.metrics.record(batches=1)
+            for job, result, error in outcomes:
+                if error is None:
+                    self.metrics.record(completed=1)
+                    job.future.set_result(result)
+                else:
+                    self.metrics.record(failed=1)
+                    job.future.set_exception(error)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_config()
+                _writer = SerializedWriter(int(config['MAX_SIZE']), int(config['BATCH_SIZE']))
+    return _writer
+
+
+def get_write_queue_metrics():
+    """Состояние очереди записи: глубина, ожидание, счетчики"""
+    config = get_config()
+    data = {'enabled': bool(config['ENABLED']), 'max_size': int(config['MAX_SIZE'])}
+    if _writer is not None:
+        data['depth'] = _writer.queue.qsize()
+        data.update(_writer.metrics.snapshot())
+    else:
+        data['depth'] = 0
+    return data
+
+
+def overloaded_response(retry_after):
+    response = JsonResponse(
+        {'success': False, 'error': 'Сервер перегружен записью, повторите попытку позже'},
+        status=503,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _profiled(view_func, profile):
+    """
+    Представление для потока-писателя с профилем исходного запроса: обертка
+    execute_wrapper из LoggingMiddleware стоит только на соединениях потока
+    запроса, без нее SQL записи не попал бы ни в профиль, ни в метрики.
+    """
+    @wraps(view_func)
+    def job(request, *args, **kwargs):
+        from django.db import connections
+        from .profiling import activate, deactivate
+
+        token = activate(profile)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile))
+                return view_func(request, *args, **kwargs)
+        finally:
+            deactivate(token)
+    return job
+
+
+def serialized_write(view_func):
+    """
+    Декоратор изменяющего представления: POST-запросы выполняются через
+    очередь записи, если она включена. GET и прочие запросы — без изменений.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        config = get_config()
+        if not config['ENABLED'] or request.method != 'POST':
+            return view_func(request, *args, **kwargs)
+        profile = getattr(request, 'profile', None)
+        func = view_func if profile is None else _profiled(view_func, profile)
+        try:
+            return get_writer().submit(func, request, *args, timeout=float(config['TIMEOUT']), **kwargs)
+        except WriteQueueFull as e:
+            logger.warning(f"Write queue backpressure on {request.path}: {e}")
+            return overloaded_response(config['RETRY_AFTER'])
+    return wrapper
@@ -1,52 +1,143 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.shortcuts import redirect, render
+from django.urls import path
+from .forms import TimesheetGridImportForm
 from .models import Timesheet, ItrTimesheet
-from .models import Holiday, WorkdaySwap
-@admin.register(Timesheet)
-class TimesheetAdmin(admin.ModelAdmin):
-    list_display = ['date', 'employee', 'master', 'value', 'status', 'approved_by', 'approved_at']
-    list_filter = ['status', 'date', 'master', 'employee__user__department']  # Изменено здесь
-    search_fields = ['employee__user__first_name', 'employee__user__last_name', 'employee__user__employee_id']
-    readonly_fields = ['created_at', 'updated_at', 'approved_at']
-    date_hierarchy = 'date'
+from .models import Holiday, WorkdaySwap, ApprovalBatch, ArchivedMonth
+from .utils import set_timesheets_approval, import_timesheet_grid, write_import_errors_report
+from .utils import bump_calendar_cache_version
+
+
+class TimesheetApprovalActionsMixin:
+    """Действия утверждения, общие для основного табеля и табеля ИТР"""
     actions = ['approve_selected', 'unapprove_selected']
     
     def approve_selected(self, request, queryset):
         """Утвердить выбранные табели"""
-        updated = queryset.filter(status='draft').update(
-            status='approved',
-            approved_by=request.user
-        )
+        updated = set_timesheets_approval(queryset, request.user, approve=True)
         self.message_user(request, f'Утверждено табелей: {updated}')
     approve_selected.short_description = 'Утвердить выбранные'
     
     def unapprove_selected(self, request, queryset):
         """Снять утверждение с выбранных табелей"""
-        updated = queryset.filter(status='approved').update(
-            status='draft',
-            approved_by=None,
-            approved_at=None
-        )
+        updated = set_timesheets_approval(queryset, request.user, approve=False)
         self.message_user(request, f'Снято с утверждения табелей: {updated}')
     unapprove_selected.short_description = 'Снять утверждение с выбранных'
 
 
+class TimesheetGridImportMixin:
+    """Загрузка месячной сетки табеля из Excel со страницы списка"""
+    change_list_template = 'admin/timesheet/change_list_import.html'
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('import-grid/', self.admin_site.admin_view(self.import_grid_view),
+                 name='%s_%s_import_grid' % info),
+        ] + super().get_urls()
+
+    def import_grid_view(self, request):
+        if not self.has_add_permission(request):
+            messages.error(request, 'Недостаточно прав для импорта')
+            return redirect('..')
+        form = TimesheetGridImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            data = form.cleaned_data
+            try:
+                result = import_timesheet_grid(
+                    data['file'], request.user, self.model, data['year'], data['month'],
+                    sheet_name=data['sheet'] or None,
+                )
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(
+                    request,
+                    f"Импорт завершён. Строк: {result['rows']}, создано: {result['created']}, "
+                    f"обновлено: {result['updated']}, ошибок: {len(result['errors'])}"
+                )
+                if result['errors']:
+                    report_path = write_import_errors_report(result['errors'])
+                    preview = '; '.join(
+                        f"{e['column']}{e['row']}: {e['error']}" for e in result['errors'][:5]
+                    )
+                    messages.warning(request, f'Отчёт об ошибках: {report_path}. {preview}')
+                return redirect('..')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'title': f'Импорт из Excel: {self.model._meta.verbose_name_plural}',
+        }
+        return render(request, 'admin/timesheet/import_grid.html', context)
+
+
+@admin.register(Timesheet)
+class TimesheetAdmin(TimesheetGridImportMixin, TimesheetApprovalActionsMixin, admin.ModelAdmin):
+    list_display = ['date', 'employee', 'master', 'value', 'status', 'approved_by', 'approved_at']
+    list_filter = ['status', 'date', 'master', 'employee__user__department']  # Изменено здесь
+    search_fields = ['employee__user__first_name', 'employee__user__last_name', 'employee__user__employee_id']
+    readonly_fields = ['created_at', 'updated_at', 'approved_at']
+    date_hierarchy = 'date'
+
+
 @admin.register(ItrTimesheet)
-class ItrTimesheetAdmin(admin.ModelAdmin):
+class ItrTimesheetAdmin(TimesheetGridImportMixin, TimesheetApprovalActionsMixin, admin.ModelAdmin):
     list_display = ['date', 'employee', 'master', 'value', 'status', 'approved_by', 'approved_at']
     list_filter = ['status', 'date', 'master', 'employee__user__department']
     search_fields = ['employee__user__first_name', 'employee__user__last_name', 'employee__user__employee_id']
     readonly_fields = ['created_at', 'updated_at', 'approved_at']
     date_hierarchy = 'date'
 
+class CalendarCacheAdminMixin:
+    """Сброс кеша календаря при изменении праздников и переносов через админку"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_calendar_cache_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_calendar_cache_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_calendar_cache_version()
+
+
 @admin.register(Holiday)
-class HolidayAdmin(admin.ModelAdmin):
+class HolidayAdmin(CalendarCacheAdminMixin, admin.ModelAdmin):
     list_display = ("date", "type", "name")
     list_filter = ("type",)
     search_fields = ("name",)
 
 
 @admin.register(WorkdaySwap)
-class WorkdaySwapAdmin(admin.ModelAdmin):
+class WorkdaySwapAdmin(CalendarCacheAdminMixin, admin.ModelAdmin):
     list_display = ("date_a", "date_b", "is_active", "created_at")
     list_filter = ("is_active",)
     date_hierarchy = "date_a"
+
+
+@admin.register(ApprovalBatch)
+class ApprovalBatchAdmin(admin.ModelAdmin):
+    list_display = ("timesheet_type", "year", "month", "approved_count", "approved_by", "created_at")
+    list_filter = ("timesheet_type", "year", "month")
+    filter_horizontal = ("masters",)
+    readonly_fields = ("created_at",)
+
+
+@admin.register(ArchivedMonth)
+class ArchivedMonthAdmin(admin.ModelAdmin):
+    """Реестр архивных месяцев; изменяется только командой archive_months"""
+    list_display = ("timesheet_type", "year", "month", "rows", "archived_at")
+    list_filter = ("timesheet_type", "year")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
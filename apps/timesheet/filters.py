@@ -1,5 +1,5 @@
 import django_filters
-from .models import Timesheet
+from .models import Timesheet, ItrTimesheet
 from apps.users.models import User, Department
 
 class TimesheetFilter(django_filters.FilterSet):
@@ -33,4 +33,11 @@ class TimesheetFilter(django_filters.FilterSet):
         if user.is_authenticated and user.is_master:
             queryset = queryset.filter(master=user)
         
-        return queryset
\ No newline at end of file
+        return queryset
+
+
+class ItrTimesheetFilter(TimesheetFilter):
+    """Фильтры для табелей ИТР"""
+    
+    class Meta(TimesheetFilter.Meta):
+        model = ItrTimesheet
@@ -9,6 +9,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from apps.users.models import User, Employee, Department
 from .models import MonthlyTimesheet, Timesheet
+from .utils import check_months_writable
 class MonthlyTimesheetForm(forms.Form):
     """Форма для создания месячного табеля"""
     month = forms.CharField(
@@ -53,11 +54,12 @@ class MonthlyTimesheetForm(forms.Form):
             # Преобразуем строку "ГГГГ-ММ" в дату (первый день месяца)
             from datetime import datetime
             month_date = datetime.strptime(month_str, '%Y-%m').date()
-            
-            # Убедимся, что это первый день месяца
-            return month_date.replace(day=1)
         except ValueError:
             raise forms.ValidationError('Пожалуйста, выберите правильный месяц в формате ГГГГ-ММ')
+        # Убедимся, что это первый день месяца
+        month_date = month_date.replace(day=1)
+        check_months_writable(Timesheet, month_date)
+        return month_date
     
     def create_monthly_timesheet(self):
         """Создать табели на весь месяц"""
@@ -171,6 +173,11 @@ class BulkTimesheetForm(forms.Form):
         if not self.initial.get('date'):
             self.initial['date'] = timezone.now().date()
     
+    def clean_date(self):
+        date = self.cleaned_data['date']
+        check_months_writable(Timesheet, date)
+        return date
+    
     def clean_value(self):
         value = self.cleaned_data.get('value')
         
@@ -272,6 +279,11 @@ class TimesheetForm(forms.ModelForm):
             if hasattr(self.user, 'show_self_in_own_timesheet') and not self.user.show_self_in_own_timesheet:
                 self.fields['employee'].queryset = self.fields['employee'].queryset.exclude(user=self.user)
     
+    def clean_date(self):
+        date = self.cleaned_data['date']
+        check_months_writable(Timesheet, date)
+        return date
+    
     def clean(self):
         cleaned_data = super().clean()
         
@@ -313,3 +325,23 @@ class TimesheetForm(forms.ModelForm):
             )
         
         return value
+
+
+class TimesheetGridImportForm(forms.Form):
+    """Форма загрузки месячной сетки табеля из Excel в админке"""
+    file = forms.FileField(label='Файл .xlsx, .xls или .csv')
+    year = forms.IntegerField(label='Год', min_value=2000, max_value=2100)
+    month = forms.IntegerField(label='Месяц', min_value=1, max_value=12)
+    sheet = forms.CharField(label='Лист', required=False, help_text='По умолчанию — первый лист')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        today = timezone.now().date()
+        self.fields['year'].initial = today.year
+        self.fields['month'].initial = today.month
+
+    def clean_file(self):
+        f = self.cleaned_data['file']
+        if not f.name.lower().endswith(('.xlsx', '.xls', '.csv')):
+            raise forms.ValidationError('Поддерживаются форматы .xlsx, .xls и .csv')
+        return f
@@ -0,0 +1,77 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from apps.timesheet.models import Timesheet, ItrTimesheet
+from apps.timesheet.utils import archive_month, get_archivable_months, unarchive_month
+
+
+class Command(BaseCommand):
+    help = (
+        "Перенос полностью утвержденных месяцев старше N месяцев в архивную БД SQLite "
+        "(settings.SQLITE_ARCHIVE_PATH) и возврат месяцев из архива (--unarchive)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=24,
+                            help="Архивировать месяцы, закончившиеся раньше, чем N месяцев назад")
+        parser.add_argument("--type", choices=["main", "itr", "all"], default="all", help="Тип табеля")
+        parser.add_argument("--unarchive", nargs="+", metavar="ГГГГ-ММ", default=None,
+                            help="Вернуть указанные месяцы из архива")
+        parser.add_argument("--dry-run", action="store_true", default=False, help="Только показать месяцы")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "SQLITE_ARCHIVE_PATH", ""):
+            raise CommandError("Архив отключен: SQLITE_ARCHIVE_PATH не задан")
+        models = {"main": Timesheet, "itr": ItrTimesheet}
+        types = ["main", "itr"] if options["type"] == "all" else [options["type"]]
+
+        if options["unarchive"]:
+            periods = [self._parse_period(value) for value in options["unarchive"]]
+            for timesheet_type in types:
+                for year, month in periods:
+                    label = f"{month:02d}.{year} ({timesheet_type})"
+                    if options["dry_run"]:
+                        self.stdout.write(f"Будет возвращен: {label}")
+                        continue
+                    try:
+                        rows = unarchive_month(models[timesheet_type], year, month)
+                    except ValueError as e:
+                        self.stdout.write(self.style.WARNING(f"{label}: {e}"))
+                        continue
+                    self.stdout.write(self.style.SUCCESS(f"{label}: возвращено записей {rows}"))
+            return
+
+        if options["older_than"] < 1:
+            raise CommandError("--older-than должен быть >= 1")
+        today = date.today()
+        months_total = today.year * 12 + today.month - 1 - options["older_than"]
+        before = date(months_total // 12, months_total % 12 + 1, 1)
+        self.stdout.write(f"Архивация месяцев до {before:%m.%Y} (не включая) в {settings.SQLITE_ARCHIVE_PATH}")
+
+        moved = 0
+        for timesheet_type in types:
+            TimesheetModel = models[timesheet_type]
+            for year, month, rows in get_archivable_months(TimesheetModel, before):
+                label = f"{month:02d}.{year} ({timesheet_type})"
+                if options["dry_run"]:
+                    self.stdout.write(f"Будет перенесен: {label}, записей {rows}")
+                    continue
+                try:
+                    rows = archive_month(TimesheetModel, year, month)
+                except ValueError as e:
+                    # Месяц мог измениться между выборкой и переносом
+                    self.stdout.write(self.style.WARNING(f"{label}: {e}"))
+                    continue
+                moved += rows
+                self.stdout.write(f"{label}: перенесено записей {rows}")
+        if not options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Готово. Перенесено записей: {moved}"))
+
+    def _parse_period(self, value):
+        try:
+            year, month = (int(part) for part in value.split("-"))
+            return date(year, month, 1).year, month
+        except ValueError:
+            raise CommandError(f"Некорректный месяц: {value} (ожидается ГГГГ-ММ)")
@@ -1,21 +1,34 @@
-import sqlite3
-import zipfile
 from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 
+from apps.core.backups import (
+    BackupError, backup_attached_database, backup_timestamp, check_free_space, database_size, file_sha256, hash_pages,
+    integrity_check, list_manifests, read_manifest, snapshot_backup, write_full_archive, write_incremental_archive,
+    write_manifest,
+)
+
 
 class Command(BaseCommand):
-    help = "Back up the default database (SQLite supported) to a directory with rotation."
+    help = (
+        "Back up the default database (SQLite supported) to a directory with rotation. "
+        "The copy is a snapshot taken inside a read transaction, verified with PRAGMA integrity_check and "
+        "described by a checksum manifest; --incremental stores only changed pages. "
+        "The timesheet archive database (SQLITE_ARCHIVE_PATH) is backed up into the same set. "
+        "An uncompressed copy of the database is written next to the archives first, so the "
+        "destination needs free space for the whole database plus the archive."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("--dest-dir", default=None)
         parser.add_argument("--prefix", default="db_backup")
-        parser.add_argument("--keep", type=int, default=14)
+        parser.add_argument("--keep", type=int, default=14, help="Full backups to keep (with their incrementals)")
         parser.add_argument("--compress", action="store_true", default=True)
         parser.add_argument("--no-compress", action="store_false", dest="compress")
+        parser.add_argument("--incremental", action="store_true", default=False,
+                            help="Store pages changed since the latest backup of the set")
         parser.add_argument("--dry-run", action="store_true", default=False)
 
     def handle(self, *args, **options):
@@ -40,84 +53,167 @@ class Command(BaseCommand):
             raise CommandError("--prefix is empty")
 
         ts = timezone.localtime(timezone.now()).strftime("%Y%m%d_%H%M%S")
-        ext = "zip" if options["compress"] else "sqlite3"
-        out_path = dest_dir / f"{prefix}_{ts}.{ext}"
+        if options["incremental"]:
+            out_path = dest_dir / f"{prefix}_{ts}.inc.zip"
+        else:
+            ext = "zip" if options["compress"] else "sqlite3"
+            out_path = dest_dir / f"{prefix}_{ts}.{ext}"
 
         if options["dry_run"]:
             self.stdout.write(f"Engine: {engine}")
             self.stdout.write(f"Source: {name}")
             self.stdout.write(f"Destination: {out_path}")
+            archive_src = self._archive_source()
+            if archive_src:
+                self.stdout.write(f"Archive database: {archive_src}")
             return
 
+        if not engine.endswith("sqlite3"):
+            raise CommandError(f"Unsupported DB engine for backup command: {engine}")
+        src_path = Path(str(name)).resolve()
+        if not src_path.exists():
+            raise CommandError(f"SQLite file not found: {src_path}")
+
         try:
             dest_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             raise CommandError(f"Cannot create destination directory: {dest_dir} ({e})")
 
-        if engine.endswith("sqlite3"):
-            src_path = Path(str(name)).resolve()
-            if not src_path.exists():
-                raise CommandError(f"SQLite file not found: {src_path}")
-
-            tmp_path = dest_dir / f"{prefix}_{ts}.sqlite3"
-            self._sqlite_backup(src_path, tmp_path)
+        base = self._latest_manifest(dest_dir, prefix) if options["incremental"] else None
+        if options["incremental"] and base is None:
+            raise CommandError("No previous backup in the set; run a full backup first")
 
-            if options["compress"]:
-                self._zip_one(tmp_path, out_path)
-                try:
-                    tmp_path.unlink(missing_ok=True)
-                except Exception:
-                    pass
+        copy_path = dest_dir / f"{prefix}_{ts}.sqlite3"
+        tmp_copy = copy_path if not options["compress"] and not options["incremental"] else copy_path.with_suffix(".tmp")
+        try:
+            # The temporary copy and, when compressing or diffing, the archive next to it
+            in_place = tmp_copy == copy_path
+            check_free_space(dest_dir, database_size(src_path) * (1 if in_place else 2))
+            snapshot_backup(src_path, tmp_copy)
+            ok, message, page_size, page_count = integrity_check(tmp_copy)
+            if not ok:
+                raise CommandError(f"integrity_check failed on the backup copy: {message}")
+
+            manifest = {
+                "created": timezone.now().isoformat(),
+                "source": str(src_path),
+                "archive": out_path.name,
+                "page_size": page_size,
+                "page_count": page_count,
+                "integrity_check": message,
+            }
+            if options["incremental"]:
+                if base["page_size"] != page_size:
+                    raise CommandError("Page size changed since the base backup; run a full backup")
+                base_digests = (dest_dir / base["pages_file"]).read_bytes()
+                db_sha256, digests, changed = write_incremental_archive(tmp_copy, out_path, page_size, base_digests)
+                manifest.update(type="incremental", base=base["archive"], changed_pages=changed)
+            elif options["compress"]:
+                db_sha256, digests = write_full_archive(tmp_copy, out_path, copy_path.name, page_size)
+                manifest.update(type="full", member=copy_path.name)
             else:
-                if out_path != tmp_path:
-                    tmp_path.replace(out_path)
-        else:
-            raise CommandError(f"Unsupported DB engine for backup command: {engine}")
+                db_sha256, digests = hash_pages(tmp_copy, page_size)
+                manifest.update(type="full", member=None)
+        except BaseException as e:
+            # Do not leave a half-written archive behind for rotation to count as a backup
+            out_path.unlink(missing_ok=True)
+            if isinstance(e, BackupError):
+                raise CommandError(str(e))
+            raise
+        finally:
+            if tmp_copy != out_path:
+                tmp_copy.unlink(missing_ok=True)
+
+        # Archive after the main file: months moved in between end up in both copies
+        archive_src = self._archive_source()
+        try:
+            if archive_src and archive_src.exists():
+                manifest["archive_db"] = backup_attached_database(
+                    archive_src, dest_dir, f"{prefix}_{ts}.archive",
+                    base_entry=base.get("archive_db") if base else None,
+                )
+            elif archive_src:
+                # Archive not created yet: nothing was moved out of the main database
+                manifest["archive_db"] = None
+        except BaseException as e:
+            out_path.unlink(missing_ok=True)
+            if isinstance(e, BackupError):
+                raise CommandError(str(e))
+            raise
+
+        pages_path = dest_dir / f"{prefix}_{ts}.pages"
+        pages_path.write_bytes(digests)
+        manifest.update(
+            db_sha256=db_sha256,
+            archive_sha256=file_sha256(out_path),
+            archive_size=out_path.stat().st_size,
+            pages_file=pages_path.name,
+        )
+        write_manifest(dest_dir / f"{prefix}_{ts}.json", manifest)
 
         removed = self._rotate(dest_dir, prefix, keep)
-        self.stdout.write(self.style.SUCCESS(f"Backup created: {out_path}"))
+        if options["incremental"]:
+            self.stdout.write(self.style.SUCCESS(
+                f"Incremental backup created: {out_path} ({manifest['changed_pages']} of {page_count} pages)"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Backup created: {out_path}"))
+        if manifest.get("archive_db"):
+            self.stdout.write(f"Archive database: {manifest['archive_db']['archive']}")
         if removed:
             self.stdout.write(f"Old backups removed: {removed}")
 
-    def _sqlite_backup(self, src_path: Path, dest_path: Path):
-        try:
-            if dest_path.exists():
-                dest_path.unlink()
-        except Exception:
-            pass
+    def _archive_source(self):
+        path = getattr(settings, "SQLITE_ARCHIVE_PATH", "") or ""
+        return Path(path).resolve() if path else None
 
-        src = sqlite3.connect(str(src_path))
-        try:
-            dest = sqlite3.connect(str(dest_path))
+    def _latest_manifest(self, dest_dir: Path, prefix: str):
+        for path in list_manifests(dest_dir, prefix):
             try:
-                src.backup(dest)
-            finally:
-                dest.close()
-        finally:
-            src.close()
-
-    def _zip_one(self, file_path: Path, zip_path: Path):
-        with zipfile.ZipFile(str(zip_path), mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.write(str(file_path), arcname=file_path.name)
+                manifest = read_manifest(path)
+            except BackupError:
+                continue
+            if (dest_dir / manifest.get("archive", "")).exists() and manifest.get("pages_file"):
+                return manifest
+        return None
 
     def _rotate(self, dest_dir: Path, prefix: str, keep: int):
-        items = []
+        """
+        Keep the `keep` newest full backups and the incrementals built on them.
+
+        Files are ordered by the timestamp in their name rather than mtime, so
+        copying the directory around does not change what gets deleted.
+        """
+        # Full backups: manifests of type "full" and older archives without a manifest
+        fulls = set()
         for p in dest_dir.iterdir():
-            if not p.is_file():
+            ts = backup_timestamp(p)
+            if not ts or not p.name.startswith(prefix + "_") or p.suffix not in (".zip", ".sqlite3"):
                 continue
-            if not p.name.startswith(prefix + "_"):
+            manifest_path = dest_dir / f"{prefix}_{ts}.json"
+            if not manifest_path.exists():
+                fulls.add(ts)
                 continue
-            if not (p.name.endswith(".zip") or p.name.endswith(".sqlite3")):
+            try:
+                if read_manifest(manifest_path).get("type") == "full":
+                    fulls.add(ts)
+            except BackupError:
                 continue
-            items.append(p)
+        fulls = sorted(fulls, reverse=True)
+        if len(fulls) <= keep:
+            return 0
+        cutoff = fulls[keep - 1]
 
-        items.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-        to_remove = items[keep:]
         removed = 0
-        for p in to_remove:
-            try:
-                p.unlink()
-                removed += 1
-            except Exception:
+        for p in dest_dir.iterdir():
+            if not p.is_file() or not p.name.startswith(prefix + "_"):
                 continue
+            ts = backup_timestamp(p)
+            if ts and ts < cutoff:
+                try:
+                    p.unlink()
+                except Exception:
+                    continue
+                if p.suffix in (".zip", ".sqlite3") and not p.name.endswith(".archive.zip"):
+                    removed += 1
         return removed
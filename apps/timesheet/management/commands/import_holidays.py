@@ -1,31 +1,30 @@
-import pandas as pd
+from apps.core.spreadsheets import iter_rows, to_date, SpreadsheetError
 from apps.timesheet.models import Holiday
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 class Command(BaseCommand):
     help = "Импорт выходных и праздников из Excel"
 
     def add_arguments(self, parser):
-        parser.add_argument("filename", type=str, help="Путь к Excel файлу")
+        parser.add_argument("filename", type=str, help="Путь к файлу .xlsx, .xls или .csv")
 
     def handle(self, *args, **options):
         filename = options["filename"]
-        df = pd.read_excel(filename, header=None)
 
-        for row in df.iloc[1:].itertuples(index=False):
-            for cell in row:
-                if pd.notna(cell):
-                    try:
-                        # пробуем преобразовать в дату
-                        day = pd.to_datetime(cell, errors="coerce")
-                        if pd.notna(day):
-                            Holiday.objects.get_or_create(
-                                date=day.date(),
-                                defaults={"type": "holiday", "name": "Выходной"}
-                            )
-                        else:
-                            self.stdout.write(self.style.WARNING(f"Пропущено: {cell}"))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f"Ошибка для {cell}: {e}"))
+        try:
+            for row in iter_rows(filename, skip_rows=1):
+                for cell in row:
+                    if cell in (None, ""):
+                        continue
+                    day = to_date(cell)
+                    if day:
+                        Holiday.objects.get_or_create(
+                            date=day,
+                            defaults={"type": "holiday", "name": "Выходной"}
+                        )
+                    else:
+                        self.stdout.write(self.style.WARNING(f"Пропущено: {cell}"))
+        except SpreadsheetError as e:
+            raise CommandError(str(e))
 
         self.stdout.write(self.style.SUCCESS("Импорт завершён"))
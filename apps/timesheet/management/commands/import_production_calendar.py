@@ -0,0 +1,208 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from datetime import date, timedelta
+from apps.core.spreadsheets import iter_rows, iter_records, map_columns, normalize_header, to_date, SpreadsheetError
+from apps.timesheet.models import Holiday, WorkdaySwap
+from apps.timesheet.utils import bump_calendar_cache_version
+import os
+import re
+from itertools import chain
+
+TYPE_ALIASES = {
+    'holiday': 'holiday', 'праздник': 'holiday', 'выходной': 'holiday',
+    'preholiday': 'preholiday', 'предпраздник': 'preholiday', 'предпраздничный': 'preholiday',
+    'сокращенный': 'preholiday', 'сокращённый': 'preholiday',
+    'swap': 'swap', 'перенос': 'swap',
+}
+DEFAULT_NAMES = {'holiday': 'Выходной', 'preholiday': 'Предпраздничный день'}
+COLUMNS = {
+    'date': ['date', 'дата'],
+    'type': ['type', 'тип'],
+    'name': ['name', 'название', 'наименование'],
+    'swap_with': ['swap_with', 'date_b', 'перенос', 'перенос на'],
+}
+
+def parse_type(value, default):
+    key = normalize_header(value)
+    if not key:
+        return default
+    return TYPE_ALIASES.get(key)
+
+def iter_table(rows, default_type):
+    """
+    Строки таблицы (XLSX/CSV) в записи календаря.
+
+    С заголовком (дата, тип, название, перенос) — по строке на день; без заголовка
+    (старый формат import_holidays) каждая ячейка-дата считается днем типа default_type.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+
+    if 'date' not in map_columns(first, COLUMNS):
+        # Сетка дат; первая строка — подписи месяцев, как в import_holidays
+        for cells in rows:
+            for cell in cells:
+                if cell in (None, ''):
+                    continue
+                day = to_date(cell)
+                if day:
+                    yield {'date': day, 'type': default_type, 'name': ''}
+                else:
+                    yield {'error': f'Пропущено: {cell}'}
+        return
+
+    for row_number, record in iter_records(chain([first], rows), COLUMNS, dates=('date',)):
+        day = record['date']
+        kind = parse_type(record.get('type'), default_type)
+        if day is None or kind is None:
+            yield {'error': f'Строка {row_number}: некорректная дата или тип'}
+            continue
+        swap_with = record.get('swap_with')
+        if kind == 'swap' or swap_with not in (None, ''):
+            other = to_date(swap_with)
+            if other is None or other == day:
+                yield {'error': f'Строка {row_number}: некорректный перенос'}
+                continue
+            yield {'date': day, 'type': 'swap', 'swap_with': other}
+            continue
+        yield {'date': day, 'type': kind, 'name': str(record.get('name') or '').strip()[:100]}
+
+def iter_ical(lines, default_type):
+    """События VEVENT с датами (DTSTART;VALUE=DATE) в записи календаря; DTEND не включается"""
+    unfolded = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and unfolded:
+            unfolded[-1] += line[1:]
+        else:
+            unfolded.append(line)
+    event = None
+    for line in unfolded:
+        if line == 'BEGIN:VEVENT':
+            event = {}
+        elif line == 'END:VEVENT' and event is not None:
+            start = to_date(event.get('DTSTART'))
+            if start is None:
+                yield {'error': f"Событие без даты: {event.get('SUMMARY', '')}"}
+            else:
+                end = to_date(event.get('DTEND')) or start + timedelta(days=1)
+                summary = event.get('SUMMARY', '').replace('\\,', ',').strip()
+                kind = default_type
+                if re.search(r'предпраздн|сокращ', summary, re.IGNORECASE):
+                    kind = 'preholiday'
+                day = start
+                while day < end:
+                    yield {'date': day, 'type': kind, 'name': summary[:100]}
+                    day += timedelta(days=1)
+            event = None
+        elif event is not None and ':' in line:
+            name, value = line.split(':', 1)
+            event[name.split(';', 1)[0].upper()] = value.strip()
+
+def read_entries(filename, default_type, sheet_name=None):
+    ext = os.path.splitext(filename)[1].lower()
+    try:
+        if ext in ('.ics', '.ical'):
+            with open(filename, encoding='utf-8-sig') as f:
+                yield from iter_ical(f, default_type)
+        else:
+            yield from iter_table(iter_rows(filename, sheet_name=sheet_name), default_type)
+    except SpreadsheetError as e:
+        raise CommandError(f'{e} (также поддерживается .ics)')
+    except OSError as e:
+        raise CommandError(f'Не удалось прочитать файл: {e}')
+
+class Command(BaseCommand):
+    help = "Импорт производственного календаря (праздники, предпраздничные дни, переносы) из XLSX, CSV или iCalendar"
+
+    def add_arguments(self, parser):
+        parser.add_argument("filenames", nargs="+", type=str, help="Файлы .xlsx, .xls, .csv или .ics")
+        parser.add_argument("--type", choices=["holiday", "preholiday"], default="holiday",
+                            help="Тип дней для файлов без колонки типа")
+        parser.add_argument("--sheet", type=str, help="Имя листа", default=None)
+        parser.add_argument("--keep-missing", action="store_true",
+                            help="Не удалять записи за загружаемые годы, отсутствующие в файлах")
+        parser.add_argument("--dry-run", action="store_true", help="Показать изменения без записи в БД")
+
+    def handle(self, *args, **options):
+        holidays = {}
+        swaps = set()
+        errors = 0
+        for filename in options["filenames"]:
+            for entry in read_entries(filename, options["type"], options.get("sheet")):
+                if 'error' in entry:
+                    errors += 1
+                    self.stdout.write(self.style.WARNING(entry['error']))
+                elif entry['type'] == 'swap':
+                    swaps.add(tuple(sorted((entry['date'], entry['swap_with']))))
+                else:
+                    holidays[entry['date']] = (entry['type'], entry['name'] or DEFAULT_NAMES[entry['type']])
+        if not holidays and not swaps:
+            raise CommandError("В файлах не найдено ни одной даты")
+
+        years = sorted({d.year for d in holidays} | {d.year for pair in swaps for d in pair})
+        imported_types = {kind for kind, _ in holidays.values()}
+        # Диапазоны дат вместо __year, чтобы работали индексы по датам
+        year_ranges = [(date(y, 1, 1), date(y, 12, 31)) for y in years]
+
+        def years_q(field):
+            q = Q()
+            for year_range in year_ranges:
+                q |= Q(**{f'{field}__range': year_range})
+            return q
+
+        # Holiday: сравнение с существующими записями за загружаемые годы
+        existing = {h.date: h for h in Holiday.objects.filter(years_q('date'))}
+        holiday_create, holiday_update = [], []
+        for day, (kind, name) in holidays.items():
+            h = existing.get(day)
+            if h is None:
+                holiday_create.append(Holiday(date=day, type=kind, name=name))
+            elif h.type != kind or (h.name or '') != name:
+                h.type, h.name = kind, name
+                holiday_update.append(h)
+        holiday_delete = []
+        if not options["keep_missing"]:
+            holiday_delete = [h.pk for day, h in existing.items() if day not in holidays and h.type in imported_types]
+
+        # WorkdaySwap: пары дат без учета порядка
+        existing_swaps = {}
+        for s in WorkdaySwap.objects.filter(years_q('date_a') | years_q('date_b')):
+            existing_swaps[tuple(sorted((s.date_a, s.date_b)))] = s
+        swap_create = [WorkdaySwap(date_a=a, date_b=b, is_active=True) for a, b in swaps if (a, b) not in existing_swaps]
+        swap_update = []
+        for pair in swaps:
+            s = existing_swaps.get(pair)
+            if s is not None and not s.is_active:
+                s.is_active = True
+                swap_update.append(s)
+        swap_delete = []
+        if swaps and not options["keep_missing"]:
+            swap_delete = [s.pk for pair, s in existing_swaps.items() if pair not in swaps]
+
+        summary = (
+            f"Годы: {', '.join(map(str, years))}. Праздники: +{len(holiday_create)}, "
+            f"изменено {len(holiday_update)}, удалено {len(holiday_delete)}. "
+            f"Переносы: +{len(swap_create)}, включено {len(swap_update)}, удалено {len(swap_delete)}. "
+            f"Пропущено строк: {errors}."
+        )
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Пробный запуск (--dry-run), изменения не записаны. {summary}"))
+            return
+
+        with transaction.atomic():
+            if holiday_delete:
+                Holiday.objects.filter(pk__in=holiday_delete).delete()
+            if swap_delete:
+                WorkdaySwap.objects.filter(pk__in=swap_delete).delete()
+            Holiday.objects.bulk_create(holiday_create, batch_size=500)
+            if holiday_update:
+                Holiday.objects.bulk_update(holiday_update, ['type', 'name'], batch_size=500)
+            WorkdaySwap.objects.bulk_create(swap_create, batch_size=500)
+            if swap_update:
+                WorkdaySwap.objects.bulk_update(swap_update, ['is_active'], batch_size=500)
+        bump_calendar_cache_version()
+        self.stdout.write(self.style.SUCCESS(f"Импорт календаря завершён. {summary}"))
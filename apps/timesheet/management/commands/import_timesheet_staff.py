@@ -1,11 +1,25 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils.text import slugify
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from apps.users.models import User, Employee, Department, EmployeeAssignment
+from apps.users.utils import bump_autocomplete_cache_version
+from apps.core.spreadsheets import iter_rows, iter_records, map_columns, to_text, SpreadsheetError
 from django.db.models import Q
+from itertools import chain
 import re
 import os
+import time
+
+COLUMNS = {
+    'employee_id': ['табельный', 'табельный номер', 'таб. №', 'таб.№', 'таб №', 'employee_id'],
+    'fio': ['фио', 'ф.и.о.', 'сотрудник', 'фио сотрудника'],
+    'department': ['отдел', 'подразделение', 'участок', 'department'],
+    'position': ['должность', 'профессия', 'position'],
+    'master': ['фио мастера', 'мастер', 'master'],
+}
+# Заголовок для файлов без распознанных колонок: поля по порядку
+POSITIONAL_HEADER = tuple(aliases[0] for aliases in COLUMNS.values())
 
 RU_MONTHS = {
     'январь': 1, 'февраль': 2, 'март': 3, 'апрель': 4, 'май': 5, 'июнь': 6,
@@ -28,55 +42,312 @@ def gen_unique_employee_id(prefix, base):
     ts = datetime.now().strftime("%Y%m%d%H%M%S%f")[-8:]
     return f"{prefix.upper()}-{base_slug}-{ts}".upper()
 
-def find_or_create_department(name):
-    if not name:
-        return None
-    name = str(name).strip()
-    dep = Department.objects.filter(name__iexact=name).first()
-    if dep:
-        return dep
+def normalize_name(value):
+    """Ключ для сопоставления названий и ФИО: без лишних пробелов, в нижнем регистре"""
+    return re.sub(r'\s+', ' ', str(value or '')).strip().lower()
+
+def unique_department_code(name, taken_codes):
     code_base = slugify(name).upper()[:8] or "DEP"
     code = code_base
     i = 1
-    while Department.objects.filter(code=code).exists():
+    while code in taken_codes:
         code = f"{code_base[:6]}{i:02d}"
         i += 1
-    return Department.objects.create(name=name, code=code)
-
-def find_or_create_master(last, first, middle, department=None):
-    if not last and not first:
-        return None
-    qs = User.objects.filter(
-        last_name__iexact=last,
-        first_name__iexact=first
-    )
-    if middle:
-        qs = qs.filter(middle_name__iexact=middle)
-    master = qs.filter(role='master').first()
-    if master:
-        if department and master.department != department:
-            master.department = master.department or department
-            master.save(update_fields=['department'])
-        return master
-    username_base = slugify(f"{last}-{first}-{middle}") or slugify(f"{last}-{first}") or f"master"
+    taken_codes.add(code)
+    return code
+
+def unique_username(last, first, middle, taken_usernames):
+    username_base = slugify(f"{last}-{first}-{middle}") or slugify(f"{last}-{first}") or "master"
     username = username_base
     i = 1
-    while User.objects.filter(username=username).exists():
+    while username in taken_usernames:
         username = f"{username_base}{i}"
         i += 1
-    emp_id = gen_unique_employee_id("M", f"{last}{first}")
-    password = User.objects.make_random_password()
-    master = User.objects.create_user(
-        username=username,
-        password=password,
-        first_name=first or "",
-        last_name=last or "",
-        middle_name=middle or "",
-        role='master',
-        employee_id=emp_id,
-        department=department
-    )
-    return master
+    taken_usernames.add(username)
+    return username
+
+def unique_employee_id(prefix, base, taken_ids):
+    emp_id = gen_unique_employee_id(prefix, base)
+    i = 1
+    while emp_id in taken_ids:
+        emp_id = f"{gen_unique_employee_id(prefix, base)}-{i}"
+        i += 1
+    taken_ids.add(emp_id)
+    return emp_id
+
+def obj_key(obj):
+    """Ключ объекта для индексов: pk для сохранённых, идентичность для новых"""
+    return obj.pk if obj.pk is not None else ('new', id(obj))
+
+class StaffIndex:
+    """
+    Справочники, загруженные из БД одним проходом, и накопленные изменения.
+
+    Все сопоставления (отдел по названию, мастер по ФИО, сотрудник по
+    табельному номеру) выполняются в памяти; запись — пакетами в write().
+    """
+
+    def __init__(self, start_date, close_previous=False):
+        self.start_date = start_date
+        self.close_previous = close_previous
+        self.departments = {}
+        self.department_codes = set()
+        for dep in Department.objects.only('id', 'name', 'code').order_by('id'):
+            self.departments.setdefault(normalize_name(dep.name), dep)
+            self.department_codes.add(dep.code)
+
+        self.usernames = set()
+        self.employee_ids = set()
+        self.users_by_pk = {}
+        self.users_by_employee_id = {}
+        self.masters_by_fio = {}
+        self.masters_by_short_fio = {}
+        for user in User.objects.only(
+            'id', 'username', 'employee_id', 'role', 'last_name', 'first_name',
+            'middle_name', 'department_id', 'position'
+        ).order_by('id'):
+            self._index_user(user)
+
+        self.employees_by_user = {}
+        self.employees_by_own_id = {}
+        for emp in Employee.objects.only(
+            'id', 'user_id', 'employee_id_own', 'position_own', 'department_own_id',
+            'last_name', 'first_name', 'middle_name',
+        ).order_by('id'):
+            if emp.user_id:
+                self.employees_by_user.setdefault(emp.user_id, emp)
+            elif emp.employee_id_own:
+                self.employees_by_own_id.setdefault(emp.employee_id_own, emp)
+                self.employee_ids.add(emp.employee_id_own)
+
+        self.assignment_keys = set()
+        self.open_assignments = {}
+        for pk, employee_id, master_id, assignment_start in EmployeeAssignment.objects.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=start_date)
+        ).values_list('id', 'employee_id', 'master_id', 'start_date'):
+            self.assignment_keys.add((employee_id, master_id))
+            self.open_assignments.setdefault(employee_id, []).append((pk, master_id, assignment_start))
+
+        self.new_departments = []
+        self.new_masters = []
+        self.new_employees = []
+        self.new_assignments = []
+        self.file_masters = {}
+        self.closed_assignments = []
+        self.user_updates = {}
+        self.employee_updates = {}
+
+    def _index_user(self, user):
+        self.usernames.add(user.username)
+        self.employee_ids.add(user.employee_id)
+        self.users_by_employee_id[user.employee_id] = user
+        if user.pk is not None:
+            self.users_by_pk[user.pk] = user
+        if user.role == 'master':
+            last, first = normalize_name(user.last_name), normalize_name(user.first_name)
+            self.masters_by_fio.setdefault((last, first, normalize_name(user.middle_name)), user)
+            self.masters_by_short_fio.setdefault((last, first), user)
+
+    @staticmethod
+    def _mark(updates, obj, field):
+        # Новые объекты уйдут в bulk_create целиком, обновлять нужно только существующие
+        if obj.pk is not None:
+            updates.setdefault(obj.pk, (obj, set()))[1].add(field)
+
+    def department(self, name):
+        if not name:
+            return None
+        key = normalize_name(name)
+        dep = self.departments.get(key)
+        if dep is None:
+            name = str(name).strip()
+            dep = Department(name=name, code=unique_department_code(name, self.department_codes))
+            self.departments[key] = dep
+            self.new_departments.append(dep)
+        return dep
+
+    def master(self, last, first, middle, department=None):
+        if not last and not first:
+            return None
+        if middle:
+            master = self.masters_by_fio.get(
+                (normalize_name(last), normalize_name(first), normalize_name(middle))
+            )
+        else:
+            master = self.masters_by_short_fio.get((normalize_name(last), normalize_name(first)))
+        if master:
+            if department and master.department_id is None and master.department is None:
+                master.department = department
+                self._mark(self.user_updates, master, 'department')
+            return master
+        master = User(
+            username=unique_username(last, first, middle, self.usernames),
+            first_name=first or "",
+            last_name=last or "",
+            middle_name=middle or "",
+            role='master',
+            employee_id=unique_employee_id("M", f"{last}{first}", self.employee_ids),
+            department=department,
+        )
+        # Пароль выдаётся позже командой export_master_credentials
+        master.set_unusable_password()
+        self._index_user(master)
+        self.new_masters.append(master)
+        return master
+
+    def employee(self, employee_id_val, fio_val, dep, position_val):
+        """Сотрудник по табельному номеру; возвращает (сотрудник, создан ли)"""
+        e_user = self.users_by_employee_id.get(employee_id_val) if employee_id_val else None
+        if e_user:
+            emp = self.employees_by_user.get(obj_key(e_user))
+            created = emp is None
+            if created:
+                emp = Employee(user=e_user, is_active=True)
+                self.employees_by_user[obj_key(e_user)] = emp
+                self.new_employees.append(emp)
+            if dep and e_user.department_id is None and e_user.department is None:
+                e_user.department = dep
+                self._mark(self.user_updates, e_user, 'department')
+            if position_val and not e_user.position:
+                e_user.position = position_val
+                self._mark(self.user_updates, e_user, 'position')
+            return emp, created
+
+        e_last, e_first, e_middle = parse_fio(fio_val)
+        own_id = employee_id_val or unique_employee_id("E", f"{e_last}{e_first}", self.employee_ids)
+        emp = self.employees_by_own_id.get(own_id)
+        if emp is None:
+            emp = Employee(
+                employee_id_own=own_id,
+                last_name=e_last,
+                first_name=e_first,
+                middle_name=e_middle,
+                position_own=position_val or "",
+                department_own=dep,
+                is_active=True,
+            )
+            self.employees_by_own_id[own_id] = emp
+            self.employee_ids.add(own_id)
+            self.new_employees.append(emp)
+            return emp, True
+        if position_val and not emp.position_own:
+            emp.position_own = position_val
+            self._mark(self.employee_updates, emp, 'position_own')
+        if dep and emp.department_own_id is None and emp.department_own is None:
+            emp.department_own = dep
+            self._mark(self.employee_updates, emp, 'department_own')
+        return emp, False
+
+    def assign(self, emp, master):
+        self.file_masters.setdefault(obj_key(emp), (emp, set()))[1].add(obj_key(master))
+        key = (obj_key(emp), obj_key(master))
+        if key in self.assignment_keys:
+            return False
+        self.assignment_keys.add(key)
+        self.new_assignments.append(EmployeeAssignment(
+            employee=emp, master=master, start_date=self.start_date, end_date=None
+        ))
+        return True
+
+    def plan_closes(self):
+        """
+        С --close-previous: открытые назначения сотрудников из файла к мастерам,
+        которых нет в файле, закрываются днем раньше начала периода.
+        Назначения, начавшиеся в самом периоде, не трогаются.
+        """
+        self.closed_assignments = []
+        if not self.close_previous:
+            return
+        for emp_key, (emp, masters) in self.file_masters.items():
+            for pk, master_id, assignment_start in self.open_assignments.get(emp_key, ()):
+                if master_id not in masters and assignment_start < self.start_date:
+                    self.closed_assignments.append((pk, emp, master_id))
+
+    def employee_label(self, emp):
+        user = self.users_by_pk.get(emp.user_id) if emp.user_id else None
+        if user is None and emp.user_id is None and Employee.user.is_cached(emp):
+            user = emp.user
+        if user is not None:
+            return f"{user.get_full_name()} ({user.employee_id})"
+        return f"{emp.full_name} ({emp.employee_id_own})"
+
+    def describe(self):
+        """Строки плана изменений для --dry-run"""
+        for dep in self.new_departments:
+            yield f"  + отдел: {dep.name} ({dep.code})"
+        for master in self.new_masters:
+            yield f"  + мастер: {master.get_full_name()} ({master.username})"
+        for emp in self.new_employees:
+            yield f"  + сотрудник: {self.employee_label(emp)}"
+        for assignment in self.new_assignments:
+            yield (
+                f"  + назначение: {self.employee_label(assignment.employee)} -> "
+                f"{assignment.master.get_full_name()} с {assignment.start_date:%d.%m.%Y}"
+            )
+        end_date = self.start_date - timedelta(days=1)
+        for _, emp, master_id in self.closed_assignments:
+            master = self.users_by_pk.get(master_id)
+            yield (
+                f"  - назначение: {self.employee_label(emp)} -> "
+                f"{master.get_full_name() if master else master_id} по {end_date:%d.%m.%Y}"
+            )
+        for user, fields in self.user_updates.values():
+            changes = ', '.join(f"{field}={getattr(user, field)}" for field in sorted(fields) if field != 'search_text')
+            yield f"  ~ пользователь {user.get_full_name()} ({user.employee_id}): {changes}"
+        for emp, fields in self.employee_updates.values():
+            changes = ', '.join(f"{field}={getattr(emp, field)}" for field in sorted(fields) if field != 'search_text')
+            yield f"  ~ сотрудник {self.employee_label(emp)}: {changes}"
+
+    def write(self, batch_size):
+        """
+        Запись накопленных изменений пакетами (вызывать внутри transaction.atomic).
+
+        Порядок важен: bulk_create проставляет pk созданным объектам, и ссылки
+        на них (отдел мастера, мастер назначения) подхватываются при следующей вставке.
+        """
+        self._refresh_search_text()
+        Department.objects.bulk_create(self.new_departments, batch_size=batch_size)
+        if self.new_departments:
+            Department.rebuild_paths()
+        User.objects.bulk_create(self.new_masters, batch_size=batch_size)
+        for fields, objs in self._group_updates(self.user_updates).items():
+            User.objects.bulk_update(objs, sorted(fields), batch_size=batch_size)
+        Employee.objects.bulk_create(self.new_employees, batch_size=batch_size)
+        for fields, objs in self._group_updates(self.employee_updates).items():
+            Employee.objects.bulk_update(objs, sorted(fields), batch_size=batch_size)
+        EmployeeAssignment.objects.bulk_create(self.new_assignments, batch_size=batch_size)
+        if self.closed_assignments:
+            EmployeeAssignment.objects.filter(
+                pk__in=[pk for pk, _, _ in self.closed_assignments]
+            ).update(end_date=self.start_date - timedelta(days=1))
+        bump_autocomplete_cache_version()
+
+    def _refresh_search_text(self):
+        """search_text для bulk_create/bulk_update: save() при пакетной записи не вызывается"""
+        for user in self.new_masters:
+            user.search_text = user.get_search_text()
+        for user, fields in self.user_updates.values():
+            if 'position' not in fields:
+                continue
+            user.search_text = user.get_search_text()
+            fields.add('search_text')
+            emp = self.employees_by_user.get(obj_key(user))
+            if emp is not None and emp.pk is not None:
+                emp.search_text = Employee.search_text_for_user(user)
+                self._mark(self.employee_updates, emp, 'search_text')
+        for emp in self.new_employees:
+            emp.search_text = emp.get_search_text()
+        for emp, fields in self.employee_updates.values():
+            if 'position_own' in fields:
+                emp.search_text = emp.get_search_text()
+                fields.add('search_text')
+
+    @staticmethod
+    def _group_updates(updates):
+        grouped = {}
+        for obj, fields in updates.values():
+            grouped.setdefault(frozenset(fields), []).append(obj)
+        return grouped
 
 def get_month_period_from_filename(filename, year=None, month=None):
     if year and month:
@@ -108,106 +379,81 @@ def get_month_period_from_filename(filename, year=None, month=None):
     today = date.today()
     return today.replace(day=1), today
 
+def read_rows(filename, sheet_name=None, header=0):
+    """
+    Строки файла как кортежи из 5 строк: табельный, ФИО, отдел, должность, ФИО мастера.
+
+    Колонки ищутся по заголовку (COLUMNS); если в заголовке нет ФИО сотрудника
+    и мастера, берутся первые 5 колонок по порядку, как в прежнем формате.
+    """
+    try:
+        rows = iter_rows(filename, sheet_name=sheet_name, skip_rows=header)
+        columns = next(rows, None)
+        if columns is None:
+            raise CommandError("Файл пуст")
+        mapping = map_columns(columns, COLUMNS)
+        if not {'fio', 'master'} <= mapping.keys():
+            if len(columns) < 5:
+                raise CommandError("Ожидалось минимум 5 колонок: табельный, ФИО, отдел, должность, ФИО мастера")
+            columns = POSITIONAL_HEADER
+        for _, record in iter_records(chain([columns], rows), COLUMNS):
+            yield tuple(to_text(record.get(field)) for field in COLUMNS)
+    except SpreadsheetError as e:
+        raise CommandError(str(e))
+
 class Command(BaseCommand):
-    help = "Импорт сотрудников и мастеров из файла табеля Excel (.xls/.xlsx)"
+    help = "Импорт сотрудников и мастеров из файла табеля (.xlsx/.xls/.csv)"
 
     def add_arguments(self, parser):
-        parser.add_argument("filename", type=str, help="Путь к Excel файлу")
+        parser.add_argument("filename", type=str, help="Путь к файлу .xlsx, .xls или .csv")
         parser.add_argument("--year", type=int, help="Год табеля", default=None)
         parser.add_argument("--month", type=int, help="Месяц табеля (1-12)", default=None)
         parser.add_argument("--sheet", type=str, help="Имя листа", default=None)
         parser.add_argument("--header", type=int, help="Номер строки заголовка (0-индекс)", default=0)
+        parser.add_argument("--batch-size", type=int, default=500, help="Размер пакета при записи в БД")
+        parser.add_argument("--close-previous", action="store_true",
+                            help="Закрыть открытые назначения сотрудников к мастерам, которых нет в файле")
+        parser.add_argument("--dry-run", action="store_true", help="Показать изменения без записи в БД")
 
     def handle(self, *args, **options):
         filename = options["filename"]
-        year = options.get("year")
-        month = options.get("month")
-        sheet_name = options.get("sheet")
-        header = options.get("header", 0)
-        try:
-            import pandas as pd
-        except Exception as e:
-            raise CommandError("Требуется библиотека pandas для импорта")
-        engine = None
-        if filename.lower().endswith(".xls"):
-            engine = "xlrd"
-        try:
-            if sheet_name is None:
-                sheet_name = 0
-            df = pd.read_excel(filename, header=header, sheet_name=sheet_name, engine=engine)
-        except Exception as e:
-            raise CommandError(f"Не удалось прочитать файл: {e}")
-        cols = list(df.columns)
-        if len(cols) < 5:
-            raise CommandError("Ожидалось минимум 5 колонок: табельный, ФИО, отдел, должность, ФИО мастера")
-        start_date, end_date = get_month_period_from_filename(filename, year, month)
-        created_users = []
+        batch_size = max(1, options["batch_size"])
+        dry_run = options["dry_run"]
+        started = time.monotonic()
+        start_date, end_date = get_month_period_from_filename(filename, options.get("year"), options.get("month"))
+
+        index = StaffIndex(start_date, options["close_previous"])
+        rows = 0
         created_employees = 0
-        created_assignments = 0
-        with transaction.atomic():
-            for i, row in df.iterrows():
-                try:
-                    employee_id_val = str(row.iloc[0]).strip() if not pd.isna(row.iloc[0]) else ""
-                    fio_val = str(row.iloc[1]).strip() if not pd.isna(row.iloc[1]) else ""
-                    department_val = str(row.iloc[2]).strip() if not pd.isna(row.iloc[2]) else ""
-                    position_val = str(row.iloc[3]).strip() if not pd.isna(row.iloc[3]) else ""
-                    master_raw = str(row.iloc[4]).strip() if not pd.isna(row.iloc[4]) else ""
-                    if not employee_id_val and not fio_val:
-                        continue
-                    dep = find_or_create_department(department_val) if department_val else None
-                    m_last, m_first, m_middle = parse_fio(master_raw)
-                    master_user = find_or_create_master(m_last, m_first, m_middle, dep)
-                    e_user = None
-                    if employee_id_val:
-                        e_user = User.objects.filter(employee_id=employee_id_val).first()
-                    if e_user:
-                        emp, _ = Employee.objects.get_or_create(user=e_user, defaults={"is_active": True})
-                        if dep and e_user.department != dep:
-                            e_user.department = e_user.department or dep
-                            e_user.save(update_fields=['department'])
-                    else:
-                        e_last, e_first, e_middle = parse_fio(fio_val)
-                        emp, created = Employee.objects.get_or_create(
-                            user=None,
-                            employee_id_own=employee_id_val or gen_unique_employee_id("E", f"{e_last}{e_first}"),
-                            defaults={
-                                "last_name": e_last,
-                                "first_name": e_first,
-                                "middle_name": e_middle,
-                                "position_own": position_val or "",
-                                "department_own": dep,
-                                "is_active": True
-                            }
-                        )
-                        if created:
-                            created_employees += 1
-                        else:
-                            if position_val and not emp.position_own:
-                                emp.position_own = position_val
-                            if dep and not emp.department_own:
-                                emp.department_own = dep
-                            emp.save()
-                    if position_val:
-                        if emp.user and not emp.user.position:
-                            emp.user.position = position_val
-                            emp.user.save(update_fields=['position'])
-                        elif not emp.user and not emp.position_own:
-                            emp.position_own = position_val
-                            emp.save(update_fields=['position_own'])
-                    if master_user:
-                        overlap = EmployeeAssignment.objects.filter(employee=emp, master=master_user).filter(
-                            Q(end_date__isnull=True) | Q(end_date__gte=start_date)
-                        ).exists()
-                        if not overlap:
-                            EmployeeAssignment.objects.create(
-                                employee=emp,
-                                master=master_user,
-                                start_date=start_date,
-                                end_date=None
-                            )
-                            created_assignments += 1
-                except Exception as e:
-                    raise
+        for employee_id_val, fio_val, department_val, position_val, master_raw in read_rows(
+            filename, options.get("sheet"), options.get("header", 0)
+        ):
+            if not employee_id_val and not fio_val:
+                continue
+            rows += 1
+            dep = index.department(department_val)
+            master_user = index.master(*parse_fio(master_raw), dep)
+            emp, created = index.employee(employee_id_val, fio_val, dep, position_val)
+            if created:
+                created_employees += 1
+            if master_user:
+                index.assign(emp, master_user)
+
+        index.plan_closes()
+        if dry_run:
+            self.stdout.write(self.style.WARNING("Пробный запуск (--dry-run): изменения не записаны"))
+            for line in index.describe():
+                self.stdout.write(line)
+        else:
+            with transaction.atomic():
+                index.write(batch_size)
+
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed > 0 else rows
         self.stdout.write(self.style.SUCCESS(
-            f"Импорт завершён. Сотрудники: +{created_employees}, назначений создано: {created_assignments}."
+            f"Импорт завершён. Строк: {rows}, отделов: +{len(index.new_departments)}, "
+            f"мастеров: +{len(index.new_masters)}, сотрудники: +{created_employees}, "
+            f"обновлено пользователей: {len(index.user_updates)}, сотрудников: {len(index.employee_updates)}, "
+            f"назначений создано: {len(index.new_assignments)}, закрыто: {len(index.closed_assignments)}. "
+            f"Время: {elapsed:.2f} с ({rate:.0f} строк/с)."
         ))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.users.models import User
+from apps.timesheet.models import Timesheet, ItrTimesheet
+from apps.timesheet.utils import import_timesheet_grid, write_import_errors_report
+from apps.timesheet.management.commands.import_timesheet_staff import get_month_period_from_filename
+import time
+
+
+class Command(BaseCommand):
+    help = "Импорт значений табеля (сетка сотрудники × дни) из .xlsx/.xls/.csv в Timesheet/ItrTimesheet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("filename", type=str, help="Путь к файлу .xlsx, .xls или .csv")
+        parser.add_argument("--year", type=int, help="Год табеля", default=None)
+        parser.add_argument("--month", type=int, help="Месяц табеля (1-12)", default=None)
+        parser.add_argument("--sheet", type=str, help="Имя листа", default=None)
+        parser.add_argument("--type", choices=["main", "itr"], default="main", help="Основной табель или табель ИТР")
+        parser.add_argument("--user", type=str, default=None,
+                            help="Логин пользователя, от имени которого выполняется импорт (по умолчанию — суперпользователь)")
+        parser.add_argument("--chunk-size", type=int, default=100, help="Строк листа в одной транзакции")
+
+    def handle(self, *args, **options):
+        filename = options["filename"]
+        year, month = options.get("year"), options.get("month")
+        if not (year and month):
+            start_date, _ = get_month_period_from_filename(filename, year, month)
+            year, month = start_date.year, start_date.month
+
+        if options["user"]:
+            user = User.objects.filter(username=options["user"]).first()
+            if not user:
+                raise CommandError(f"Пользователь {options['user']} не найден")
+        else:
+            user = User.objects.filter(is_superuser=True, is_active=True).order_by("id").first()
+            if not user:
+                raise CommandError("Укажите --user: суперпользователь не найден")
+
+        TimesheetModel = ItrTimesheet if options["type"] == "itr" else Timesheet
+        self.stdout.write(f"Импорт {filename} за {month:02d}.{year} ({options['type']}) от имени {user.username}")
+        started = time.monotonic()
+
+        def progress(rows):
+            self.stdout.write(f"  обработано строк: {rows}")
+
+        try:
+            result = import_timesheet_grid(
+                filename, user, TimesheetModel, year, month,
+                sheet_name=options.get("sheet"),
+                chunk_size=max(1, options["chunk_size"]),
+                progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Импорт завершён. Строк: {result['rows']}, создано: {result['created']}, "
+            f"обновлено: {result['updated']}, пропущено дублей: {result['skipped']}, "
+            f"ошибок: {len(result['errors'])}. Время: {elapsed:.2f} с."
+        ))
+        if result["errors"]:
+            path = write_import_errors_report(result["errors"])
+            self.stdout.write(self.style.WARNING(f"Отчёт об ошибках: {path}"))
@@ -0,0 +1,111 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from apps.core.backups import (
+    BackupError, backup_chain, copy_database, integrity_check, list_manifests, read_manifest, restore_attached_database,
+    restore_chain,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore the default SQLite database from a backup_db set. Checksums of every "
+        "archive in the chain are verified, incrementals are applied on top of the full "
+        "backup and the result is checked with PRAGMA integrity_check before it is copied in. "
+        "The timesheet archive database stored in the same backup is restored with it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("backup", nargs="?", default=None,
+                            help="Archive or manifest to restore (default: the latest in --dest-dir)")
+        parser.add_argument("--dest-dir", default=None)
+        parser.add_argument("--prefix", default="db_backup")
+        parser.add_argument("--target", default=None, help="Write to this file instead of the configured database")
+        parser.add_argument("--archive-target", default=None,
+                            help="Write the archive database to this file (default: SQLITE_ARCHIVE_PATH, "
+                                 "or <target>_archive.sqlite3 with --target)")
+        parser.add_argument("--verify-only", action="store_true", default=False,
+                            help="Rebuild and verify the backup without touching the database")
+        parser.add_argument("--force", action="store_true", default=False,
+                            help="Overwrite the configured database")
+
+    def handle(self, *args, **options):
+        db = settings.DATABASES.get("default") or {}
+        if not (db.get("ENGINE") or "").endswith("sqlite3"):
+            raise CommandError("restore_db supports SQLite only")
+        name = db.get("NAME")
+
+        if options["backup"]:
+            backup_path = Path(options["backup"])
+            dest_dir = backup_path.parent
+        else:
+            dest_dir = Path(options["dest_dir"]) if options["dest_dir"] else Path(str(name)).resolve().parent / "backups"
+            manifests = list_manifests(dest_dir, options["prefix"])
+            if not manifests:
+                raise CommandError(f"No backups with manifests found in {dest_dir}")
+            backup_path = manifests[0]
+
+        try:
+            chain = backup_chain(read_manifest(backup_path), dest_dir)
+        except BackupError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Restoring: " + " -> ".join(m["archive"] for m in chain))
+
+        target = Path(options["target"]) if options["target"] else Path(str(name)).resolve()
+        if not options["verify_only"] and not options["target"] and not options["force"]:
+            raise CommandError(f"Refusing to overwrite {target}; pass --force or use --target")
+
+        archive_entry = chain[-1].get("archive_db")
+        archive_target = self._archive_target(options, target) if archive_entry else None
+        if archive_entry and archive_target is None and not options["verify_only"]:
+            raise CommandError(
+                "The backup contains the archive database but SQLITE_ARCHIVE_PATH is not set; "
+                "pass --archive-target"
+            )
+
+        work_path = target.with_name(target.name + ".restore-tmp")
+        archive_work = target.with_name(target.name + ".archive-restore-tmp")
+        try:
+            # Both files are rebuilt and verified before anything is overwritten
+            restore_chain(chain, dest_dir, work_path)
+            ok, message, _, _ = integrity_check(work_path)
+            if not ok:
+                raise CommandError(f"integrity_check failed on the restored copy: {message}")
+            if archive_entry:
+                restore_attached_database(archive_entry, dest_dir, archive_work)
+                ok, message, _, _ = integrity_check(archive_work)
+                if not ok:
+                    raise CommandError(f"integrity_check failed on the restored archive database: {message}")
+            if options["verify_only"]:
+                self.stdout.write(self.style.SUCCESS("Backup verified: checksums and integrity_check ok"))
+                return
+            connections.close_all()
+            # The backup API writes through SQLite, so an existing WAL/journal is handled correctly
+            copy_database(work_path, target)
+            if archive_entry:
+                copy_database(archive_work, archive_target)
+        except BackupError as e:
+            raise CommandError(str(e))
+        finally:
+            for path in (work_path, archive_work):
+                for suffix in ("", "-wal", "-shm", "-journal"):
+                    Path(str(path) + suffix).unlink(missing_ok=True)
+
+        self.stdout.write(self.style.SUCCESS(f"Database restored into {target}"))
+        if archive_entry:
+            self.stdout.write(self.style.SUCCESS(f"Archive database restored into {archive_target}"))
+        elif "archive_db" not in chain[-1] and getattr(settings, "SQLITE_ARCHIVE_PATH", ""):
+            self.stdout.write(self.style.WARNING(
+                "The backup has no archive database (made before archive backups); the archive file was left as is"
+            ))
+
+    def _archive_target(self, options, target):
+        if options["archive_target"]:
+            return Path(options["archive_target"])
+        if options["target"]:
+            return target.with_name(target.stem + "_archive.sqlite3")
+        path = getattr(settings, "SQLITE_ARCHIVE_PATH", "") or ""
+        return Path(path).resolve() if path else None
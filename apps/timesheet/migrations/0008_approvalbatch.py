@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:08
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('timesheet', '0007_workdayswap_workdayswap_uniq_workday_swap_pair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timesheet_type', models.CharField(choices=[('main', 'Табель'), ('itr', 'Табель ИТР')], default='main', max_length=10, verbose_name='Тип табеля')),
+                ('year', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(2000)], verbose_name='Год')),
+                ('month', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(12)], verbose_name='Месяц')),
+                ('approved_count', models.PositiveIntegerField(default=0, verbose_name='Утверждено записей')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('approved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_approval_batches', to=settings.AUTH_USER_MODEL, verbose_name='Утвердил')),
+                ('masters', models.ManyToManyField(related_name='approval_batches', to=settings.AUTH_USER_MODEL, verbose_name='Мастера')),
+            ],
+            options={
+                'verbose_name': 'Утверждение месяца',
+                'verbose_name_plural': 'Утверждения месяцев',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['year', 'month'], name='timesheet_a_year_5d4d6f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timesheet', '0008_approvalbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedItrTimesheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('value', models.CharField(max_length=10, verbose_name='Значение')),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('approved', 'Утвержден'), ('submitted', 'Сдан мастером')], max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(verbose_name='Создано')),
+                ('updated_at', models.DateTimeField(verbose_name='Обновлено')),
+                ('approved_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата утверждения')),
+            ],
+            options={
+                'verbose_name': 'Архивный табель ИТР',
+                'verbose_name_plural': 'Архивные табели ИТР',
+                'db_table': 'archive"."timesheet_itrtimesheet_archive',
+                'ordering': ['-date', 'employee'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTimesheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('value', models.CharField(max_length=10, verbose_name='Значение')),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('approved', 'Утвержден'), ('submitted', 'Сдан мастером')], max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(verbose_name='Создано')),
+                ('updated_at', models.DateTimeField(verbose_name='Обновлено')),
+                ('approved_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата утверждения')),
+            ],
+            options={
+                'verbose_name': 'Архивный табель',
+                'verbose_name_plural': 'Архивные табели',
+                'db_table': 'archive"."timesheet_timesheet_archive',
+                'ordering': ['-date', 'employee'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timesheet_type', models.CharField(choices=[('main', 'Табель'), ('itr', 'Табель ИТР')], default='main', max_length=10, verbose_name='Тип табеля')),
+                ('year', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(2000)], verbose_name='Год')),
+                ('month', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(12)], verbose_name='Месяц')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Перенесено в архив')),
+            ],
+            options={
+                'verbose_name': 'Архивный месяц',
+                'verbose_name_plural': 'Архивные месяцы',
+                'ordering': ['-year', '-month', 'timesheet_type'],
+                'unique_together': {('timesheet_type', 'year', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timesheet', '0009_archivedmonth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='milkvoucher',
+            name='attended_days',
+            field=models.PositiveIntegerField(default=0, verbose_name='Дней явки'),
+        ),
+        migrations.AddField(
+            model_name='milkvoucher',
+            name='per_day_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Талонов в день'),
+        ),
+    ]
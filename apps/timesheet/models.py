@@ -309,6 +309,10 @@ class ItrTimesheet(models.Model):
     def is_approved(self):
         return self.status == 'approved'
     
+    @property
+    def is_submitted(self):
+        return self.status == 'submitted'
+    
     @property
     def can_edit(self):
         return self.status == 'draft'
@@ -353,12 +357,145 @@ class ItrTimesheet(models.Model):
             return 'draft'
 
 
+class ApprovalBatch(models.Model):
+    """Журнал помесячного утверждения табелей плановым отделом"""
+    TIMESHEET_TYPE_CHOICES = [
+        ('main', 'Табель'),
+        ('itr', 'Табель ИТР'),
+    ]
+    
+    timesheet_type = models.CharField('Тип табеля', max_length=10, choices=TIMESHEET_TYPE_CHOICES, default='main')
+    year = models.PositiveIntegerField('Год', validators=[MinValueValidator(2000)])
+    month = models.PositiveIntegerField('Месяц', validators=[MinValueValidator(1), MaxValueValidator(12)])
+    masters = models.ManyToManyField(User, related_name='approval_batches', verbose_name='Мастера')
+    approved_count = models.PositiveIntegerField('Утверждено записей', default=0)
+    approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='created_approval_batches', verbose_name='Утвердил')
+    created_at = models.DateTimeField('Создано', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Утверждение месяца'
+        verbose_name_plural = 'Утверждения месяцев'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['year', 'month']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_timesheet_type_display()} {self.month:02d}.{self.year}: {self.approved_count}"
+
+
+class ArchivedMonth(models.Model):
+    """Месяц табеля, перенесенный в архивную БД (команда archive_months)"""
+    TIMESHEET_TYPE_CHOICES = ApprovalBatch.TIMESHEET_TYPE_CHOICES
+    
+    timesheet_type = models.CharField('Тип табеля', max_length=10, choices=TIMESHEET_TYPE_CHOICES, default='main')
+    year = models.PositiveIntegerField('Год', validators=[MinValueValidator(2000)])
+    month = models.PositiveIntegerField('Месяц', validators=[MinValueValidator(1), MaxValueValidator(12)])
+    rows = models.PositiveIntegerField('Записей', default=0)
+    archived_at = models.DateTimeField('Перенесено в архив', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Архивный месяц'
+        verbose_name_plural = 'Архивные месяцы'
+        ordering = ['-year', '-month', 'timesheet_type']
+        unique_together = ('timesheet_type', 'year', 'month')
+    
+    def __str__(self):
+        return f"{self.get_timesheet_type_display()} {self.month:02d}.{self.year}: {self.rows}"
+
+
+class ArchivedTimesheetBase(models.Model):
+    """
+    Запись табеля в архивной БД (только чтение).
+
+    Архив — отдельный файл SQLite, подключаемый к каждому соединению как схема
+    archive (apps.core.db); таблицы создает команда archive_months. Колонки
+    совпадают с исходной таблицей, поэтому записи отображаются теми же шаблонами.
+    """
+    STATUS_CHOICES = Timesheet.STATUS_CHOICES
+    
+    date = models.DateField('Дата')
+    employee = models.ForeignKey(Employee, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 related_name='+', verbose_name='Сотрудник')
+    master = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                               related_name='+', verbose_name='Мастер')
+    value = models.CharField('Значение', max_length=10)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES)
+    created_at = models.DateTimeField('Создано')
+    updated_at = models.DateTimeField('Обновлено')
+    approved_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                                    null=True, blank=True, related_name='+', verbose_name='Утверждено')
+    approved_at = models.DateTimeField('Дата утверждения', null=True, blank=True)
+    
+    is_archived = True
+    
+    class Meta:
+        abstract = True
+        managed = False
+        ordering = ['-date', 'employee']
+    
+    def __str__(self):
+        return f"{self.date} - {self.employee} - {self.value}"
+    
+    @property
+    def is_approved(self):
+        return self.status == 'approved'
+    
+    @property
+    def is_submitted(self):
+        return self.status == 'submitted'
+    
+    @property
+    def can_edit(self):
+        return False
+    
+    @property
+    def can_submit(self):
+        return False
+    
+    @property
+    def can_approve(self):
+        return False
+    
+    @property
+    def display_value(self):
+        if self.value.isdigit():
+            return f"{self.value} ч"
+        return self.value if self.value else ""
+    
+    @property
+    def css_class(self):
+        return Timesheet.css_class.fget(self)
+
+
+class ArchivedTimesheet(ArchivedTimesheetBase):
+    class Meta(ArchivedTimesheetBase.Meta):
+        abstract = False
+        managed = False
+        # Таблица во вложенной схеме: Django экранирует имя как "archive"."..."
+        db_table = 'archive"."timesheet_timesheet_archive'
+        verbose_name = 'Архивный табель'
+        verbose_name_plural = 'Архивные табели'
+
+
+class ArchivedItrTimesheet(ArchivedTimesheetBase):
+    class Meta(ArchivedTimesheetBase.Meta):
+        abstract = False
+        managed = False
+        db_table = 'archive"."timesheet_itrtimesheet_archive'
+        verbose_name = 'Архивный табель ИТР'
+        verbose_name_plural = 'Архивные табели ИТР'
+
+
 class MilkVoucher(models.Model):
     """Талоны на молоко для литейщиков"""
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='milk_vouchers', verbose_name='Сотрудник')
     year = models.PositiveIntegerField('Год', validators=[MinValueValidator(2000)])
     month = models.PositiveIntegerField('Месяц', validators=[MinValueValidator(1), MaxValueValidator(12)])
     count = models.PositiveIntegerField('Количество талонов', default=0)
+    attended_days = models.PositiveIntegerField('Дней явки', default=0)
+    per_day_count = models.PositiveIntegerField('Талонов в день', default=0)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Назначил')
     created_at = models.DateTimeField('Создано', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлено', auto_now=True)
@@ -436,3 +573,21 @@ class WorkdaySwap(models.Model):
 
     def __str__(self):
         return f"{self.date_a} ⇄ {self.date_b}"
+
+
+class CalendarVersion(models.Model):
+    """
+    Версия производственного календаря (одна строка).
+
+    Входит в ключи кеша календаря. Хранится в БД, а не в кеше: кеш у каждого
+    процесса свой, а изменение праздников должны увидеть все воркеры.
+    """
+    version = models.PositiveIntegerField('Версия', default=1)
+    updated_at = models.DateTimeField('Изменено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Версия календаря'
+        verbose_name_plural = 'Версия календаря'
+
+    def __str__(self):
+        return f"{self.version} ({self.updated_at:%d.%m.%Y %H:%M})"
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.core.exceptions import ValidationError
-from .models import Timesheet
+from .models import Timesheet, ItrTimesheet
+from .utils import check_months_writable
 from apps.users.models import Employee, User
 
 class TimesheetSerializer(serializers.ModelSerializer):
@@ -18,11 +19,46 @@ class TimesheetSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['status', 'approved_by', 'approved_at']
     
+    # Колонки модели и связи, необходимые для каждого поля (для .only() и select_related)
+    FIELD_COLUMNS = {
+        'employee_name': ['employee'],
+        'master_name': ['master'],
+        'department_name': ['employee'],
+        'can_edit': ['status'],
+    }
+    FIELD_RELATED = {
+        'employee_name': ['employee', 'employee__user'],
+        'master_name': ['master'],
+        'department_name': ['employee', 'employee__user', 'employee__user__department', 'employee__department_own'],
+    }
+    
+    def __init__(self, *args, **kwargs):
+        # Необязательный список полей для сокращенного ответа (?fields=date,employee,value)
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+    
+    @classmethod
+    def get_query_plan(cls, fields):
+        """Колонки для .only() и связи для select_related под выбранные поля"""
+        columns, related = {'id'}, set()
+        for name in fields:
+            columns.update(cls.FIELD_COLUMNS.get(name, [name]))
+            related.update(cls.FIELD_RELATED.get(name, []))
+        return sorted(columns), sorted(related)
+    
     def validate(self, data):
         user = self.context['request'].user
         employee = data.get('employee')
         master = data.get('master')
         
+        # Записи архивного месяца не видны до возврата месяца из архива
+        day = data.get('date') or getattr(self.instance, 'date', None)
+        if day:
+            check_months_writable(self.Meta.model, day)
+        
         # Мастер может работать только со своими сотрудниками
         if user.is_master:
             if employee.master != user:
@@ -36,7 +72,7 @@ class TimesheetSerializer(serializers.ModelSerializer):
         
         # Проверка уникальности табеля на дату и сотрудника
         if self.instance is None:  # Создание нового
-            if Timesheet.objects.filter(date=data['date'], employee=data['employee']).exists():
+            if self.Meta.model.objects.filter(date=data['date'], employee=data['employee']).exists():
                 raise ValidationError({
                     'employee': 'Табель для этого сотрудника на эту дату уже существует'
                 })
@@ -81,6 +117,21 @@ class TimesheetSerializer(serializers.ModelSerializer):
         
         return value
 
+class ItrTimesheetSerializer(TimesheetSerializer):
+    """Сериализатор табеля ИТР (те же поля и проверки)"""
+    
+    class Meta(TimesheetSerializer.Meta):
+        model = ItrTimesheet
+    
+    def validate(self, data):
+        data = super().validate(data)
+        employee = data.get('employee')
+        if employee is not None and not employee.is_itr_employee:
+            raise ValidationError({
+                'employee': 'Сотрудник не включен в табель ИТР'
+            })
+        return data
+
 class TimesheetApproveSerializer(serializers.Serializer):
     """Сериализатор для утверждения табелей"""
     timesheet_ids = serializers.ListField(
@@ -90,9 +141,9 @@ class TimesheetApproveSerializer(serializers.Serializer):
     approve = serializers.BooleanField(default=True)
     
     def validate_timesheet_ids(self, value):
-        # Проверка существования табелей
-        from .models import Timesheet
-        existing_ids = Timesheet.objects.filter(
+        # Проверка существования табелей (модель передается через context)
+        model = self.context.get('model', Timesheet)
+        existing_ids = model.objects.filter(
             id__in=value
         ).values_list('id', flat=True)
         
@@ -101,6 +152,15 @@ class TimesheetApproveSerializer(serializers.Serializer):
         
         return value
 
+class MonthApproveSerializer(serializers.Serializer):
+    """Сериализатор для утверждения месяца по мастерам"""
+    master_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1
+    )
+    year = serializers.IntegerField(min_value=2000, max_value=2100)
+    month = serializers.IntegerField(min_value=1, max_value=12)
+
 class ExportSerializer(serializers.Serializer):
     """Сериализатор для экспорта"""
     start_date = serializers.DateField()
@@ -110,4 +170,16 @@ class ExportSerializer(serializers.Serializer):
     status = serializers.ChoiceField(
         choices=[('all', 'Все'), ('draft', 'Черновик'), ('approved', 'Утвержден')],
         default='all'
-    )
\ No newline at end of file
+    )
+
+class TimesheetBulkUpsertSerializer(serializers.Serializer):
+    """Сериализатор для массовой загрузки табелей (строки проверяются в bulk_upsert_timesheets)"""
+    type = serializers.ChoiceField(
+        choices=[('main', 'Табель'), ('itr', 'Табель ИТР')],
+        default='main'
+    )
+    rows = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=50000
+    )
@@ -77,7 +77,7 @@ def sum_attr_any(iterable, attr):
                 total += float(cleaned)
             except (ValueError, TypeError):
                 continue
-    return int(total) if total.is_integer() else total
+    return int(total) if float(total).is_integer() else total
 
 
 @register.filter
@@ -0,0 +1,1051 @@
+"""
+Тесты табеля: бюджеты SQL-запросов нагруженных представлений и поведение
+операций, которые переносят или удаляют данные (архив, резервные копии,
+импорт, утверждение).
+
+Фикстура повторяет реальный цех: несколько мастеров (обычный, литейный, ИЦ,
+ИТР), сотрудники без учетной записи, назначения, пересекающие границы месяца,
+праздник, предпраздничный день и перенос рабочего дня. Тесты запросов
+проверяют, что представление укладывается в бюджет и что его результат
+совпадает с данными в БД — оптимизация не должна менять вывод.
+
+Число запросов не должно зависеть от объема данных: тесты *_do_not_grow
+выполняют представление при двух размерах фикстуры (grow) и требуют равных
+счетчиков, так что N+1 не спрятать в бюджет. Бюджеты — верхняя граница на
+базовой фикстуре; при превышении сообщение покажет повторяющиеся запросы.
+"""
+import calendar
+import csv
+import io
+import shutil
+import sqlite3
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.core.backups import snapshot_backup
+from apps.core.db import ARCHIVE_SCHEMA, attach_archive
+from apps.core.profiling import sql_fingerprint
+from apps.users.models import Department, Employee, EmployeeAssignment, User
+
+from .models import (
+    ApprovalBatch, ArchivedMonth, ArchivedTimesheet, CalendarVersion, Holiday, ItrTimesheet, MilkVoucher,
+    PositionMilkAllowance, Timesheet, WorkdaySwap,
+)
+from .utils import (
+    archive_month, bulk_upsert_timesheets, calculate_milk_vouchers, check_months_writable,
+    get_calendar_cache_version, get_timesheet_read_model, import_timesheet_grid, unarchive_month,
+)
+from .web_views import (
+    EVENING_FORMATS, NIGHT_FORMATS, OVERTIME_FORMATS, TOTAL_HOURS_FORMATS, generate_default_table, get_day_value,
+    get_foundry_day_value, get_month_day_values, update_statistics,
+)
+
+YEAR, MONTH = 2024, 3
+MONTH_START, MONTH_END = date(2024, 3, 1), date(2024, 3, 31)
+
+
+class QueryBudgetMixin:
+    def assertQueryBudget(self, budget, label=''):
+        """Контекстный менеджер: не больше budget запросов, иначе — самые частые из них"""
+        test = self
+
+        class Budget(CaptureQueriesContext):
+            def __exit__(self, exc_type, exc_value, traceback):
+                super().__exit__(exc_type, exc_value, traceback)
+                if exc_type is not None:
+                    return
+                executed = len(self)
+                if executed > budget:
+                    test.fail(f'{label or "Запросы"}: {executed} > бюджета {budget}\n{top_queries(self)}')
+
+        return Budget(connection)
+
+    def count_queries(self, user, request):
+        """Число запросов request() от имени user; изменения в БД откатываются"""
+        cache.clear()
+        self.client.force_login(user)
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                response = request()
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, response.content[:500])
+        return context
+
+    def assertQueriesConstant(self, user, request, label=''):
+        """
+        Число запросов не зависит от объема данных: request() выполняется
+        при двух размерах фикстуры (grow(2) и grow(5)), счетчики должны совпасть.
+        """
+        self.grow(2)
+        small = self.count_queries(user, request)
+        self.grow(3)
+        large = self.count_queries(user, request)
+        if statement_count(small) != statement_count(large):
+            self.fail(
+                f'{label or "Запросы"}: {statement_count(small)} -> {statement_count(large)} '
+                f'при росте данных\n{top_queries(large)}'
+            )
+
+
+def statement_count(context):
+    """
+    Число запросов; пакеты одного bulk_create считаются одним запросом —
+    их число задает лимит параметров SQLite, а не N+1
+    """
+    count, previous = 0, None
+    for query in context.captured_queries:
+        sql = query['sql']
+        key = sql.split(' VALUES ', 1)[0] if sql.startswith('INSERT INTO') else None
+        if key is None or key != previous:
+            count += 1
+        previous = key
+    return count
+
+
+def top_queries(context, limit=5):
+    counts = {}
+    for query in context.captured_queries:
+        key = sql_fingerprint(query['sql'])
+        counts[key] = counts.get(key, 0) + 1
+    top = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+    return '\n'.join(f'  {n} x {sql[:200]}' for sql, n in top)
+
+
+class TimesheetFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        dept = Department.objects.create(name='Литейный цех', code='LC')
+        cls.master = User.objects.create(
+            username='master', employee_id='M-1', role='master', department=dept,
+            last_name='Иванов', first_name='Иван',
+        )
+        cls.foundry_master = User.objects.create(
+            username='foundry', employee_id='M-2', role='master', department=dept,
+            last_name='Петров', first_name='Петр',
+            is_foundry_master=True, foundry_anchor_date=date(2024, 1, 1),
+        )
+        cls.ic_master = User.objects.create(
+            username='ic', employee_id='M-3', role='master', department=dept,
+            last_name='Сидоров', first_name='Сидор',
+            is_ic_master=True, ic_anchor_date=date(2024, 1, 1),
+        )
+        cls.itr_master = User.objects.create(
+            username='itr', employee_id='M-4', role='master', department=dept,
+            last_name='Смирнов', first_name='Семен', is_itr_master=True,
+        )
+        cls.planner = User.objects.create(username='planner', employee_id='P-1', role='planner', department=dept)
+        cls.planner.allowed_masters.set([cls.master, cls.foundry_master, cls.ic_master, cls.itr_master])
+        cls.admin = User.objects.create(username='admin', employee_id='A-1', role='admin')
+
+        def employee(number, master, **kwargs):
+            kwargs.setdefault('hire_date', date(2020, 1, 1))
+            return Employee.objects.create(
+                last_name=f'Работник{number}', first_name='Тест', employee_id_own=f'E-{number}',
+                position_own='Литейщик', department_own=dept, master=master, **kwargs
+            )
+
+        cls.regular = [employee(i, cls.master) for i in range(1, 7)]
+        # Принят в середине месяца: дни до приема пустые
+        cls.regular.append(employee(7, cls.master, hire_date=date(2024, 3, 15)))
+        cls.foundry = [employee(10 + i, cls.foundry_master, is_foundry=True,
+                                foundry_anchor_date=date(2024, 2, 26)) for i in range(3)]
+        cls.ic = [
+            employee(20, cls.ic_master),
+            employee(21, cls.ic_master, ic_schedule_override='opposite'),
+            employee(22, cls.ic_master, ic_schedule_override='weekdays', ic_weekdays='0,2,4'),
+            employee(23, cls.ic_master, ic_is_part_time=True, ic_hours_per_day=4),
+        ]
+        cls.itr = [employee(30 + i, cls.itr_master, is_itr_employee=True) for i in range(3)]
+        # Переведен от обычного мастера к литейному 15-го числа
+        cls.transferred = employee(40, None)
+
+        assignments = []
+        for emp in cls.regular:
+            assignments.append(EmployeeAssignment(employee=emp, master=cls.master, start_date=date(2024, 1, 1)))
+        for emp in cls.foundry:
+            assignments.append(EmployeeAssignment(employee=emp, master=cls.foundry_master, start_date=date(2024, 2, 20)))
+        for emp in cls.ic:
+            assignments.append(EmployeeAssignment(
+                employee=emp, master=cls.ic_master, start_date=date(2024, 2, 1), end_date=date(2024, 4, 10)
+            ))
+        for emp in cls.itr:
+            assignments.append(EmployeeAssignment(employee=emp, master=cls.itr_master, start_date=date(2023, 12, 1)))
+        assignments += [
+            EmployeeAssignment(employee=cls.transferred, master=cls.master,
+                               start_date=date(2024, 2, 10), end_date=date(2024, 3, 14)),
+            EmployeeAssignment(employee=cls.transferred, master=cls.foundry_master,
+                               start_date=date(2024, 3, 15)),
+        ]
+        EmployeeAssignment.objects.bulk_create(assignments)
+
+        Holiday.objects.create(date=date(2024, 3, 8), name='Международный женский день', type='holiday')
+        Holiday.objects.create(date=date(2024, 3, 7), name='Предпраздничный день', type='preholiday')
+        WorkdaySwap.objects.create(date_a=date(2024, 3, 9), date_b=date(2024, 3, 11))
+
+        rows = []
+        for n, emp in enumerate(cls.regular[:6]):
+            status = ['draft', 'submitted', 'approved'][n % 3]
+            for day in range(1, 16):
+                value = 'О' if day in (4, 5) and n == 0 else ('7' if day == 7 else '8')
+                rows.append(Timesheet(
+                    date=date(YEAR, MONTH, day), employee=emp, master=cls.master, value=value, status=status,
+                    approved_by=cls.planner if status == 'approved' else None,
+                ))
+        for emp in cls.foundry:
+            for day in range(1, 11):
+                rows.append(Timesheet(date=date(YEAR, MONTH, day), employee=emp, master=cls.foundry_master,
+                                      value='8/2', status='submitted'))
+        for day in range(1, 15):
+            rows.append(Timesheet(date=date(YEAR, MONTH, day), employee=cls.transferred, master=cls.master,
+                                  value='8', status='submitted'))
+        # Записи соседних месяцев не должны попадать в выборки за март
+        rows.append(Timesheet(date=date(2024, 2, 29), employee=cls.regular[0], master=cls.master,
+                              value='8', status='approved'))
+        rows.append(Timesheet(date=date(2024, 4, 1), employee=cls.regular[0], master=cls.master,
+                              value='8', status='draft'))
+        Timesheet.objects.bulk_create(rows)
+        ItrTimesheet.objects.bulk_create([
+            ItrTimesheet(date=date(YEAR, MONTH, day), employee=emp, master=cls.itr_master,
+                         value='8', status='submitted')
+            for emp in cls.itr for day in range(1, 6)
+        ])
+
+    def setUp(self):
+        # Кеш производственного календаря влияет на число запросов
+        cache.clear()
+
+    def grow(self, n):
+        """
+        Добавляет n сотрудников каждому мастеру (обычный, литейный, ИЦ, ИТР)
+        с назначением и записями за первую декаду месяца в разных статусах
+        """
+        dept = Department.objects.get(code='LC')
+        number = 1000 + Employee.objects.count()
+        for i in range(n):
+            for master, model, kwargs in (
+                (self.master, Timesheet, {}),
+                (self.foundry_master, Timesheet, {'is_foundry': True, 'foundry_anchor_date': date(2024, 2, 26)}),
+                (self.ic_master, Timesheet, {}),
+                (self.itr_master, ItrTimesheet, {'is_itr_employee': True}),
+            ):
+                number += 1
+                emp = Employee.objects.create(
+                    last_name=f'Работник{number}', first_name='Тест', employee_id_own=f'E-{number}',
+                    position_own='Литейщик', department_own=dept, hire_date=date(2020, 1, 1), **kwargs
+                )
+                EmployeeAssignment.objects.create(employee=emp, master=master, start_date=date(2024, 1, 1))
+                model.objects.bulk_create([
+                    model(date=date(YEAR, MONTH, day), employee=emp, master=master, value='8',
+                          status=['draft', 'submitted', 'approved'][(i + day) % 3])
+                    for day in range(1, 11)
+                ])
+
+    def month_values(self, statuses=None, master=None):
+        queryset = Timesheet.objects.filter(date__range=(MONTH_START, MONTH_END))
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        if master:
+            queryset = queryset.filter(master=master)
+        return {(ts.employee_id, ts.date.day): ts.value for ts in queryset}
+
+    @staticmethod
+    def table_values(table_data):
+        return {
+            (row['employee_id'], cell['day']): cell['value']
+            for row in table_data for cell in row['days'] if cell['timesheet_id']
+        }
+
+
+class MonthlyTableQueryTests(TimesheetFixtureMixin, QueryBudgetMixin, TestCase):
+    url = reverse('timesheet:monthly_table')
+
+    def test_master_table(self):
+        self.client.force_login(self.master)
+        with self.assertQueryBudget(12, 'monthly_table_view (мастер)'):
+            response = self.client.get(self.url, {'year': YEAR, 'month': MONTH})
+        self.assertEqual(response.status_code, 200)
+        table = response.context['table_data']
+        expected_employees = {e.id for e in self.regular} | {self.transferred.id}
+        self.assertEqual({row['employee_id'] for row in table}, expected_employees)
+        self.assertEqual(self.table_values(table), self.month_values(master=self.master))
+        # Дни до приема пустые и не редактируются
+        late = next(row for row in table if row['employee_id'] == self.regular[6].id)
+        self.assertEqual([c['status'] for c in late['days'][:14]], ['empty'] * 14)
+        self.assertFalse(any(c['can_edit'] for c in late['days'][:14]))
+
+    def test_planner_table(self):
+        self.client.force_login(self.planner)
+        with self.assertQueryBudget(23, 'monthly_table_view (плановик)'):
+            response = self.client.get(self.url, {'year': YEAR, 'month': MONTH, 'master': self.master.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.table_values(response.context['table_data']),
+            self.month_values(statuses=['submitted', 'approved'], master=self.master),
+        )
+
+    def test_itr_table(self):
+        self.client.force_login(self.itr_master)
+        with self.assertQueryBudget(15, 'monthly_table_view (ИТР)'):
+            response = self.client.get(self.url, {'year': YEAR, 'month': MONTH, 'tt': 'itr'})
+        self.assertEqual(response.status_code, 200)
+        table = response.context['table_data']
+        self.assertEqual({row['employee_id'] for row in table}, {e.id for e in self.itr})
+        self.assertEqual(self.table_values(table), {
+            (ts.employee_id, ts.date.day): ts.value
+            for ts in ItrTimesheet.objects.filter(date__range=(MONTH_START, MONTH_END))
+        })
+
+    def test_print_form(self):
+        self.client.force_login(self.planner)
+        params = {'year': YEAR, 'month': MONTH, 'master': self.foundry_master.id}
+        with self.assertQueryBudget(18, 'print_monthly_table'):
+            printed = self.client.get(reverse('timesheet:print_monthly_table'), params)
+        self.assertEqual(printed.status_code, 200)
+        # В печать попадают только сданные/утвержденные записи выбранного мастера
+        self.assertEqual(
+            self.table_values(printed.context['table_data']),
+            self.month_values(statuses=['submitted', 'approved'], master=self.foundry_master),
+        )
+        rows = [row for page in printed.context['table_pages'] for row in page]
+        self.assertEqual([row['row_number'] for row in rows], list(range(1, len(rows) + 1)))
+
+    def test_queries_do_not_grow(self):
+        get = self.client.get
+        cases = [
+            ('мастер', self.master, lambda: get(self.url, {'year': YEAR, 'month': MONTH})),
+            ('плановик', self.planner,
+             lambda: get(self.url, {'year': YEAR, 'month': MONTH, 'master': self.master.id})),
+            ('ИТР', self.itr_master, lambda: get(self.url, {'year': YEAR, 'month': MONTH, 'tt': 'itr'})),
+            ('печать', self.planner, lambda: get(reverse('timesheet:print_monthly_table'),
+                                                 {'year': YEAR, 'month': MONTH, 'master': self.foundry_master.id})),
+            ('печать ИЦ', self.planner, lambda: get(reverse('timesheet:print_monthly_table'),
+                                                    {'year': YEAR, 'month': MONTH, 'master': self.ic_master.id})),
+        ]
+        for label, user, request in cases:
+            with self.subTest(label):
+                self.assertQueriesConstant(user, request, f'monthly_table_view ({label})')
+
+
+class CalendarDayValueTests(TimesheetFixtureMixin, TestCase):
+    def test_month_values_match_per_day_lookup(self):
+        # Праздник первого числа делает последний день прошлого месяца предпраздничным
+        Holiday.objects.create(date=date(2024, 3, 1), name='Тест', type='holiday')
+        WorkdaySwap.objects.create(date_a=date(2024, 2, 24), date_b=date(2024, 3, 4))
+        for year, month in ((2024, 2), (2024, 3)):
+            last_day = calendar.monthrange(year, month)[1]
+            expected = {day: get_day_value(date(year, month, day)) for day in range(1, last_day + 1)}
+            self.assertEqual(get_month_day_values(year, month), expected)
+        self.assertEqual(get_month_day_values(2024, 2)[29], '7')
+
+
+class StatisticsQueryTests(TimesheetFixtureMixin, QueryBudgetMixin, TestCase):
+    def test_statistics_match_table(self):
+        self.client.force_login(self.planner)
+        params = {'year': YEAR, 'month': MONTH, 'master': self.master.id}
+        with self.assertQueryBudget(17, 'get_statistics_view'):
+            response = self.client.get(reverse('timesheet:get_statistics'), params)
+        stats = response.json()['statistics']
+        table = self.client.get(reverse('timesheet:monthly_table'), params).context['table_data']
+        self.assertEqual(stats['total_employees'], len(table))
+        self.assertEqual(stats['total_hours'], round(sum(row['total_hours'] for row in table), 1))
+        expected = self.month_values(statuses=['submitted', 'approved'], master=self.master)
+        self.assertEqual(stats['submitted_count'] + stats['approved_count'], len(expected))
+        self.assertEqual(stats['draft_count'], 0)
+
+    def test_queries_do_not_grow(self):
+        params = {'year': YEAR, 'month': MONTH, 'master': self.master.id}
+        self.assertQueriesConstant(
+            self.planner, lambda: self.client.get(reverse('timesheet:get_statistics'), params), 'get_statistics_view'
+        )
+
+
+class WriteViewQueryTests(TimesheetFixtureMixin, QueryBudgetMixin, TestCase):
+    submit_url = reverse('timesheet:submit_month') + f'?year={YEAR}&month={MONTH}'
+
+    def test_quick_edit_creates_cell(self):
+        self.client.force_login(self.master)
+        employee = self.regular[6]
+        with self.assertQueryBudget(9, 'quick_edit_timesheet'):
+            response = self.client.post(reverse('timesheet:quick_edit'), {
+                'employee_id': employee.id, 'date': '2024-03-20', 'value': '8',
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Timesheet.objects.get(employee=employee, date=date(2024, 3, 20)).value, '8')
+
+    def test_quick_edit_updates_cell(self):
+        self.client.force_login(self.master)
+        timesheet = Timesheet.objects.get(employee=self.regular[0], date=date(2024, 3, 1))
+        with self.assertQueryBudget(8, 'quick_edit_timesheet (правка)'):
+            response = self.client.post(reverse('timesheet:quick_edit'), {
+                'timesheet_id': timesheet.id, 'value': '7',
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        timesheet.refresh_from_db()
+        self.assertEqual(timesheet.value, '7')
+
+    def test_fill_range(self):
+        self.client.force_login(self.master)
+        employee = self.regular[6]
+        with self.assertQueryBudget(9, 'fill_range'):
+            response = self.client.post(reverse('timesheet:fill_range'), {
+                'employee_id': employee.id, 'date_from': '2024-03-18', 'date_to': '2024-03-22', 'value': '8',
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            Timesheet.objects.filter(employee=employee, date__range=(date(2024, 3, 18), date(2024, 3, 22))).count(), 5
+        )
+
+    def test_fill_range_keeps_submitted_rows(self):
+        self.client.force_login(self.master)
+        for employee, status in ((self.regular[0], 'draft'), (self.regular[1], 'submitted')):
+            response = self.client.post(reverse('timesheet:fill_range'), {
+                'employee_id': employee.id, 'date_from': '2024-03-20', 'date_to': '2024-03-10', 'value': 'О',
+            })
+            self.assertEqual(response.json(), {'success': True, 'filled': 11})
+            values = dict(Timesheet.objects.filter(
+                employee=employee, date__range=(date(2024, 3, 10), date(2024, 3, 20))
+            ).values_list('date__day', 'value'))
+            # Черновики и новые дни получают значение, сданные дни не меняются
+            self.assertEqual(values, {
+                day: 'О' if status == 'draft' or day > 15 else '8' for day in range(10, 21)
+            })
+        response = self.client.post(reverse('timesheet:fill_range'), {
+            'employee_id': self.regular[0].id, 'date_from': '2024-03-21', 'date_to': '2024-03-22', 'value': 'XYZ',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Timesheet.objects.filter(employee=self.regular[0], date=date(2024, 3, 21)).exists())
+
+    def test_restore_range_deletes_own_drafts(self):
+        self.client.force_login(self.master)
+        for employee, expected in ((self.regular[0], 3), (self.regular[1], 0)):
+            response = self.client.post(reverse('timesheet:restore_range'), {
+                'employee_id': employee.id, 'date_from': '2024-03-13', 'date_to': '2024-03-20',
+            })
+            self.assertEqual(response.json(), {'success': True, 'restored': expected})
+        self.assertEqual(
+            Timesheet.objects.filter(employee=self.regular[0], date__range=(MONTH_START, MONTH_END)).count(), 12
+        )
+
+    def test_fill_range_does_not_grow_with_range(self):
+        url = reverse('timesheet:fill_range')
+        counts = [
+            len(self.count_queries(self.master, lambda: self.client.post(url, {
+                'employee_id': self.regular[0].id, 'date_from': '2024-03-14', 'date_to': date_to, 'value': '8',
+            })))
+            for date_to in ('2024-03-16', '2024-03-31')
+        ]
+        self.assertEqual(counts[0], counts[1])
+
+    def test_submit_month(self):
+        self.client.force_login(self.master)
+        with self.assertQueryBudget(17, 'submit_month'):
+            response = self.client.post(self.submit_url)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertFalse(Timesheet.objects.filter(
+            master=self.master, date__range=(MONTH_START, MONTH_END), status='draft'
+        ).exists())
+        # Недостающие дни созданы по автозаполнению, начиная с даты приема
+        default_table = generate_default_table(YEAR, MONTH)
+        late = dict(Timesheet.objects.filter(employee=self.regular[6]).values_list('date__day', 'value'))
+        self.assertEqual(late, {day: default_table[day] for day in range(15, 32)})
+        # Переведенный сотрудник дополняется только по дням назначения этому мастеру
+        self.assertFalse(Timesheet.objects.filter(employee=self.transferred, date__gte=date(2024, 3, 15)).exists())
+        self.assertEqual(data['created_missing'], 6 * 16 + 17)
+        # Сданы черновики regular[0] и regular[3] и созданные записи
+        self.assertEqual(data['submitted_count'], 2 * 15 + data['created_missing'])
+        # Соседние месяцы не затронуты
+        self.assertEqual(Timesheet.objects.get(employee=self.regular[0], date=date(2024, 4, 1)).status, 'draft')
+
+    def test_submit_month_foundry_schedule(self):
+        self.client.force_login(self.foundry_master)
+        response = self.client.post(self.submit_url)
+        self.assertEqual(response.status_code, 200, response.content)
+        for employee in self.foundry:
+            values = dict(Timesheet.objects.filter(
+                employee=employee, date__gt=date(2024, 3, 10), date__lte=MONTH_END
+            ).values_list('date__day', 'value'))
+            self.assertEqual(values, {
+                day: get_foundry_day_value(date(YEAR, MONTH, day), employee.foundry_anchor_date)
+                for day in range(11, 32)
+            })
+
+    def test_submit_month_queries_do_not_grow(self):
+        for user in (self.master, self.foundry_master, self.ic_master):
+            with self.subTest(user.username):
+                self.assertQueriesConstant(user, lambda: self.client.post(self.submit_url), 'submit_month')
+        self.assertQueriesConstant(
+            self.itr_master, lambda: self.client.post(self.submit_url + '&tt=itr'), 'submit_month (ИТР)'
+        )
+
+
+class ExportQueryTests(TimesheetFixtureMixin, QueryBudgetMixin, TestCase):
+    def test_export_matches_db(self):
+        self.client.force_login(self.planner)
+        with self.assertQueryBudget(4, 'export_view'):
+            response = self.client.post(reverse('timesheet:export'), {
+                'start_date': '2024-03-01', 'end_date': '2024-03-31', 'status': 'all',
+            })
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.content.decode())))[1:]
+        exported = {(row[2], row[1]): row[4] for row in rows}
+        expected = {
+            (ts.employee.employee_id, ts.date.strftime('%d.%m.%Y')): ts.value
+            for ts in Timesheet.objects.filter(date__range=(MONTH_START, MONTH_END)).select_related('employee')
+        }
+        self.assertEqual(exported, expected)
+
+    def test_queries_do_not_grow(self):
+        self.assertQueriesConstant(self.planner, lambda: self.client.post(reverse('timesheet:export'), {
+            'start_date': '2024-03-01', 'end_date': '2024-03-31', 'status': 'all',
+        }), 'export_view')
+
+
+class ApiQueryTests(TimesheetFixtureMixin, QueryBudgetMixin, TestCase):
+    url = '/timesheet/api/timesheets/'
+
+    def test_list_is_constant(self):
+        self.client.force_login(self.planner)
+        with self.assertQueryBudget(4, 'API list'):
+            small = self.client.get(self.url, {'page_size': 10})
+        with self.assertQueryBudget(4, 'API list (большая страница)'):
+            large = self.client.get(self.url, {'page_size': 500})
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(small.json()['count'], large.json()['count'])
+        self.assertEqual(len(large.json()['results']), large.json()['count'])
+
+    def test_list_matches_db(self):
+        self.client.force_login(self.planner)
+        data = self.client.get(self.url, {'page_size': 1000}).json()
+        ids = {item['id'] for item in data['results']}
+        self.assertTrue(ids)
+        self.assertEqual(ids, set(Timesheet.objects.filter(id__in=ids).values_list('id', flat=True)))
+
+    def test_queries_do_not_grow(self):
+        self.assertQueriesConstant(self.planner, lambda: self.client.get(self.url, {'page_size': 1000}), 'API list')
+
+
+class BackupRestoreTests(TestCase):
+    """backup_db/restore_db: основная БД и архив табелей — один набор копий"""
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.main_path = self.tmp / 'db.sqlite3'
+        self.archive_path = self.tmp / 'db_archive.sqlite3'
+        self.backups = self.tmp / 'backups'
+        self.clock = datetime(2024, 5, 1, 12, 0, tzinfo=dt_timezone.utc)
+        for path in (self.main_path, self.archive_path):
+            self.execute(path, 'CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)')
+
+    @staticmethod
+    def execute(path, sql, params=()):
+        conn = sqlite3.connect(str(path))
+        try:
+            conn.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def values(path):
+        conn = sqlite3.connect(str(path))
+        try:
+            return [row[0] for row in conn.execute('SELECT value FROM t ORDER BY id')]
+        finally:
+            conn.close()
+
+    def backup(self, **options):
+        # Каждая копия — на секунду позже: метка времени входит в имена файлов
+        self.clock += timedelta(seconds=1)
+        with mock.patch.dict(settings.DATABASES['default'], NAME=str(self.main_path)), \
+                override_settings(SQLITE_ARCHIVE_PATH=str(self.archive_path)), \
+                mock.patch('django.utils.timezone.now', return_value=self.clock):
+            call_command('backup_db', dest_dir=str(self.backups), stdout=io.StringIO(), **options)
+        return sorted(self.backups.glob('*.json'))[-1]
+
+    def restore(self, manifest, target):
+        call_command('restore_db', str(manifest), target=str(target), stdout=io.StringIO())
+
+    def test_full_and_incremental_round_trip(self):
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('март')")
+        self.execute(self.archive_path, "INSERT INTO t (value) VALUES ('январь')")
+        full = self.backup()
+
+        # Месяц перенесен в архив после полной копии
+        self.execute(self.archive_path, "INSERT INTO t (value) VALUES ('февраль')")
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('апрель')")
+        incremental = self.backup(incremental=True)
+
+        target = self.tmp / 'restored.sqlite3'
+        self.restore(incremental, target)
+        self.assertEqual(self.values(target), ['март', 'апрель'])
+        self.assertEqual(self.values(self.tmp / 'restored_archive.sqlite3'), ['январь', 'февраль'])
+
+        old_target = self.tmp / 'old.sqlite3'
+        self.restore(full, old_target)
+        self.assertEqual(self.values(old_target), ['март'])
+        self.assertEqual(self.values(self.tmp / 'old_archive.sqlite3'), ['январь'])
+
+    def test_unchanged_archive_is_reused(self):
+        self.backup()
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('март')")
+        manifest = self.backup(incremental=True)
+        self.assertEqual(len(list(self.backups.glob('*.archive.zip'))), 1)
+
+        target = self.tmp / 'restored.sqlite3'
+        call_command('restore_db', str(manifest), target=str(target),
+                     archive_target=str(self.tmp / 'archive.sqlite3'), stdout=io.StringIO())
+        self.assertEqual(self.values(target), ['март'])
+        self.assertEqual(self.values(self.tmp / 'archive.sqlite3'), [])
+
+    def test_corrupted_archive_aborts_restore(self):
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('март')")
+        manifest = self.backup()
+        archive = next(self.backups.glob('*.archive.zip'))
+        archive.write_bytes(archive.read_bytes()[:-10])
+
+        target = self.tmp / 'restored.sqlite3'
+        with self.assertRaises(CommandError):
+            self.restore(manifest, target)
+        # Основная БД не перезаписывается, если архив не прошел проверку
+        self.assertFalse(target.exists())
+
+    def test_snapshot_does_not_wait_for_writers(self):
+        self.execute(self.main_path, 'PRAGMA journal_mode = WAL')
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('март')")
+        writer = sqlite3.connect(str(self.main_path), isolation_level=None)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute("INSERT INTO t (value) VALUES ('апрель')")
+        copy = self.tmp / 'copy.sqlite3'
+        snapshot_backup(self.main_path, copy, busy_timeout=0)
+        writer.execute('COMMIT')
+        self.assertEqual(self.values(copy), ['март'])
+
+    def test_not_enough_space_leaves_nothing(self):
+        usage = shutil.disk_usage(self.tmp)._replace(free=100)
+        with mock.patch('apps.core.backups.shutil.disk_usage', return_value=usage):
+            with self.assertRaisesMessage(CommandError, 'Not enough free space'):
+                self.backup()
+        self.assertEqual(list(self.backups.iterdir()), [])
+
+    def test_incremental_chain_and_rotation(self):
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('1')")
+        self.backup(keep=1)
+        for value in ('2', '3'):
+            self.execute(self.main_path, "INSERT INTO t (value) VALUES (?)", (value,))
+            manifest = self.backup(incremental=True, keep=1)
+        target = self.tmp / 'chain.sqlite3'
+        self.restore(manifest, target)
+        self.assertEqual(self.values(target), ['1', '2', '3'])
+
+        # Новая полная копия при --keep 1 удаляет прежнюю вместе с ее инкрементами
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('4')")
+        latest = self.backup(keep=1)
+        self.assertEqual(sorted(self.backups.glob('*.json')), [latest])
+        self.assertEqual(len(list(self.backups.glob('*.inc.*'))), 0)
+        self.assertEqual(len(list(self.backups.glob('*.archive.zip'))), 1)
+        target = self.tmp / 'latest.sqlite3'
+        self.restore(latest, target)
+        self.assertEqual(self.values(target), ['1', '2', '3', '4'])
+
+    def test_verify_only_detects_broken_increment(self):
+        self.backup()
+        self.execute(self.main_path, "INSERT INTO t (value) VALUES ('март')")
+        manifest = self.backup(incremental=True)
+        increment = next(path for path in self.backups.glob('*.inc.*') if not path.name.endswith('.json'))
+        data = bytearray(increment.read_bytes())
+        data[len(data) // 2] ^= 0xFF
+        increment.write_bytes(bytes(data))
+        with mock.patch.dict(settings.DATABASES['default'], NAME=str(self.main_path)):
+            with self.assertRaises(CommandError):
+                call_command('restore_db', str(manifest), verify_only=True, stdout=io.StringIO())
+        self.assertEqual(self.values(self.main_path), ['март'])
+
+
+@override_settings(SQLITE_ARCHIVE_PATH='db_archive.sqlite3')
+class ArchiveMonthTests(TimesheetFixtureMixin, TestCase):
+    """archive_month/unarchive_month и запрет записи в архивный месяц"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Архив подключается при открытии соединения, а оно уже открыто; ATTACH — до транзакции класса
+        with override_settings(SQLITE_ARCHIVE_PATH='db_archive.sqlite3'), connection.cursor() as cursor:
+            attach_archive(connection, cursor)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DETACH DATABASE {ARCHIVE_SCHEMA}')
+
+    def archive_february(self):
+        original = list(Timesheet.objects.filter(date__year=2024, date__month=2).values())
+        self.assertEqual(archive_month(Timesheet, 2024, 2), len(original))
+        return original
+
+    def test_round_trip(self):
+        original = self.archive_february()
+        self.assertFalse(Timesheet.objects.filter(date__year=2024, date__month=2).exists())
+        self.assertTrue(ArchivedMonth.objects.filter(timesheet_type='main', year=2024, month=2).exists())
+        read_model = get_timesheet_read_model(Timesheet, 2024, 2)
+        self.assertIs(read_model, ArchivedTimesheet)
+        self.assertEqual(
+            list(read_model.objects.filter(date__year=2024, date__month=2).values_list('id', 'value', 'status')),
+            [(row['id'], row['value'], row['status']) for row in original],
+        )
+        # Соседний месяц остается в основной таблице
+        self.assertIs(get_timesheet_read_model(Timesheet, 2024, 3), Timesheet)
+
+        self.assertEqual(unarchive_month(Timesheet, 2024, 2), len(original))
+        self.assertEqual(list(Timesheet.objects.filter(date__year=2024, date__month=2).values()), original)
+        self.assertFalse(ArchivedMonth.objects.exists())
+        self.assertFalse(ArchivedTimesheet.objects.exists())
+
+    def test_month_with_unapproved_rows_is_not_archived(self):
+        with self.assertRaises(ValueError):
+            archive_month(Timesheet, 2024, 3)
+        self.assertFalse(ArchivedMonth.objects.exists())
+
+    def test_writes_into_archived_month_are_refused(self):
+        self.archive_february()
+        employee = self.regular[1]
+        self.client.force_login(self.master)
+
+        response = self.client.post(reverse('timesheet:quick_edit'), {
+            'employee_id': employee.id, 'date': '2024-02-28', 'value': '8',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('архив', str(response.json()))
+        response = self.client.post(reverse('timesheet:fill_range'), {
+            'employee_id': employee.id, 'date_from': '2024-02-27', 'date_to': '2024-03-02', 'value': '8',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('архив', str(response.json()))
+        response = self.client.post('/timesheet/api/timesheets/', {
+            'date': '2024-02-28', 'employee': employee.id, 'master': self.master.id, 'value': '8',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('архив', str(response.json()))
+
+        result = bulk_upsert_timesheets(self.master, [
+            {'employee': employee.id, 'date': '2024-02-28', 'value': '8'},
+            {'employee': employee.id, 'date': '2024-03-20', 'value': '8'},
+        ], Timesheet)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([e['index'] for e in result['errors']], [0])
+
+        self.assertFalse(Timesheet.objects.filter(date__year=2024, date__month=2).exists())
+        with self.assertRaises(ValidationError):
+            check_months_writable(Timesheet, date(2024, 1, 15), date(2024, 2, 1))
+        check_months_writable(Timesheet, date(2024, 3, 1), date(2024, 3, 31))
+
+
+class BulkUpsertTests(TimesheetFixtureMixin, TestCase):
+    def test_planner_master_follows_assignment(self):
+        # У переведенного сотрудника Employee.master пуст, есть только назначения
+        employee = self.transferred
+        result = bulk_upsert_timesheets(self.planner, [
+            {'employee': employee.id, 'date': '2024-02-15', 'value': '8'},
+            {'employee': employee.id, 'date': '2024-03-20', 'value': '7'},
+        ], Timesheet)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['created'], 2)
+        masters = dict(Timesheet.objects.filter(
+            employee=employee, date__in=[date(2024, 2, 15), date(2024, 3, 20)]
+        ).values_list('date', 'master_id'))
+        self.assertEqual(masters, {date(2024, 2, 15): self.master.id, date(2024, 3, 20): self.foundry_master.id})
+
+    def test_updates_drafts_and_reports_row_errors(self):
+        draft = Timesheet.objects.get(employee=self.regular[0], date=date(2024, 3, 1))
+        submitted = Timesheet.objects.get(employee=self.regular[1], date=date(2024, 3, 1))
+        result = bulk_upsert_timesheets(self.master, [
+            {'employee': draft.employee_id, 'date': '2024-03-01', 'value': '7'},
+            {'employee': submitted.employee_id, 'date': '2024-03-01', 'value': '7'},
+            {'employee': self.foundry[0].id, 'date': '2024-03-20', 'value': '8'},
+            {'employee': draft.employee_id, 'date': '2024-03-02', 'value': 'ЖЖ'},
+        ], Timesheet)
+        self.assertEqual((result['created'], result['updated']), (0, 1))
+        self.assertEqual([e['index'] for e in result['errors']], [1, 2, 3])
+        draft.refresh_from_db()
+        submitted.refresh_from_db()
+        self.assertEqual((draft.value, submitted.value), ('7', '8'))
+        self.assertFalse(Timesheet.objects.filter(employee=self.foundry[0], date=date(2024, 3, 20)).exists())
+
+    def test_employee_without_master_or_assignment(self):
+        employee = Employee.objects.create(last_name='Новый', first_name='Тест', employee_id_own='E-99')
+        result = bulk_upsert_timesheets(self.planner, [
+            {'employee': employee.id, 'date': '2024-03-20', 'value': '8'},
+        ], Timesheet)
+        self.assertEqual(result['errors'], [{'index': 0, 'error': 'У сотрудника не указан мастер'}])
+
+
+class GridImportTests(TimesheetFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.superuser = User.objects.create(username='root', employee_id='R-1', is_superuser=True)
+        # Сотрудник из import_timesheet_staff: только назначение, Employee.master пуст
+        self.employee = Employee.objects.create(last_name='Импортов', first_name='Тест', employee_id_own='E-50')
+        EmployeeAssignment.objects.create(employee=self.employee, master=self.master, start_date=date(2024, 4, 3))
+
+    def write_grid(self, rows):
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Таб. №', 'ФИО'] + list(range(1, 31)))
+        for row in rows:
+            ws.append(row)
+        path = self.tmp / 'grid.xlsx'
+        wb.save(path)
+        return str(path)
+
+    def test_assignment_only_staff(self):
+        path = self.write_grid([['E-50', 'Импортов Т.', None, None, 8, 'В', 7]])
+        call_command('import_timesheet_values', path, year=2024, month=4, stdout=io.StringIO())
+        rows = Timesheet.objects.filter(employee=self.employee).order_by('date')
+        self.assertEqual([(ts.date.day, ts.value, ts.master_id) for ts in rows], [
+            (3, '8', self.master.id), (4, 'В', self.master.id), (5, '7', self.master.id),
+        ])
+
+    def test_row_errors_are_reported(self):
+        path = self.write_grid([
+            ['E-50', 'Импортов Т.', 8, None, 8],
+            ['E-404', 'Неизвестный', 8],
+        ])
+        result = import_timesheet_grid(path, self.superuser, Timesheet, 2024, 4)
+        self.assertEqual((result['rows'], result['created']), (2, 1))
+        self.assertEqual(
+            [(e['row'], e['column']) for e in result['errors']],
+            [(2, 'C'), (3, 'A')],
+        )
+        self.assertTrue(Timesheet.objects.filter(employee=self.employee, date=date(2024, 4, 3)).exists())
+
+
+class StaffImportTests(TimesheetFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.unplaced = Employee.objects.create(last_name='Безместов', first_name='Тест', employee_id_own='E-90')
+        self.path = self.tmp / 'staff.csv'
+        self.path.write_text(
+            'Таб. №;ФИО;Отдел;Должность;ФИО мастера\n'
+            'E-1;Работник1 Тест;Литейный цех;Литейщик;Петров Петр\n'
+            'N-1;Новиков Новик;Новый участок;Токарь;Кузнецов Кузьма\n'
+            'E-90;Безместов Тест;;Слесарь;Иванов Иван\n',
+            encoding='utf-8',
+        )
+
+    def run_import(self, **options):
+        out = io.StringIO()
+        call_command('import_timesheet_staff', str(self.path), year=2024, month=4,
+                     close_previous=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run_reports_plan(self):
+        before = (Employee.objects.count(), EmployeeAssignment.objects.count(), User.objects.count())
+        output = self.run_import(dry_run=True)
+        for line in (
+            '+ отдел: Новый участок',
+            '+ мастер: Кузнецов Кузьма',
+            '+ сотрудник: Новиков Новик (N-1)',
+            '+ назначение: Работник1 Тест (E-1) -> Петров Петр с 01.04.2024',
+            '+ назначение: Безместов Тест (E-90) -> Иванов Иван с 01.04.2024',
+            '- назначение: Работник1 Тест (E-1) -> Иванов Иван по 31.03.2024',
+            '~ сотрудник Безместов Тест (E-90): position_own=Слесарь',
+        ):
+            self.assertIn(line, output)
+        self.assertEqual(
+            (Employee.objects.count(), EmployeeAssignment.objects.count(), User.objects.count()), before
+        )
+        self.assertIsNone(EmployeeAssignment.objects.get(employee=self.regular[0], master=self.master).end_date)
+
+    def test_import_applies_plan(self):
+        self.run_import()
+        self.assertEqual(
+            EmployeeAssignment.objects.get(employee=self.regular[0], master=self.master).end_date, date(2024, 3, 31)
+        )
+        self.assertTrue(EmployeeAssignment.objects.filter(
+            employee=self.regular[0], master=self.foundry_master, start_date=date(2024, 4, 1)
+        ).exists())
+        newcomer = Employee.objects.get(employee_id_own='N-1')
+        self.assertEqual((newcomer.position_own, newcomer.department_own.name), ('Токарь', 'Новый участок'))
+        self.assertEqual(newcomer.assignments.get().master.get_full_name(), 'Кузнецов Кузьма')
+        self.unplaced.refresh_from_db()
+        self.assertEqual(self.unplaced.position_own, 'Слесарь')
+        # Повторный импорт ничего не меняет
+        self.assertIn('назначений создано: 0, закрыто: 0', self.run_import())
+
+
+class CalendarImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def import_calendar(self, text, **options):
+        path = self.tmp / 'calendar.csv'
+        path.write_text(text, encoding='utf-8')
+        out = io.StringIO()
+        call_command('import_production_calendar', str(path), stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_replaces_year(self):
+        Holiday.objects.create(date=date(2024, 6, 12), name='Устаревший', type='holiday')
+        Holiday.objects.create(date=date(2023, 6, 12), name='Прошлый год', type='holiday')
+        output = self.import_calendar(
+            'Дата;Тип;Название;Перенос на\n'
+            '01.05.2024;Праздник;Праздник весны и труда;\n'
+            '2024-05-08;предпраздничный;;\n'
+            '27.04.2024;перенос;;29.04.2024\n'
+            'неделя;праздник;;\n'
+        )
+        self.assertIn('Строка 5: некорректная дата или тип', output)
+        self.assertEqual(
+            dict(Holiday.objects.filter(date__year=2024).values_list('date', 'type')),
+            {date(2024, 5, 1): 'holiday', date(2024, 5, 8): 'preholiday'},
+        )
+        self.assertTrue(Holiday.objects.filter(date=date(2023, 6, 12)).exists())
+        self.assertEqual(
+            list(WorkdaySwap.objects.values_list('date_a', 'date_b')), [(date(2024, 4, 27), date(2024, 4, 29))]
+        )
+
+    def test_dry_run_writes_nothing(self):
+        version = get_calendar_cache_version()
+        self.import_calendar('Дата;Тип\n01.05.2024;праздник\n', dry_run=True)
+        self.assertFalse(Holiday.objects.exists())
+        self.assertEqual(get_calendar_cache_version(), version)
+
+    def test_cached_calendar_follows_version_in_db(self):
+        self.assertEqual(get_month_day_values(2024, 5)[2], '8')
+        self.import_calendar('Дата;Тип\n02.05.2024;праздник\n')
+        self.assertEqual(get_month_day_values(2024, 5)[2], 'В')
+        # Другой воркер меняет календарь: его кеш недоступен, но версия в БД общая
+        Holiday.objects.filter(date=date(2024, 5, 2)).delete()
+        CalendarVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        self.assertEqual(get_month_day_values(2024, 5)[2], '8')
+
+
+class MonthApprovalTests(TimesheetFixtureMixin, TestCase):
+    url = reverse('timesheet:approve_month')
+
+    def approve(self, user, master_ids):
+        self.client.force_login(user)
+        return self.client.post(self.url, {'year': YEAR, 'month': MONTH, 'master_ids': master_ids})
+
+    def test_approves_submitted_month(self):
+        response = self.approve(self.planner, [self.foundry_master.id])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['approved_count'], 30)
+        self.assertFalse(Timesheet.objects.filter(
+            master=self.foundry_master, date__range=(MONTH_START, MONTH_END)
+        ).exclude(status='approved').exists())
+        batch = ApprovalBatch.objects.get()
+        self.assertEqual((batch.approved_count, batch.approved_by), (30, self.planner))
+        self.assertEqual(list(batch.masters.all()), [self.foundry_master])
+        # Повторное утверждение ничего не меняет и не пишет пустую пачку
+        response = self.approve(self.planner, [self.foundry_master.id])
+        self.assertEqual(response.json()['approved_count'], 0)
+        self.assertEqual(ApprovalBatch.objects.count(), 1)
+
+    def test_drafts_block_approval(self):
+        response = self.approve(self.planner, [self.master.id, self.foundry_master.id])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('несданные', response.json()['error'])
+        self.assertFalse(ApprovalBatch.objects.exists())
+        self.assertTrue(Timesheet.objects.filter(master=self.foundry_master, status='submitted').exists())
+
+    def test_unknown_masters_are_rejected(self):
+        for user, ids in (
+            (self.admin, [self.foundry_master.id, 999999]),
+            (self.admin, [self.planner.id]),
+        ):
+            response = self.approve(user, ids)
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertIn('Мастера не найдены', response.json()['error'])
+        planner = User.objects.create(username='planner2', employee_id='P-2', role='planner')
+        self.client.force_login(planner)
+        response = self.client.post('/timesheet/api/timesheets/approve-month/', {
+            'master_ids': [999999], 'year': YEAR, 'month': MONTH,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(ApprovalBatch.objects.exists())
+
+    def test_button_only_for_approvers(self):
+        button = 'onclick="approveEntireMonth()"'
+        params = {'year': YEAR, 'month': MONTH, 'master': self.foundry_master.id}
+        self.client.force_login(self.planner)
+        self.assertContains(self.client.get(reverse('timesheet:monthly_table'), params), button)
+        self.client.force_login(self.master)
+        self.assertNotContains(self.client.get(reverse('timesheet:monthly_table'), params), button)
+        self.assertEqual(self.approve(self.master, [self.master.id]).status_code, 403)
+
+
+class MilkVoucherTests(TimesheetFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        PositionMilkAllowance.objects.create(position='Литейщик', per_day_count=2)
+        PositionMilkAllowance.objects.create(position='Формовщик', per_day_count=0)
+        # Неявки и пустые ячейки не считаются днями явки
+        Timesheet.objects.bulk_create([
+            Timesheet(date=date(2024, 3, 11), employee=self.foundry[0], master=self.foundry_master, value='Б'),
+            Timesheet(date=date(2024, 3, 12), employee=self.foundry[0], master=self.foundry_master, value=''),
+        ])
+        # Должность берется из учетной записи, если она есть
+        user = User.objects.create(username='former', employee_id='F-1', position='Формовщик')
+        self.former = Employee.objects.create(user=user, is_foundry=True, position_own='Литейщик')
+        Timesheet.objects.create(date=date(2024, 3, 4), employee=self.former, master=self.foundry_master, value='8')
+
+    def expected_vouchers(self):
+        # Дни явки — по правилам свода (update_statistics), чтобы талоны и статистика не расходились
+        stats = defaultdict(dict)
+        for ts in Timesheet.objects.filter(date__range=(MONTH_START, MONTH_END), employee__is_foundry=True):
+            if ts.employee.position == 'Литейщик':
+                update_statistics(stats, ts.employee_id, ts.date.day, ts.value, False,
+                                  TOTAL_HOURS_FORMATS, EVENING_FORMATS, NIGHT_FORMATS, OVERTIME_FORMATS)
+        return {employee_id: (2 * n, n) for employee_id, n in stats['attendance'].items()}
+
+    def vouchers(self):
+        return {
+            v.employee_id: (v.count, v.attended_days)
+            for v in MilkVoucher.objects.filter(year=YEAR, month=MONTH)
+        }
+
+    def test_vouchers_match_attendance(self):
+        MilkVoucher.objects.create(employee=self.regular[0], year=YEAR, month=MONTH, count=5)
+        MilkVoucher.objects.create(employee=self.foundry[1], year=YEAR, month=MONTH, count=99)
+        MilkVoucher.objects.create(employee=self.regular[0], year=YEAR, month=4, count=7)
+
+        self.assertEqual(calculate_milk_vouchers(YEAR, MONTH, self.planner), (3, 60))
+        self.assertEqual(self.vouchers(), self.expected_vouchers())
+        self.assertEqual(self.vouchers(), {emp.id: (20, 10) for emp in self.foundry})
+        # Чужие месяцы не трогаются, устаревшие записи месяца удаляются
+        self.assertTrue(MilkVoucher.objects.filter(employee=self.regular[0], month=4).exists())
+        self.assertEqual(MilkVoucher.objects.get(employee=self.foundry[1], month=MONTH).created_by, self.planner)
+
+    def test_recalculation_follows_timesheet(self):
+        calculate_milk_vouchers(YEAR, MONTH)
+        Timesheet.objects.filter(employee=self.foundry[0], date=date(2024, 3, 12)).update(value='8')
+        Timesheet.objects.filter(employee=self.foundry[2]).update(value='О')
+        self.assertEqual(calculate_milk_vouchers(YEAR, MONTH), (2, 42))
+        self.assertEqual(self.vouchers(), self.expected_vouchers())
+        self.assertNotIn(self.foundry[2].id, self.vouchers())
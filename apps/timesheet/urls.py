@@ -5,6 +5,7 @@ from . import web_views
 
 router = DefaultRouter()
 router.register(r'timesheets', views.TimesheetViewSet, basename='api-timesheet')
+router.register(r'itr-timesheets', views.ItrTimesheetViewSet, basename='api-itr-timesheet')
 
 app_name = 'timesheet'
 
@@ -17,6 +18,7 @@ urlpatterns = [
     path('<int:pk>/approve/', web_views.approve_timesheet, name='approve'),
     path('export/', web_views.export_view, name='export'),
     path('bulk-approve/', web_views.bulk_approve_view, name='bulk_approve'),
+    path('approve-month/', web_views.approve_month_view, name='approve_month'),
     path('print-monthly/', web_views.print_monthly_table, name='print_monthly_table'),
     # API
     path('api/', include(router.urls)),
@@ -35,6 +37,7 @@ urlpatterns = [
     path('submit-month/', web_views.submit_month, name='submit_month'),
     path('print-monthly-table/', web_views.print_monthly_table, name='print_monthly_table'),
     path('get-statistics/', web_views.get_statistics_view, name='get_statistics'),
+    path('department-rollup/', web_views.department_rollup_view, name='department_rollup'),
     path('milk-vouchers/', web_views.milk_vouchers_view, name='milk_vouchers'),
     path('milk-vouchers/print/', web_views.print_milk_vouchers_view, name='milk_vouchers_print'),
 ]
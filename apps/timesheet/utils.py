@@ -66,6 +66,7 @@ def create_monthly_timesheets(master, year, month, default_value='В', include_w
     import calendar
     
     month_start = datetime(year, month, 1).date()
+    check_months_writable(Timesheet, month_start)
     # По назначениям на месяц или legacy master
     employees = Employee.objects.filter(is_active=True).filter(
         (
@@ -139,3 +140,770 @@ def get_master_employees_with_timesheets(master, date):
         })
     
     return result
+
+def bulk_upsert_timesheets(user, rows, TimesheetModel, batch_size=500):
+    """
+    Массовое создание/обновление табелей (основных или ИТР) одной транзакцией.
+
+    rows — список словарей {'employee': id, 'date': 'ГГГГ-ММ-ДД', 'value': str}.
+    Проверка кодов, прав и конфликтов по (date, employee) выполняется пакетно:
+    сотрудники, назначения и существующие записи загружаются фиксированным
+    числом запросов, запись — через bulk_create(update_conflicts=True).
+    Мастер строки — текущий пользователь-мастер, для плановика и администратора —
+    мастер назначения EmployeeAssignment на дату строки (иначе Employee.master).
+
+    Returns:
+        dict: счетчики created/updated/skipped и список ошибок по строкам
+    """
+    from django.core.exceptions import ValidationError
+    from django.db import transaction
+    from django.db.models import Q
+    from apps.users.models import Employee, EmployeeAssignment
+    from .models import ItrTimesheet
+
+    is_itr = TimesheetModel is ItrTimesheet
+    errors = []
+    parsed = {}
+    value_errors = {}
+
+    # 1) Разбор строк без обращений к БД; при дублях (date, employee) побеждает последняя строка
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({'index': index, 'error': 'Ожидался объект с полями employee, date, value'})
+            continue
+        try:
+            employee_id = int(row.get('employee'))
+            day = datetime.strptime(str(row.get('date')), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            errors.append({'index': index, 'error': 'Некорректные employee или date'})
+            continue
+        value = str(row.get('value') or '').strip()
+        if not value:
+            errors.append({'index': index, 'error': 'Пустое значение'})
+            continue
+        if value not in value_errors:
+            try:
+                TimesheetModel(value=value).clean()
+                value_errors[value] = None
+            except ValidationError as e:
+                value_errors[value] = '; '.join(e.messages)
+        if value_errors[value]:
+            errors.append({'index': index, 'error': value_errors[value]})
+            continue
+        parsed[(day, employee_id)] = (index, value)
+
+    skipped = len(rows) - len(errors) - len(parsed)
+    if not parsed:
+        return {'created': 0, 'updated': 0, 'skipped': skipped, 'errors': errors}
+
+    employee_ids = {employee_id for _, employee_id in parsed}
+    dates = [day for day, _ in parsed]
+    date_from, date_to = min(dates), max(dates)
+
+    # 2) Предзагрузка сотрудников, назначений мастера и существующих записей
+    employees = Employee.objects.only(
+        'id', 'master_id', 'hire_date', 'is_itr_employee'
+    ).in_bulk(employee_ids)
+    # Назначения всех мастеров: мастер строки — тот, чье назначение покрывает ее дату
+    assignments = {}
+    assignment_qs = EmployeeAssignment.objects.filter(
+        employee_id__in=employee_ids, start_date__lte=date_to
+    ).filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=date_from)
+    )
+    if user.is_master:
+        assignment_qs = assignment_qs.filter(master=user)
+    for employee_id, master_id, start, end in assignment_qs.order_by('-start_date').values_list(
+        'employee_id', 'master_id', 'start_date', 'end_date'
+    ):
+        assignments.setdefault(employee_id, []).append((start, end, master_id))
+    # Статусы читаются в транзакции записи: строку, утвержденную между проверкой
+    # и записью, upsert не перезапишет (PostgreSQL — блокировка строк; SQLite в
+    # режиме WAL откажет в записи по устаревшему снимку, и пакет откатится)
+    with transaction.atomic():
+        archived = get_archived_months(TimesheetModel, date_from, date_to)
+        existing = {
+            (day, employee_id): status
+            for day, employee_id, status in TimesheetModel.objects.select_for_update().filter(
+                employee_id__in=employee_ids, date__range=(date_from, date_to)
+            ).order_by().values_list('date', 'employee_id', 'status')
+        }
+
+        # 3) Проверка прав и статусов в памяти
+        objs = []
+        created = updated = 0
+        for (day, employee_id), (index, value) in parsed.items():
+            employee = employees.get(employee_id)
+            if employee is None:
+                errors.append({'index': index, 'error': 'Сотрудник не найден'})
+                continue
+            if is_itr and not employee.is_itr_employee:
+                errors.append({'index': index, 'error': 'Сотрудник не включен в табель ИТР'})
+                continue
+            if not is_itr and employee.is_itr_employee:
+                errors.append({'index': index, 'error': 'Сотрудник в табеле ИТР и не может быть в обычном табеле'})
+                continue
+            if employee.hire_date and day < employee.hire_date:
+                errors.append({'index': index, 'error': 'Дата раньше даты приема сотрудника'})
+                continue
+            if (day.year, day.month) in archived:
+                errors.append({'index': index, 'error': ARCHIVED_MONTH_ERROR})
+                continue
+            # Последнее по дате начала назначение, покрывающее день
+            assigned_master_id = next(
+                (master for start, end, master in assignments.get(employee_id, ())
+                 if start <= day and (end is None or end >= day)),
+                None,
+            )
+            if user.is_master:
+                if not (assigned_master_id or employee.master_id == user.id):
+                    errors.append({'index': index, 'error': 'Нет прав на табель этого сотрудника'})
+                    continue
+                master_id = user.id
+            else:
+                # Поле Employee.master — только если на дату нет назначения
+                master_id = assigned_master_id or employee.master_id
+                if master_id is None:
+                    errors.append({'index': index, 'error': 'У сотрудника не указан мастер'})
+                    continue
+            status = existing.get((day, employee_id))
+            if status is not None and status != 'draft':
+                errors.append({'index': index, 'error': 'Табель сдан или утвержден и не может быть изменен'})
+                continue
+            if status is None:
+                created += 1
+            else:
+                updated += 1
+            objs.append(TimesheetModel(
+                date=day, employee_id=employee_id, master_id=master_id, value=value, status='draft'
+            ))
+
+        # 4) Запись в той же транзакции, что и чтение статусов
+        if objs:
+            TimesheetModel.objects.bulk_create(
+                objs,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['date', 'employee'],
+                update_fields=['value', 'master', 'updated_at'],
+            )
+
+    errors.sort(key=lambda e: e['index'])
+    return {'created': created, 'updated': updated, 'skipped': skipped, 'errors': errors}
+
+def normalize_grid_value(raw):
+    """Значение ячейки табеля Excel в формат поля value ('8', '3,5', 'В')"""
+    if raw is None:
+        return ''
+    if isinstance(raw, bool):
+        return ''
+    if isinstance(raw, (int, float)):
+        if float(raw).is_integer():
+            return str(int(raw))
+        return f'{raw:g}'.replace('.', ',')
+    return str(raw).strip().upper()
+
+def import_timesheet_grid(source, user, TimesheetModel, year, month, sheet_name=None,
+                          chunk_size=100, progress=None):
+    """
+    Импорт месячной сетки табеля из Excel (строка — сотрудник, колонки 1..31 — дни).
+
+    Лист (.xlsx, .xls или .csv) читается через apps.core.spreadsheets. Строка
+    заголовка ищется среди первых строк по колонкам с номерами дней, колонка
+    табельного номера — по заголовку «Таб...». Сотрудники сопоставляются по табельному номеру через
+    индекс, загруженный одним запросом; значения записываются пакетами по
+    chunk_size строк листа через bulk_upsert_timesheets (каждый пакет — своя
+    транзакция).
+
+    Returns:
+        dict: rows, created, updated, skipped и errors [{'row', 'column', 'error'}]
+    """
+    import calendar
+    from datetime import date
+    from openpyxl.utils import get_column_letter
+    from apps.core.spreadsheets import iter_rows
+    from apps.users.models import Employee
+
+    days_in_month = calendar.monthrange(year, month)[1]
+
+    # Индекс табельных номеров: пользователи системы и сотрудники без учетной записи
+    tab_index = dict(
+        Employee.objects.filter(user__isnull=False).values_list('user__employee_id', 'id')
+    )
+    for tab, emp_id in Employee.objects.filter(user__isnull=True).exclude(
+        employee_id_own__isnull=True
+    ).exclude(employee_id_own='').values_list('employee_id_own', 'id'):
+        tab_index.setdefault(tab, emp_id)
+
+    result = {'rows': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+    day_columns = {}
+    tab_column = None
+    chunk = []
+    positions = []
+
+    def flush():
+        outcome = bulk_upsert_timesheets(user, chunk, TimesheetModel)
+        for key in ('created', 'updated', 'skipped'):
+            result[key] += outcome[key]
+        for error in outcome['errors']:
+            row_number, column = positions[error['index']]
+            result['errors'].append({'row': row_number, 'column': column, 'error': error['error']})
+        chunk.clear()
+        positions.clear()
+        if progress:
+            progress(result['rows'])
+
+    rows_in_chunk = 0
+    for row_number, cells in enumerate(iter_rows(source, sheet_name=sheet_name), start=1):
+        if not day_columns:
+            # Строка заголовка: не меньше 28 колонок с номерами дней
+            found = {}
+            for col, cell in enumerate(cells):
+                text = normalize_grid_value(cell)
+                if text.isdigit() and 1 <= int(text) <= 31:
+                    found.setdefault(int(text), col)
+                elif tab_column is None and 'ТАБ' in text:
+                    tab_column = col
+            if len(found) >= 28:
+                day_columns = {d: col for d, col in found.items() if d <= days_in_month}
+                if tab_column is None:
+                    tab_column = 0
+            elif row_number >= 20:
+                raise ValueError('Не найдена строка заголовка с номерами дней 1..31')
+            else:
+                tab_column = None
+            continue
+
+        tab = normalize_grid_value(cells[tab_column] if tab_column < len(cells) else None)
+        if not tab:
+            continue
+        result['rows'] += 1
+        employee_id = tab_index.get(tab)
+        if employee_id is None:
+            result['errors'].append({
+                'row': row_number, 'column': get_column_letter(tab_column + 1),
+                'error': f'Сотрудник с табельным номером {tab} не найден'
+            })
+            continue
+        for day, col in day_columns.items():
+            value = normalize_grid_value(cells[col] if col < len(cells) else None)
+            if not value:
+                continue
+            chunk.append({
+                'employee': employee_id,
+                'date': date(year, month, day).isoformat(),
+                'value': value,
+            })
+            positions.append((row_number, get_column_letter(col + 1)))
+        rows_in_chunk += 1
+        if rows_in_chunk >= chunk_size:
+            if chunk:
+                flush()
+            rows_in_chunk = 0
+    if not day_columns:
+        raise ValueError('Не найдена строка заголовка с номерами дней 1..31')
+    if chunk:
+        flush()
+
+    result['errors'].sort(key=lambda e: e['row'])
+    return result
+
+def write_import_errors_report(errors, prefix='timesheet_import'):
+    """Запись ошибок импорта в CSV в каталоге logs; возвращает путь к файлу"""
+    from pathlib import Path
+    from django.conf import settings
+    from django.utils import timezone
+
+    logs_dir = Path(getattr(settings, 'BASE_DIR', '.')) / 'logs'
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    path = logs_dir / f"{prefix}_errors_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    with path.open('w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Строка', 'Колонка', 'Ошибка'])
+        for error in errors:
+            writer.writerow([error['row'], error['column'], error['error']])
+    return path
+
+def set_timesheets_approval(queryset, user, approve=True):
+    """
+    Утверждение/снятие утверждения табелей одним UPDATE.
+
+    Работает для любой модели табеля (Timesheet, ItrTimesheet): queryset
+    определяет и таблицу, и набор записей.
+
+    Returns:
+        int: количество обновленных записей
+    """
+    from django.utils import timezone
+
+    if approve:
+        return queryset.filter(status__in=['draft', 'submitted']).update(
+            status='approved',
+            approved_by=user,
+            approved_at=timezone.now(),
+            updated_at=timezone.now()
+        )
+    return queryset.filter(status='approved').update(
+        status='draft',
+        approved_by=None,
+        approved_at=None,
+        updated_at=timezone.now()
+    )
+
+def approve_month(user, master_ids, year, month, timesheet_types=('main',)):
+    """
+    Утверждение месяца целиком для выбранных мастеров.
+
+    Для каждой таблицы проверяет, что черновиков за месяц не осталось
+    (один агрегирующий запрос), и утверждает все сданные записи одним
+    UPDATE по диапазону дат. Каждое утверждение, изменившее хотя бы одну
+    запись, фиксируется в ApprovalBatch.
+
+    Raises:
+        ValueError: если среди master_ids есть не мастера или у мастеров
+            остались несданные записи
+
+    Returns:
+        dict: количество утвержденных записей по типам табеля
+    """
+    import calendar
+    from datetime import date
+    from django.db import transaction
+    from django.db.models import Count
+    from apps.users.models import User
+    from .models import Timesheet, ItrTimesheet, ApprovalBatch
+
+    models_by_type = {'main': Timesheet, 'itr': ItrTimesheet}
+    master_ids = sorted({int(m) for m in master_ids})
+    known = set(User.objects.filter(id__in=master_ids, role='master').values_list('id', flat=True))
+    unknown = [m for m in master_ids if m not in known]
+    if unknown:
+        raise ValueError(f'Мастера не найдены: {", ".join(map(str, unknown))}')
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+
+    approved = {}
+    with transaction.atomic():
+        scoped = {
+            timesheet_type: models_by_type[timesheet_type].objects.filter(
+                master_id__in=master_ids, date__range=(month_start, month_end)
+            )
+            for timesheet_type in timesheet_types
+        }
+        for timesheet_type, queryset in scoped.items():
+            drafts = dict(
+                queryset.filter(status='draft').order_by().values('master_id')
+                .annotate(n=Count('id')).values_list('master_id', 'n')
+            )
+            if drafts:
+                details = ', '.join(f'мастер {m}: {n}' for m, n in sorted(drafts.items()))
+                raise ValueError(f'Есть несданные записи ({details})')
+        for timesheet_type, queryset in scoped.items():
+            updated = set_timesheets_approval(queryset, user, approve=True)
+            approved[timesheet_type] = updated
+            if not updated:
+                # Нечего утверждать — пустую пачку в журнал не пишем
+                continue
+            batch = ApprovalBatch.objects.create(
+                timesheet_type=timesheet_type,
+                year=year,
+                month=month,
+                approved_count=updated,
+                approved_by=user,
+            )
+            batch.masters.set(master_ids)
+    return approved
+
+CALENDAR_CACHE_TIMEOUT = 300
+
+def get_calendar_cache_version():
+    """
+    Текущая версия кеша производственного календаря (праздники и переносы).
+
+    Читается из БД при каждом обращении: кеш у каждого процесса свой, и версия
+    в нем не увидела бы изменений, сделанных другим воркером.
+    """
+    from .models import CalendarVersion
+    return CalendarVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 1
+
+def bump_calendar_cache_version():
+    """
+    Сбросить закешированные данные календаря после изменения Holiday/WorkdaySwap.
+
+    Ключи кеша включают версию, поэтому старые записи перестают читаться во
+    всех процессах и просто истекают по CALENDAR_CACHE_TIMEOUT.
+    """
+    from django.db.models import F
+    from django.utils import timezone
+    from .models import CalendarVersion
+    if not CalendarVersion.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+        CalendarVersion.objects.get_or_create(pk=1, defaults={'version': 2})
+    return get_calendar_cache_version()
+
+def get_archive_model(TimesheetModel):
+    """Архивная модель (схема archive) для Timesheet/ItrTimesheet"""
+    from .models import ItrTimesheet, ArchivedTimesheet, ArchivedItrTimesheet
+    return ArchivedItrTimesheet if TimesheetModel is ItrTimesheet else ArchivedTimesheet
+
+def get_timesheet_type_for_model(TimesheetModel):
+    from .models import ItrTimesheet
+    return 'itr' if TimesheetModel is ItrTimesheet else 'main'
+
+def get_archived_months(TimesheetModel, date_from=None, date_to=None):
+    """Множество (год, месяц), перенесенных в архив, с необязательным ограничением по датам"""
+    from django.conf import settings
+    from .models import ArchivedMonth
+
+    if not getattr(settings, 'SQLITE_ARCHIVE_PATH', ''):
+        return set()
+    months = set(ArchivedMonth.objects.filter(
+        timesheet_type=get_timesheet_type_for_model(TimesheetModel)
+    ).values_list('year', 'month'))
+    if date_from:
+        months = {ym for ym in months if ym >= (date_from.year, date_from.month)}
+    if date_to:
+        months = {ym for ym in months if ym <= (date_to.year, date_to.month)}
+    return months
+
+def is_month_archived(TimesheetModel, year, month):
+    from django.conf import settings
+    from .models import ArchivedMonth
+
+    if not getattr(settings, 'SQLITE_ARCHIVE_PATH', ''):
+        return False
+    return ArchivedMonth.objects.filter(
+        timesheet_type=get_timesheet_type_for_model(TimesheetModel), year=year, month=month
+    ).exists()
+
+ARCHIVED_MONTH_ERROR = 'Месяц перенесен в архив, изменения недоступны'
+
+def check_months_writable(TimesheetModel, date_from, date_to=None):
+    """
+    Общая проверка всех путей записи табеля: период не затрагивает месяцы,
+    перенесенные в архив. Чтение таких месяцев идет из архивной модели, поэтому
+    новые записи в основной таблице были бы не видны до unarchive_month.
+
+    Raises:
+        ValidationError: если хотя бы один месяц периода в архиве
+    """
+    from django.core.exceptions import ValidationError
+
+    archived = get_archived_months(TimesheetModel, date_from, date_to or date_from)
+    if archived:
+        months = ', '.join(f'{month:02d}.{year}' for year, month in sorted(archived))
+        raise ValidationError(f'{ARCHIVED_MONTH_ERROR} ({months})', code='archived')
+
+def get_timesheet_read_model(TimesheetModel, year, month):
+    """Модель, из которой читаются записи месяца: архивная, если месяц перенесен в архив"""
+    if is_month_archived(TimesheetModel, year, month):
+        return get_archive_model(TimesheetModel)
+    return TimesheetModel
+
+def _archive_tables(TimesheetModel):
+    """(схема, таблица архива, таблица основной БД, колонки)"""
+    archive_table = get_archive_model(TimesheetModel)._meta.db_table
+    schema, table = archive_table.split('"."')
+    columns = [field.column for field in TimesheetModel._meta.concrete_fields]
+    return schema, table, TimesheetModel._meta.db_table, columns
+
+def ensure_archive_table(TimesheetModel):
+    """
+    Создать таблицу архива по образцу основной (CREATE TABLE ... AS SELECT)
+    и досоздать колонки, появившиеся в основной таблице после прошлой архивации.
+    """
+    from django.db import connection
+
+    schema, table, source, columns = _archive_tables(TimesheetModel)
+    quoted = ', '.join(f'"{c}"' for c in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{schema}"."{table}" AS '
+            f'SELECT {quoted} FROM "main"."{source}" WHERE 0'
+        )
+        cursor.execute(f'PRAGMA "{schema}".table_info("{table}")')
+        existing = {row[1] for row in cursor.fetchall()}
+        for column in columns:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE "{schema}"."{table}" ADD COLUMN "{column}"')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{schema}"."{table}_id" ON "{table}" ("id")')
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{schema}"."{table}_date_employee" ON "{table}" ("date", "employee_id")'
+        )
+
+def get_archivable_months(TimesheetModel, before):
+    """
+    Месяцы раньше даты before, все записи которых утверждены.
+
+    Returns:
+        list: кортежи (год, месяц, количество записей) по возрастанию
+    """
+    from django.db.models import Count, Q
+    from django.db.models.functions import TruncMonth
+
+    rows = (
+        TimesheetModel.objects.filter(date__lt=before)
+        .annotate(period=TruncMonth('date'))
+        .order_by().values('period')
+        .annotate(total=Count('id'), approved=Count('id', filter=Q(status='approved')))
+        .order_by('period')
+    )
+    return [
+        (row['period'].year, row['period'].month, row['total'])
+        for row in rows if row['total'] == row['approved']
+    ]
+
+def archive_month(TimesheetModel, year, month):
+    """
+    Перенести утвержденный месяц в архивную БД.
+
+    Записи копируются в архив (INSERT OR REPLACE по id), затем удаляются из
+    основной таблицы, месяц регистрируется в ArchivedMonth. В режиме WAL
+    транзакция по двум файлам не атомарна, поэтому порядок «скопировать, затем
+    удалить» выбран так, чтобы повторный запуск после сбоя был безопасен.
+
+    Raises:
+        ValueError: если записей нет или не все утверждены
+
+    Returns:
+        int: количество перенесенных записей
+    """
+    import calendar
+    from datetime import date
+    from django.db import connection, transaction
+    from django.db.models import Count, Q
+    from .models import ArchivedMonth
+
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+    period = [month_start.isoformat(), month_end.isoformat()]
+    schema, table, source, columns = _archive_tables(TimesheetModel)
+    quoted = ', '.join(f'"{c}"' for c in columns)
+
+    with transaction.atomic():
+        stats = TimesheetModel.objects.filter(date__range=(month_start, month_end)).aggregate(
+            total=Count('id'), approved=Count('id', filter=Q(status='approved'))
+        )
+        if not stats['total']:
+            raise ValueError(f'Нет записей за {month:02d}.{year}')
+        if stats['total'] != stats['approved']:
+            raise ValueError(f'За {month:02d}.{year} есть неутвержденные записи')
+        ensure_archive_table(TimesheetModel)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO "{schema}"."{table}" ({quoted}) '
+                f'SELECT {quoted} FROM "main"."{source}" WHERE "date" BETWEEN %s AND %s',
+                period,
+            )
+            cursor.execute(f'DELETE FROM "main"."{source}" WHERE "date" BETWEEN %s AND %s', period)
+        ArchivedMonth.objects.update_or_create(
+            timesheet_type=get_timesheet_type_for_model(TimesheetModel), year=year, month=month,
+            defaults={'rows': stats['total']},
+        )
+    return stats['total']
+
+def unarchive_month(TimesheetModel, year, month):
+    """
+    Вернуть месяц из архива в основную таблицу.
+
+    Raises:
+        ValueError: если месяц не в архиве или в основной таблице уже есть
+            записи за этот месяц
+
+    Returns:
+        int: количество возвращенных записей
+    """
+    import calendar
+    from datetime import date
+    from django.db import connection, transaction
+    from .models import ArchivedMonth
+
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+    period = [month_start.isoformat(), month_end.isoformat()]
+    schema, table, source, columns = _archive_tables(TimesheetModel)
+    quoted = ', '.join(f'"{c}"' for c in columns)
+
+    with transaction.atomic():
+        record = ArchivedMonth.objects.select_for_update().filter(
+            timesheet_type=get_timesheet_type_for_model(TimesheetModel), year=year, month=month
+        ).first()
+        if record is None:
+            raise ValueError(f'{month:02d}.{year} нет в архиве')
+        if TimesheetModel.objects.filter(date__range=(month_start, month_end)).exists():
+            raise ValueError(f'В основной таблице уже есть записи за {month:02d}.{year}')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO "main"."{source}" ({quoted}) '
+                f'SELECT {quoted} FROM "{schema}"."{table}" WHERE "date" BETWEEN %s AND %s',
+                period,
+            )
+            restored = cursor.rowcount
+            cursor.execute(f'DELETE FROM "{schema}"."{table}" WHERE "date" BETWEEN %s AND %s', period)
+        record.delete()
+    return restored
+
+def employee_department_expression(prefix=''):
+    """Отдел сотрудника в SQL, как Employee.department: отдел учетной записи либо department_own"""
+    from django.db.models import Case, F, When
+    return Case(
+        When(**{f'{prefix}user__isnull': False}, then=F(f'{prefix}user__department_id')),
+        default=F(f'{prefix}department_own_id'),
+    )
+
+def filter_by_department(queryset, department, prefix=''):
+    """
+    Отбор по отделу вместе со всеми подразделениями (Department.path).
+    prefix — путь до сотрудника: '' для Employee, 'employee__' для табелей.
+    """
+    from apps.users.models import Department
+    return queryset.annotate(
+        employee_department_id=employee_department_expression(prefix)
+    ).filter(employee_department_id__in=Department.objects.subtree(department).values('id'))
+
+ROLLUP_KEYS = (
+    'total_hours', 'attendance', 'evening_hours', 'night_hours', 'overtime_hours',
+    'vacation', 'illness', 'business_trip', 'downtime', 'absence', 'other_absence', 'admin_permission',
+)
+
+def _value_contribution(value, cache):
+    """Вклад одной ячейки со значением value в показатели свода (по правилам update_statistics)"""
+    if value not in cache:
+        from .web_views import (
+            EVENING_FORMATS, NIGHT_FORMATS, OVERTIME_FORMATS, TOTAL_HOURS_FORMATS, update_statistics,
+        )
+        stats = {key: {} for key in ROLLUP_KEYS + ('weekend_hours',)}
+        update_statistics(
+            stats, 0, None, value, False,
+            TOTAL_HOURS_FORMATS, EVENING_FORMATS, NIGHT_FORMATS, OVERTIME_FORMATS,
+        )
+        cache[value] = {key: stats[key].get(0, 0) for key in ROLLUP_KEYS}
+    return cache[value]
+
+def department_rollup(department, year, month, timesheet_type='main', statuses=None):
+    """
+    Свод часов и категорий за месяц по отделу и всем его подразделениям.
+
+    Табели группируются в БД одним запросом по (отдел сотрудника, значение):
+    диапазон дат — по индексу date, поддерево — по индексу Department.path.
+    Вклад каждого различного значения считается один раз и умножается на
+    число ячеек. Часы в выходные в свод не входят: они зависят от календаря дня.
+
+    Возвращает строки отделов в порядке дерева: own — по сотрудникам самого
+    отдела, total — вместе с подразделениями.
+    """
+    import calendar
+    from datetime import date, timedelta
+    from django.db.models import Count
+    from apps.users.models import Department
+    from .models import Timesheet, ItrTimesheet
+
+    TimesheetModel = ItrTimesheet if timesheet_type == 'itr' else Timesheet
+    ReadModel = get_timesheet_read_model(TimesheetModel, year, month)
+    month_start = date(year, month, 1)
+    next_month = month_start + timedelta(days=calendar.monthrange(year, month)[1])
+
+    departments = list(Department.objects.subtree(department).order_by('path'))
+    empty = dict.fromkeys(ROLLUP_KEYS, 0)
+    rows = {
+        dep.id: {
+            'id': dep.id, 'name': dep.name, 'code': dep.code, 'depth': dep.depth,
+            'path': dep.path, 'cells': 0, 'total_cells': 0, 'own': dict(empty), 'total': dict(empty),
+        }
+        for dep in departments
+    }
+    if not rows:
+        return []
+
+    cells = filter_by_department(
+        ReadModel.objects.filter(date__gte=month_start, date__lt=next_month),
+        departments[0], prefix='employee__',
+    )
+    if statuses:
+        cells = cells.filter(status__in=statuses)
+    grouped = cells.values('employee_department_id', 'value').annotate(cells=Count('id')).order_by()
+
+    contributions = {}
+    for item in grouped:
+        row = rows.get(item['employee_department_id'])
+        if row is None:
+            continue
+        contribution = _value_contribution(item['value'], contributions)
+        row['cells'] += item['cells']
+        for key, amount in contribution.items():
+            row['own'][key] += amount * item['cells']
+
+    # Итоги поднимаются от каждого отдела ко всем предкам в пределах поддерева
+    for row in rows.values():
+        ancestors = [int(part) for part in row['path'].strip('/').split('/')]
+        for ancestor_id in ancestors:
+            target = rows.get(ancestor_id)
+            if target is None:
+                continue
+            for key, amount in row['own'].items():
+                target['total'][key] += amount
+            target['total_cells'] += row['cells']
+    return [rows[dep.id] for dep in departments]
+
+def employee_position_expression(prefix=''):
+    """Должность сотрудника в SQL, как Employee.position: должность учетной записи либо position_own"""
+    from django.db.models.functions import Coalesce, Trim
+    return Trim(Coalesce(f'{prefix}user__position', f'{prefix}position_own'))
+
+def get_employee_positions():
+    """Различные непустые должности активных сотрудников одним запросом (DISTINCT)"""
+    from apps.users.models import Employee
+    return list(
+        Employee.objects.filter(is_active=True)
+        .annotate(position_name=employee_position_expression())
+        .exclude(position_name='')
+        .values_list('position_name', flat=True).distinct().order_by('position_name')
+    )
+
+def calculate_milk_vouchers(year, month, user=None):
+    """
+    Талоны на молоко за месяц: норма должности (PositionMilkAllowance) × дни явки
+    литейщика по табелю. Дни явки считаются одним сгруппированным запросом
+    (значения, кроме web_views.NON_ATTENDANCE_CODES — тот же список, что в
+    своде), результат сохраняется в MilkVoucher одним upsert; записи месяца
+    для сотрудников без талонов удаляются.
+
+    Возвращает (число сотрудников с талонами, всего талонов).
+    """
+    import calendar
+    from datetime import date, timedelta
+    from django.db import transaction
+    from django.db.models import Count
+    from .models import MilkVoucher, PositionMilkAllowance, Timesheet
+    from .web_views import NON_ATTENDANCE_CODES
+
+    month_start = date(year, month, 1)
+    next_month = month_start + timedelta(days=calendar.monthrange(year, month)[1])
+    ReadModel = get_timesheet_read_model(Timesheet, year, month)
+    attendance = (
+        ReadModel.objects.filter(date__gte=month_start, date__lt=next_month, employee__is_foundry=True)
+        .exclude(value__in=NON_ATTENDANCE_CODES).exclude(value='')
+        .annotate(position_name=employee_position_expression('employee__'))
+        .values('employee_id', 'position_name').annotate(days=Count('id')).order_by()
+    )
+    allowances = dict(PositionMilkAllowance.objects.filter(per_day_count__gt=0).values_list('position', 'per_day_count'))
+
+    vouchers = []
+    for row in attendance:
+        per_day = allowances.get(row['position_name'], 0)
+        if per_day:
+            vouchers.append(MilkVoucher(
+                employee_id=row['employee_id'], year=year, month=month,
+                count=per_day * row['days'], attended_days=row['days'], per_day_count=per_day,
+                created_by=user,
+            ))
+
+    with transaction.atomic():
+        MilkVoucher.objects.filter(year=year, month=month).exclude(
+            employee_id__in=[v.employee_id for v in vouchers]
+        ).delete()
+        MilkVoucher.objects.bulk_create(
+            vouchers, batch_size=500, update_conflicts=True,
+            unique_fields=['employee', 'year', 'month'],
+            update_fields=['count', 'attended_days', 'per_day_count', 'created_by', 'updated_at'],
+        )
+    return len(vouchers), sum(v.count for v in vouchers)
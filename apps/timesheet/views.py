@@ -1,19 +1,28 @@
 import csv
-from datetime import datetime
+import calendar
+from datetime import datetime, date, timedelta
 from django.http import HttpResponse, JsonResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db.models import Q
 from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 
-from .models import Timesheet
-from .serializers import TimesheetSerializer, TimesheetApproveSerializer, ExportSerializer
-from .filters import TimesheetFilter
+from .models import Timesheet, ItrTimesheet
+from .serializers import (
+    TimesheetSerializer, TimesheetApproveSerializer, ExportSerializer,
+    TimesheetBulkUpsertSerializer, ItrTimesheetSerializer, MonthApproveSerializer
+)
+from .filters import TimesheetFilter, ItrTimesheetFilter
+from .utils import bulk_upsert_timesheets, set_timesheets_approval, approve_month, check_months_writable
 from apps.users.permissions import (
     IsAdministrator, IsMaster, IsPlanner, 
     IsMasterOrPlanner, TimesheetEditPermission
@@ -21,40 +30,120 @@ from apps.users.permissions import (
 
 # ========== API ViewSets ==========
 
+class TimesheetPagination(PageNumberPagination):
+    """Постраничная выдача табелей (?page=, ?page_size=)"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 class TimesheetViewSet(viewsets.ModelViewSet):
     """ViewSet для работы с табелями"""
+    timesheet_type = 'main'
     queryset = Timesheet.objects.select_related(
-        'employee', 'employee__user', 'master', 'approved_by'
+        'employee', 'employee__user', 'employee__user__department',
+        'employee__department_own', 'master', 'approved_by'
     ).all()
     serializer_class = TimesheetSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = TimesheetFilter
+    pagination_class = TimesheetPagination
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             permission_classes = [IsAuthenticated, TimesheetEditPermission]
-        elif self.action in ['approve', 'bulk_approve']:
+        elif self.action in ['approve', 'bulk_approve', 'approve_month']:
             permission_classes = [IsAuthenticated, IsPlanner]
         else:
             permission_classes = [IsAuthenticated, IsMasterOrPlanner]
         return [permission() for permission in permission_classes]
     
+    def get_requested_fields(self):
+        """Список полей из ?fields=date,employee,value (только для чтения)"""
+        if self.action not in ['list', 'retrieve']:
+            return None
+        raw = self.request.query_params.get('fields')
+        if not raw:
+            return None
+        fields = [f.strip() for f in raw.split(',') if f.strip()]
+        unknown = set(fields) - set(self.serializer_class.Meta.fields)
+        if unknown:
+            raise ValidationError({'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'})
+        return fields
+    
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+    
     def get_queryset(self):
         user = self.request.user
+        queryset = self.queryset
+        
+        # Сокращенный набор полей: выбираем только нужные колонки и связи,
+        # сортировка по employee_id без JOIN на сотрудника/пользователя
+        fields = self.get_requested_fields()
+        if fields:
+            columns, related = self.serializer_class.get_query_plan(fields)
+            queryset = self.queryset.model.objects.only(*columns).order_by('-date', 'employee_id')
+            if related:
+                queryset = queryset.select_related(*related)
         
         # Администраторы видят все
         if user.is_authenticated and user.is_administrator:
-            return self.queryset
+            return queryset
         
         # Мастера видят только свои табели
         if user.is_authenticated and user.is_master:
-            return self.queryset.filter(master=user)
+            return queryset.filter(master=user)
         
         # Плановый отдел видит все
         if user.is_authenticated and user.is_planner:
-            return self.queryset
+            return queryset
         
-        return Timesheet.objects.none()
+        return queryset.none()
+    
+    def perform_content_negotiation(self, request, force=False):
+        # ?format=matrix — это формат данных, а не рендерер DRF
+        if request.query_params.get('format') == 'matrix':
+            renderer = JSONRenderer()
+            return (renderer, renderer.media_type)
+        return super().perform_content_negotiation(request, force)
+    
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('format') == 'matrix':
+            return self.matrix(request)
+        return super().list(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'])
+    def matrix(self, request):
+        """Компактный формат: строка на сотрудника с массивом значений по дням месяца"""
+        try:
+            year = int(request.query_params.get('year', timezone.now().year))
+            month = int(request.query_params.get('month', timezone.now().month))
+            month_start = date(year, month, 1)
+        except (ValueError, TypeError):
+            raise ValidationError({'month': 'Некорректный год или месяц'})
+        days_in_month = calendar.monthrange(year, month)[1]
+        month_end = month_start + timedelta(days=days_in_month - 1)
+        
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            date__range=(month_start, month_end)
+        ).order_by('employee_id', 'date').values_list('employee_id', 'date', 'value')
+        
+        rows = {}
+        for employee_id, day, value in queryset:
+            if employee_id not in rows:
+                rows[employee_id] = [None] * days_in_month
+            rows[employee_id][day.day - 1] = value
+        
+        return Response({
+            'year': year,
+            'month': month,
+            'days_in_month': days_in_month,
+            'results': [{'employee': employee_id, 'days': values} for employee_id, values in rows.items()],
+        })
     
     def perform_create(self, serializer):
         # Автоматически устанавливаем мастера для новых записей
@@ -74,10 +163,7 @@ class TimesheetViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        timesheet.status = 'approved'
-        timesheet.approved_by = request.user
-        timesheet.approved_at = datetime.now()
-        timesheet.save()
+        set_timesheets_approval(self.queryset.model.objects.filter(pk=timesheet.pk), request.user)
         
         # Логирование действия
         import logging
@@ -89,27 +175,19 @@ class TimesheetViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def bulk_approve(self, request):
         """Массовое утверждение табелей"""
-        serializer = TimesheetApproveSerializer(data=request.data)
+        serializer = TimesheetApproveSerializer(
+            data=request.data, context={'model': self.queryset.model}
+        )
         serializer.is_valid(raise_exception=True)
         
         timesheet_ids = serializer.validated_data['timesheet_ids']
         approve = serializer.validated_data['approve']
         
         queryset = self.get_queryset().filter(id__in=timesheet_ids)
-        
+        updated = set_timesheets_approval(queryset, request.user, approve)
         if approve:
-            updated = queryset.filter(status='draft').update(
-                status='approved',
-                approved_by=request.user,
-                approved_at=datetime.now()
-            )
             message = f'Утверждено табелей: {updated}'
         else:
-            updated = queryset.filter(status='approved').update(
-                status='draft',
-                approved_by=None,
-                approved_at=None
-            )
             message = f'Снято с утверждения табелей: {updated}'
         
         # Логирование
@@ -119,6 +197,72 @@ class TimesheetViewSet(viewsets.ModelViewSet):
         
         return Response({'message': message})
     
+    @action(detail=False, methods=['post'], url_path='approve-month')
+    def approve_month(self, request):
+        """Утверждение месяца целиком по мастерам (один UPDATE)"""
+        serializer = MonthApproveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        allowed_ids = set(request.user.allowed_masters.values_list('id', flat=True))
+        if allowed_ids and not set(data['master_ids']) <= allowed_ids:
+            return Response(
+                {'error': 'Нет доступа к выбранным мастерам'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            approved = approve_month(
+                request.user, data['master_ids'], data['year'], data['month'],
+                (self.timesheet_type,)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Логирование
+        import logging
+        logger = logging.getLogger('apps')
+        logger.info(
+            f'Утвержден месяц {data["month"]:02d}.{data["year"]} ({self.timesheet_type}) '
+            f'по мастерам {data["master_ids"]}: {approved[self.timesheet_type]} записей пользователем {request.user}'
+        )
+        
+        return Response({'approved_count': approved[self.timesheet_type]})
+    
+    @action(detail=False, methods=['post'], url_path='bulk-upsert')
+    def bulk_upsert(self, request):
+        """Массовое создание/обновление табелей (основных или ИТР)"""
+        from .web_views import get_timesheet_model
+
+        serializer = TimesheetBulkUpsertSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # В ViewSet табеля ИТР тип фиксирован, в основном — берется из запроса
+        if self.timesheet_type == 'itr' or 'type' not in request.data:
+            timesheet_type = self.timesheet_type
+        else:
+            timesheet_type = serializer.validated_data['type']
+        user = request.user
+        if timesheet_type == 'itr' and user.is_master and not getattr(user, 'is_itr_master', False):
+            return Response(
+                {'error': 'Нет доступа к табелю ИТР'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        result = bulk_upsert_timesheets(
+            user, serializer.validated_data['rows'], get_timesheet_model(timesheet_type)
+        )
+
+        # Логирование
+        import logging
+        logger = logging.getLogger('apps')
+        logger.info(
+            f'Массовая загрузка табелей ({timesheet_type}): создано {result["created"]}, '
+            f'обновлено {result["updated"]}, ошибок {len(result["errors"])} пользователем {user}'
+        )
+
+        return Response(result)
+
     @action(detail=False, methods=['post'])
     def export(self, request):
         """Экспорт табелей в CSV"""
@@ -177,6 +321,23 @@ class TimesheetViewSet(viewsets.ModelViewSet):
         
         return response
 
+class ItrTimesheetViewSet(TimesheetViewSet):
+    """ViewSet для работы с табелями ИТР (те же действия, что и для основного табеля)"""
+    timesheet_type = 'itr'
+    queryset = ItrTimesheet.objects.select_related(
+        'employee', 'employee__user', 'employee__user__department',
+        'employee__department_own', 'master', 'approved_by'
+    ).all()
+    serializer_class = ItrTimesheetSerializer
+    filterset_class = ItrTimesheetFilter
+    
+    def get_queryset(self):
+        user = self.request.user
+        # Мастер без табеля ИТР не видит записи ИТР
+        if user.is_authenticated and user.is_master and not getattr(user, 'is_itr_master', False):
+            return self.queryset.none()
+        return super().get_queryset()
+
 # ========== Django Views (для веб-интерфейса) ==========
 
 @login_required
@@ -252,8 +413,10 @@ def submit_month(request):
 @require_POST
 def approve_timesheet(request, timesheet_id):
     """Утвердить табель плановиком"""
+    from .web_views import get_timesheet_type, get_timesheet_model
+    TimesheetModel = get_timesheet_model(get_timesheet_type(request))
     try:
-        timesheet = Timesheet.objects.get(id=timesheet_id)
+        timesheet = TimesheetModel.objects.get(id=timesheet_id)
         
         # Проверяем права (только плановик)
         if not request.user.is_planner and not request.user.is_administrator:
@@ -267,19 +430,16 @@ def approve_timesheet(request, timesheet_id):
             return JsonResponse({'error': 'Табель не сдан мастером'}, status=400)
         
         # Утверждаем табель
-        timesheet.status = 'approved'
-        timesheet.approved_by = request.user
-        timesheet.approved_at = timezone.now()
-        timesheet.save()
+        set_timesheets_approval(TimesheetModel.objects.filter(pk=timesheet.pk), request.user)
         
         return JsonResponse({
             'success': True,
             'message': 'Табель утвержден',
             'timesheet_id': timesheet.id,
-            'status': timesheet.status
+            'status': 'approved'
         })
         
-    except Timesheet.DoesNotExist:
+    except TimesheetModel.DoesNotExist:
         return JsonResponse({'error': 'Табель не найден'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -311,6 +471,7 @@ def quick_edit_timesheet(request):
             # Проверяем, можно ли редактировать
             if not timesheet.can_edit:
                 return JsonResponse({'error': 'Табель нельзя редактировать (уже сдан или утвержден)'}, status=400)
+            check_months_writable(Timesheet, timesheet.date)
             
             # Обновляем значение
             timesheet.value = value
@@ -322,6 +483,7 @@ def quick_edit_timesheet(request):
             
             employee = Employee.objects.get(id=employee_id)
             date_obj = datetime.strptime(date, '%Y-%m-%d').date()
+            check_months_writable(Timesheet, date_obj)
             
             timesheet = Timesheet.objects.create(
                 date=date_obj,
@@ -341,5 +503,7 @@ def quick_edit_timesheet(request):
             'is_submitted': timesheet.is_submitted
         })
         
+    except DjangoValidationError as e:
+        return JsonResponse({'error': '; '.join(e.messages)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
@@ -3,7 +3,9 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse, JsonResponse
+from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.db import transaction
 from django.utils import timezone
 import csv
 from datetime import datetime, date, timedelta
@@ -11,9 +13,16 @@ import calendar
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, CreateView, UpdateView, DetailView
 
-from .models import MonthlyTimesheet, Timesheet, ItrTimesheet, Holiday, PositionMilkAllowance, WorkdaySwap
+from .models import MonthlyTimesheet, Timesheet, ItrTimesheet, Holiday, MilkVoucher, PositionMilkAllowance, WorkdaySwap
 from .forms import MonthlyTimesheetForm, BulkTimesheetForm, TimesheetForm
+from .utils import set_timesheets_approval, approve_month
+from .utils import get_calendar_cache_version, CALENDAR_CACHE_TIMEOUT
+from .utils import get_archive_model, get_archived_months, get_timesheet_read_model, check_months_writable
+from .utils import department_rollup, filter_by_department
+from .utils import calculate_milk_vouchers, get_employee_positions
 from apps.users.models import Employee, Department, User
+from apps.core.write_queue import serialized_write
+from apps.core.replica import read_replica
 from apps.users.permissions import IsMaster, IsPlanner
 from datetime import datetime, date, timedelta
 
@@ -70,13 +79,66 @@ def get_day_value(day_date):
         mapped = swap.date_b if swap.date_a == day_date else swap.date_a
         return base_value(mapped)
     return base_value(day_date)
+
+def get_month_day_values(year: int, month: int) -> dict:
+    """
+    get_day_value для всех дней месяца: {день: значение} за два запроса.
+
+    Результат кешируется по версии календаря, как generate_default_table.
+    """
+    from django.core.cache import cache
+    cache_key = f'timesheet:day_values:{get_calendar_cache_version()}:{year}-{month:02d}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+    # Первый перенос в порядке модели, как .first() в get_day_value
+    mapped = {}
+    swaps = WorkdaySwap.objects.filter(is_active=True).filter(
+        Q(date_a__range=(month_start, month_end)) | Q(date_b__range=(month_start, month_end))
+    )
+    for swap in swaps:
+        if month_start <= swap.date_a <= month_end:
+            mapped.setdefault(swap.date_a, swap.date_b)
+        if month_start <= swap.date_b <= month_end:
+            mapped.setdefault(swap.date_b, swap.date_a)
+    targets = {
+        day: mapped.get(day, day)
+        for day in (month_start + timedelta(days=i) for i in range((month_end - month_start).days + 1))
+    }
+    needed = set(targets.values()) | {d + timedelta(days=1) for d in targets.values()}
+    holidays = set(Holiday.objects.filter(date__in=needed, type="holiday").values_list('date', flat=True))
+
+    values = {}
+    for day, d in targets.items():
+        if d in holidays:
+            value = "В"
+        elif d + timedelta(days=1) in holidays and d.weekday() in (0, 1, 2, 3, 4):
+            value = "7"
+        elif d.weekday() in (5, 6):
+            value = "В"
+        else:
+            value = "8"
+        values[day.day] = value
+    cache.set(cache_key, values, CALENDAR_CACHE_TIMEOUT)
+    return dict(values)
 def generate_default_table(year: int, month: int) -> dict:
     """
     Автозаполнение табеля с правильной логикой:
     - 'В' для праздников и выходных (сб/вс)
     - '7' для рабочего дня перед праздником (даже если праздник в субботу)
     - '8' для рабочих дней
+
+    Результат кешируется по версии календаря (см. bump_calendar_cache_version).
     """
+    from django.core.cache import cache
+    cache_key = f'timesheet:default_table:{get_calendar_cache_version()}:{year}-{month:02d}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
     default_table = {}
     cal = calendar.Calendar()
     month_days = cal.monthdatescalendar(year, month)
@@ -126,7 +188,8 @@ def generate_default_table(year: int, month: int) -> dict:
         elif b_in:
             default_table[s.date_b.day] = base_value(s.date_a, holidays)
     
-    return default_table
+    cache.set(cache_key, default_table, CALENDAR_CACHE_TIMEOUT)
+    return dict(default_table)
 
 def get_foundry_day_value(day_date: date, anchor: date) -> str:
     pattern = (
@@ -247,6 +310,10 @@ def get_timesheet_model(timesheet_type: str):
         return ItrTimesheet
     return Timesheet
 
+def is_report_reader(request):
+    """Отчеты плановика/администратора читают из реплики; мастеру нужны свежие данные"""
+    return not request.user.is_master
+
 def get_monthly_data(request, year, month, print_mode=False):
     """
     Общая функция для получения данных табеля за месяц.
@@ -269,6 +336,8 @@ def get_monthly_data(request, year, month, print_mode=False):
             'timesheet_type': 'itr',
         }
     TimesheetModel = get_timesheet_model(timesheet_type)
+    # Месяцы, перенесенные командой archive_months, читаются из архивной БД
+    ReadModel = get_timesheet_read_model(TimesheetModel, year, month)
     
     # Инициализация переменных
     employees = Employee.objects.none()
@@ -305,7 +374,7 @@ def get_monthly_data(request, year, month, print_mode=False):
             if hasattr(request.user, 'show_self_in_own_timesheet') and not request.user.show_self_in_own_timesheet:
                 employees = employees.exclude(user=request.user)
 
-        timesheets = TimesheetModel.objects.filter(
+        timesheets = ReadModel.objects.filter(
             date__year=year,
             date__month=month,
             employee__in=employees,
@@ -351,14 +420,17 @@ def get_monthly_data(request, year, month, print_mode=False):
                      (Q(assignments__end_date__isnull=True) | Q(assignments__end_date__gte=month_start)) &
                      Q(assignments__start_date__lte=month_end))
                 )
-            else:
-                # Нет выбранного мастера и нет ограничений по allowed_masters — не грузим ничего
+            elif not department_id:
+                # Нет выбранного мастера, отдела и ограничений по allowed_masters — не грузим ничего
                 base_employees = Employee.objects.none()
+        # Фильтр по отделу (из селекта) — вместе с подразделениями
+        if department_id:
+            base_employees = filter_by_department(base_employees, department_id)
         employees = base_employees.distinct()
 
         if print_mode:
             # Для печатной формы - только табели со статусом submitted/approved
-            timesheets = TimesheetModel.objects.filter(
+            timesheets = ReadModel.objects.filter(
                 date__year=year,
                 date__month=month,
                 employee__in=employees,
@@ -373,7 +445,7 @@ def get_monthly_data(request, year, month, print_mode=False):
                 employees = employees.filter(id__in=employee_ids_from_timesheets)
         else:
             # Для веб-интерфейса
-            timesheets = TimesheetModel.objects.filter(
+            timesheets = ReadModel.objects.filter(
                 date__year=year,
                 date__month=month,
                 employee__in=employees
@@ -403,6 +475,18 @@ def get_monthly_data(request, year, month, print_mode=False):
     }
 
 
+# Форматы для подсчета часов (process_timesheet_data, свод по отделам)
+TOTAL_HOURS_FORMATS = {
+    '7/3': 7.0, '7/2': 7.0, '8/2': 8.0, '8': 8.0, '7': 7.0,
+    '4': 4.0, '10': 10.0, '10/2': 10.0, '3,5': 3.5, '9': 9.0,
+    '9/2': 9.0, '6': 6.0, '6/2': 6.0, '5': 5.0, '5/2': 5.0,
+}
+EVENING_FORMATS = ['8/2', '7/2', '9/2', '10/2', '6/2']
+NIGHT_FORMATS = {'7/3': 7.0, '8/2': 1.5, '9/2': 1.5, '10/2': 1.5, '6/2': 1.5}
+OVERTIME_FORMATS = {'9': 1, '10': 2, '9/2': 1, '10/2': 2}
+# Коды, не считающиеся явкой (все прочие непустые значения — явка); по ним же считаются талоны на молоко
+NON_ATTENDANCE_CODES = ['В', 'О', 'Б', 'К', 'ЦП', 'П', 'Н', 'ОС', 'Р', 'Г', 'ДМ', 'ОЖ', 'А']
+
 def update_statistics(stats, employee_id, day, value_str, is_weekend, 
                      total_hours_formats, evening_formats, night_formats, overtime_formats):
     """Обновление статистики для одного дня"""
@@ -438,7 +522,7 @@ def update_statistics(stats, employee_id, day, value_str, is_weekend,
         stats['overtime_hours'][employee_id] = stats['overtime_hours'].get(employee_id, 0) + overtime_formats[value_str]
     
     # Подсчет категорий
-    if value_str not in ['В', 'О', 'Б', 'К', 'ЦП', 'П', 'Н', 'ОС', 'Р', 'Г', 'ДМ', 'ОЖ', 'А']:
+    if value_str not in NON_ATTENDANCE_CODES:
         stats['attendance'][employee_id] = stats['attendance'].get(employee_id, 0) + 1
     
     # Маппинг категорий
@@ -473,10 +557,8 @@ def process_timesheet_data(request, year, month, employees, timesheets):
     weekend_days_dict = {}
     default_table = generate_default_table(year, month)
     
-    day_value_by_day = {}
+    day_value_by_day = get_month_day_values(year, month)
     for day in days:
-        day_date = date(year, month, day)
-        day_value_by_day[day] = get_day_value(day_date)
         weekend_days_dict[day] = (day_value_by_day[day] == 'В')
     
     # Подготовка словарей для статистики
@@ -497,15 +579,10 @@ def process_timesheet_data(request, year, month, employees, timesheets):
     }
     
     # Форматы для подсчета часов
-    total_hours_formats = {
-        '7/3': 7.0, '7/2': 7.0, '8/2': 8.0, '8': 8.0, '7': 7.0,
-        '4': 4.0, '10': 10.0, '10/2': 10.0, '3,5': 3.5, '9': 9.0,
-        '9/2': 9.0, '6': 6.0, '6/2': 6.0, '5': 5.0, '5/2': 5.0,
-    }
-    
-    evening_formats = ['8/2', '7/2', '9/2', '10/2', '6/2']
-    night_formats = {'7/3': 7.0, '8/2': 1.5, '9/2': 1.5, '10/2': 1.5, '6/2': 1.5}
-    overtime_formats = {'9': 1, '10': 2, '9/2': 1, '10/2': 2}
+    total_hours_formats = TOTAL_HOURS_FORMATS
+    evening_formats = EVENING_FORMATS
+    night_formats = NIGHT_FORMATS
+    overtime_formats = OVERTIME_FORMATS
     
     # Группировка табелей по сотрудникам
     timesheet_dict = {}
@@ -740,25 +817,28 @@ def get_composer_fio(master_user):
 # ==================== ОСНОВНЫЕ VIEW ФУНКЦИИ ====================
 
 @login_required
+@serialized_write
 def milk_vouchers_view(request):
     """Назначение дневной нормы талонов по должностям литейщиков (роль ТБ)"""
     if not (getattr(request.user, 'is_tb', False) or request.user.is_administrator):
         messages.error(request, 'Доступ разрешен только пользователям ТБ или администраторам')
         return redirect('timesheet:list')
     
-    # Собираем уникальные должности из всех сотрудников (не только литейщиков)
-    employees = Employee.objects.filter(is_active=True)
-    # Уникальные должности через свойство position/position_own/user.position
-    positions = []
-    seen = set()
-    for emp in employees:
-        pos = (emp.position or '').strip()
-        if not pos:
-            continue
-        if pos not in seen:
-            seen.add(pos)
-            positions.append(pos)
-    positions.sort()
+    today = timezone.now().date()
+    if request.method == 'POST' and request.POST.get('action') == 'calculate':
+        try:
+            year = int(request.POST.get('year', today.year))
+            month = int(request.POST.get('month', today.month))
+            date(year, month, 1)
+        except (ValueError, TypeError):
+            messages.error(request, 'Ошибка в параметрах месяца')
+            return redirect(reverse_lazy('timesheet:milk_vouchers'))
+        employees_count, total = calculate_milk_vouchers(year, month, request.user)
+        messages.success(request, f'Талоны за {month:02d}.{year} рассчитаны: сотрудников {employees_count}, талонов {total}')
+        return redirect(f"{reverse_lazy('timesheet:milk_vouchers_print')}?year={year}&month={month}")
+
+    # Уникальные должности всех сотрудников (не только литейщиков) одним запросом
+    positions = get_employee_positions()
     allowances_map = {a.position: a for a in PositionMilkAllowance.objects.filter(position__in=positions)}
     
     if request.method == 'POST':
@@ -789,7 +869,12 @@ def milk_vouchers_view(request):
         return redirect(reverse_lazy('timesheet:milk_vouchers'))
     
     rows = [{'position': pos, 'count': allowances_map.get(pos).per_day_count if allowances_map.get(pos) else 0} for pos in positions]
-    return render(request, 'timesheet/milk_vouchers.html', {'title': 'Талоны на молоко: нормы по должностям', 'rows': rows})
+    return render(request, 'timesheet/milk_vouchers.html', {
+        'title': 'Талоны на молоко: нормы по должностям',
+        'rows': rows,
+        'year': today.year,
+        'month': today.month,
+    })
 
 @login_required
 def print_milk_vouchers_view(request):
@@ -803,12 +888,17 @@ def print_milk_vouchers_view(request):
     except (ValueError, TypeError):
         year = today.year
         month = today.month
-    employees = Employee.objects.filter(is_active=True, is_foundry=True).order_by('last_name', 'first_name', 'user__last_name', 'user__first_name')
-    allowances = {a.position: a.per_day_count for a in PositionMilkAllowance.objects.all()}
-    rows = [{'emp': emp, 'count': allowances.get((emp.position or '').strip(), 0)} for emp in employees]
+    # Печать из сохраненного расчета (calculate_milk_vouchers)
+    vouchers = MilkVoucher.objects.filter(year=year, month=month).select_related(
+        'employee', 'employee__user'
+    ).order_by('employee__last_name', 'employee__first_name', 'employee__user__last_name', 'employee__user__first_name')
+    rows = [
+        {'emp': v.employee, 'per_day': v.per_day_count, 'days': v.attended_days, 'count': v.count}
+        for v in vouchers
+    ]
     total = sum(r['count'] for r in rows)
     context = {
-        'title': 'Отчет по талонам на молоко (в день)',
+        'title': 'Отчет по талонам на молоко',
         'year': year,
         'month': month,
         'rows': rows,
@@ -817,6 +907,7 @@ def print_milk_vouchers_view(request):
     return render(request, 'timesheet/print_milk_vouchers.html', context)
 
 @login_required
+@read_replica(when=is_report_reader)
 def monthly_table_view(request):
     """Табличное представление табеля за месяц"""
     # Получаем параметры месяца
@@ -869,6 +960,11 @@ def monthly_table_view(request):
         'is_master': request.user.is_master,
         'is_planner': request.user.is_planner,
         'is_admin': request.user.is_administrator,
+        # Те же права, что проверяет approve_month_view
+        'can_approve_month': (
+            (request.user.is_planner or request.user.is_administrator)
+            and (request.GET.get('master') or '').isdigit()
+        ),
         'is_ic_master': getattr(request.user, 'is_ic_master', False),
         'is_itr_master': getattr(request.user, 'is_itr_master', False),
         'timesheet_type': data.get('timesheet_type', 'main'),
@@ -885,6 +981,7 @@ def monthly_table_view(request):
 
 
 @login_required
+@read_replica(when=is_report_reader)
 def print_monthly_table(request):
     """Печатная форма табеля за месяц"""
     # Получаем параметры месяца
@@ -1036,7 +1133,7 @@ class TimesheetListView(LoginRequiredMixin, ListView):
         if master_id and (user.is_planner or user.is_administrator):
             queryset = queryset.filter(master_id=master_id)
         if department_id and (user.is_planner or user.is_administrator):
-            queryset = queryset.filter(employee__department_id=department_id)
+            queryset = filter_by_department(queryset, department_id, prefix='employee__')
         
         return queryset.select_related(
             'employee', 'employee__user', 'master', 'approved_by'
@@ -1137,9 +1234,16 @@ class TimesheetDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
 
 
 @login_required
+@serialized_write
 def approve_timesheet(request, pk):
-    """Утверждение табеля"""
-    timesheet = get_object_or_404(Timesheet, pk=pk)
+    """Утверждение табеля (основного или ИТР — по параметру tt)"""
+    TimesheetModel = get_timesheet_model(get_timesheet_type(request))
+    timesheet = get_object_or_404(TimesheetModel, pk=pk)
+    # Карточка есть только у основного табеля
+    if TimesheetModel is Timesheet:
+        back_url = reverse_lazy('timesheet:detail', kwargs={'pk': pk})
+    else:
+        back_url = reverse_lazy('timesheet:list')
     
     if not request.user.is_planner and not request.user.is_administrator:
         messages.error(request, 'У вас нет прав для утверждения табелей')
@@ -1147,20 +1251,18 @@ def approve_timesheet(request, pk):
     
     if timesheet.is_approved:
         messages.warning(request, 'Табель уже утвержден')
-        return redirect('timesheet:detail', pk=pk)
+        return redirect(back_url)
     
-    timesheet.status = 'approved'
-    timesheet.approved_by = request.user
-    timesheet.approved_at = datetime.now()
-    timesheet.save()
+    set_timesheets_approval(TimesheetModel.objects.filter(pk=pk), request.user)
     
     messages.success(request, 'Табель успешно утвержден')
-    return redirect('timesheet:detail', pk=pk)
+    return redirect(back_url)
 
 
 @login_required
+@serialized_write
 def bulk_approve_view(request):
-    """Массовое утверждение табелей"""
+    """Массовое утверждение табелей (основных или ИТР — по параметру tt)"""
     if not request.user.is_planner and not request.user.is_administrator:
         messages.error(request, 'У вас нет прав для массового утверждения')
         return redirect('timesheet:list')
@@ -1173,27 +1275,66 @@ def bulk_approve_view(request):
             messages.error(request, 'Не выбраны табели для обработки')
             return redirect('timesheet:list')
         
-        queryset = Timesheet.objects.filter(id__in=timesheet_ids)
+        TimesheetModel = get_timesheet_model(get_timesheet_type(request))
+        queryset = TimesheetModel.objects.filter(id__in=timesheet_ids)
         
         if action == 'approve':
-            updated = queryset.filter(status='draft').update(
-                status='approved',
-                approved_by=request.user,
-                approved_at=datetime.now()
-            )
+            updated = set_timesheets_approval(queryset, request.user, approve=True)
             messages.success(request, f'Утверждено табелей: {updated}')
         elif action == 'unapprove':
-            updated = queryset.filter(status='approved').update(
-                status='draft',
-                approved_by=None,
-                approved_at=None
-            )
+            updated = set_timesheets_approval(queryset, request.user, approve=False)
             messages.success(request, f'Снято с утверждения табелей: {updated}')
     
     return redirect('timesheet:list')
 
 
 @login_required
+@serialized_write
+def approve_month_view(request):
+    """Утверждение месяца целиком по выбранным мастерам (один UPDATE на таблицу)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Неверный запрос'}, status=400)
+    if not request.user.is_planner and not request.user.is_administrator:
+        return JsonResponse({'error': 'У вас нет прав для утверждения табелей'}, status=403)
+    
+    try:
+        year = int(request.POST.get('year'))
+        month = int(request.POST.get('month'))
+        raw_ids = request.POST.getlist('master_ids') or (request.POST.get('master_ids') or '').split(',')
+        master_ids = {int(m) for m in raw_ids if str(m).strip()}
+        date(year, month, 1)
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Ошибка в параметрах месяца или мастеров'}, status=400)
+    if not master_ids:
+        return JsonResponse({'error': 'Не выбраны мастера'}, status=400)
+    
+    # Плановик с ограничением по мастерам утверждает только доступных ему
+    if request.user.is_planner:
+        allowed_ids = set(request.user.allowed_masters.values_list('id', flat=True))
+        if allowed_ids and not master_ids <= allowed_ids:
+            return JsonResponse({'error': 'Нет доступа к выбранным мастерам'}, status=403)
+    
+    if (request.POST.get('tt') or '').strip().lower() == 'all':
+        timesheet_types = ('main', 'itr')
+    else:
+        timesheet_types = (get_timesheet_type(request),)
+    
+    try:
+        approved = approve_month(request.user, master_ids, year, month, timesheet_types)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    total = sum(approved.values())
+    return JsonResponse({
+        'success': True,
+        'approved': approved,
+        'approved_count': total,
+        'message': f'Утверждено {total} записей за {month:02d}.{year}'
+    })
+
+
+@login_required
+@read_replica
 def export_view(request):
     """Экспорт табелей в CSV"""
     if not request.user.is_planner and not request.user.is_administrator:
@@ -1207,21 +1348,31 @@ def export_view(request):
         department_id = request.POST.get('department')
         status = request.POST.get('status', 'all')
         
-        queryset = Timesheet.objects.all()
+        querysets = [Timesheet.objects.all()]
+        # Период затрагивает архивные месяцы — выгружаем и записи из архива
+        try:
+            date_from = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+            date_to = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        except ValueError:
+            date_from = date_to = None
+        if get_archived_months(Timesheet, date_from, date_to):
+            querysets.append(get_archive_model(Timesheet).objects.all())
         
-        if start_date:
-            queryset = queryset.filter(date__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(date__lte=end_date)
-        if master_id:
-            queryset = queryset.filter(master_id=master_id)
-        if department_id:
-            queryset = queryset.filter(employee__user__department_id=department_id)
-        if status != 'all':
-            queryset = queryset.filter(status=status)
+        for i, queryset in enumerate(querysets):
+            if start_date:
+                queryset = queryset.filter(date__gte=start_date)
+            if end_date:
+                queryset = queryset.filter(date__lte=end_date)
+            if master_id:
+                queryset = queryset.filter(master_id=master_id)
+            if department_id:
+                queryset = filter_by_department(queryset, department_id, prefix='employee__')
+            if status != 'all':
+                queryset = queryset.filter(status=status)
+            querysets[i] = queryset
         
         # Генерация CSV
-        csv_data = generate_csv_report(queryset)
+        csv_data = generate_csv_report(*querysets)
         
         response = HttpResponse(csv_data, content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="timesheet_export_{datetime.now():%Y%m%d_%H%M%S}.csv"'
@@ -1239,10 +1390,11 @@ def export_view(request):
     })
 
 
-def generate_csv_report(queryset):
-    """Генерация CSV отчета"""
+def generate_csv_report(*querysets):
+    """Генерация CSV отчета (основная таблица и, при необходимости, архив)"""
     import csv
     from io import StringIO
+    from itertools import chain
     
     output = StringIO()
     writer = csv.writer(output)
@@ -1254,7 +1406,8 @@ def generate_csv_report(queryset):
     ])
     
     # Данные
-    for ts in queryset.select_related('employee', 'employee__user', 'master', 'approved_by'):
+    related = ('employee', 'employee__user', 'master', 'approved_by')
+    for ts in chain.from_iterable(queryset.select_related(*related) for queryset in querysets):
         writer.writerow([
             ts.id,
             ts.date.strftime('%d.%m.%Y'),
@@ -1272,6 +1425,7 @@ def generate_csv_report(queryset):
 
 
 @login_required
+@serialized_write
 def quick_edit_timesheet(request):
     """Быстрое редактирование дневного табеля через AJAX"""
     if not request.method == 'POST' or not request.user.is_authenticated:
@@ -1346,6 +1500,7 @@ def quick_edit_timesheet(request):
             # Проверка прав
             if not timesheet.can_edit:
                 return JsonResponse({'error': 'Табель сдан или утвержден и не может быть изменен'}, status=403)
+            check_months_writable(TimesheetModel, timesheet.date)
             
             # Запрет на редактирование значений для дат до приема (кроме удаления)
             if action != 'delete' and timesheet.employee.hire_date and timesheet.date < timesheet.employee.hire_date:
@@ -1379,6 +1534,7 @@ def quick_edit_timesheet(request):
                 return JsonResponse({'error': 'Не указаны обязательные параметры'}, status=400)
             
             date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+            check_months_writable(TimesheetModel, date_obj)
             employee = Employee.objects.get(id=employee_id)
             if timesheet_type == 'itr' and not getattr(employee, 'is_itr_employee', False):
                 return JsonResponse({'error': 'Сотрудник не включен в табель ИТР'}, status=403)
@@ -1442,11 +1598,37 @@ def quick_edit_timesheet(request):
         return JsonResponse({'error': 'Табель не найден'}, status=404)
     except Employee.DoesNotExist:
         return JsonResponse({'error': 'Сотрудник не найден'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'error': '; '.join(e.messages)}, status=400)
     except Exception as e:
         import traceback
         return JsonResponse({'error': str(e), 'traceback': traceback.format_exc()}, status=500)
 
+def allowed_range_days(employee, master, date_from, date_to, legacy_ok=False):
+    """
+    Дни диапазона (с учетом даты приема), в которые мастер может править
+    сотрудника: legacy-мастер или назначение, покрывающее день.
+    Назначения читаются одним запросом на весь диапазон.
+    """
+    from apps.users.models import EmployeeAssignment
+    periods = list(EmployeeAssignment.objects.filter(
+        employee=employee, master=master, start_date__lte=date_to
+    ).filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=date_from)
+    ).values_list('start_date', 'end_date'))
+    hire_date = getattr(employee, 'hire_date', None)
+    days = []
+    day = date_from
+    while day <= date_to:
+        if not (hire_date and day < hire_date) and (legacy_ok or any(
+            start <= day and (end is None or end >= day) for start, end in periods
+        )):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
 @login_required
+@serialized_write
 def fill_range(request):
     """Протяжка значения по диапазону дней для одного сотрудника"""
     if request.method != 'POST':
@@ -1483,50 +1665,47 @@ def fill_range(request):
         dt = datetime.strptime(date_to, '%Y-%m-%d').date()
         if dt < df:
             df, dt = dt, df
-        # Учитываем дату приема: протягиваем только начиная с hire_date
-        hire_date = getattr(emp, 'hire_date', None)
-        # Права: мастер должен иметь назначение на каждую дату или быть legacy-мастером
-        from apps.users.models import EmployeeAssignment
-        from django.db.models import Q
+        check_months_writable(TimesheetModel, df, dt)
+        # Права: мастер должен иметь назначение на каждую дату или быть legacy-мастером;
+        # протягиваем только начиная с даты приема
         legacy_ok = getattr(emp, 'master_id', None) == getattr(request.user, 'id', None)
-        filled = 0
-        day = df
-        while day <= dt:
-            if hire_date and day < hire_date:
-                day += timedelta(days=1)
-                continue
-            has_assignment = EmployeeAssignment.objects.filter(
-                employee=emp, master=request.user
-            ).filter(
-                Q(end_date__isnull=True) | Q(end_date__gte=day),
-                start_date__lte=day
-            ).exists()
-            if request.user.is_master and (legacy_ok or has_assignment):
-                ts, created = TimesheetModel.objects.get_or_create(
-                    date=day,
-                    employee=emp,
-                    defaults={
-                        'master': request.user,
-                        'value': value,
-                        'status': 'draft'
-                    }
-                )
-                if not created:
-                    if ts.can_edit:
-                        ts.value = value
-                        if ts.master is None:
-                            ts.master = request.user
-                        ts.save()
-                filled += 1
-            day += timedelta(days=1)
+        days = allowed_range_days(emp, request.user, df, dt, legacy_ok) if request.user.is_master else []
+        filled = len(days)
+        if days:
+            # Значение проверяется один раз, записи диапазона пишутся пакетно
+            TimesheetModel(value=value).clean()
+            existing = {
+                d: (status, master_id)
+                for d, status, master_id in TimesheetModel.objects.filter(
+                    employee=emp, date__range=(df, dt)
+                ).values_list('date', 'status', 'master_id')
+            }
+            editable = [d for d in days if d in existing and existing[d][0] == 'draft']
+            without_master = [d for d in editable if existing[d][1] is None]
+            with transaction.atomic():
+                TimesheetModel.objects.bulk_create([
+                    TimesheetModel(date=d, employee=emp, master=request.user, value=value, status='draft')
+                    for d in days if d not in existing
+                ], batch_size=500)
+                if editable:
+                    TimesheetModel.objects.filter(
+                        employee=emp, date__in=editable, status='draft'
+                    ).update(value=value, updated_at=timezone.now())
+                if without_master:
+                    TimesheetModel.objects.filter(
+                        employee=emp, date__in=without_master
+                    ).update(master=request.user)
         return JsonResponse({'success': True, 'filled': filled})
     except Employee.DoesNotExist:
         return JsonResponse({'error': 'Сотрудник не найден'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'error': '; '.join(e.messages)}, status=400)
     except Exception as e:
         import traceback
         return JsonResponse({'error': str(e), 'traceback': traceback.format_exc()}, status=500)
 
 @login_required
+@serialized_write
 def restore_range(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Неверный запрос'}, status=400)
@@ -1547,36 +1726,25 @@ def restore_range(request):
         dt = datetime.strptime(date_to, '%Y-%m-%d').date()
         if dt < df:
             df, dt = dt, df
-        hire_date = getattr(emp, 'hire_date', None)
-        from apps.users.models import EmployeeAssignment
-        from django.db.models import Q
+        check_months_writable(TimesheetModel, df, dt)
         legacy_ok = getattr(emp, 'master_id', None) == getattr(request.user, 'id', None)
+        days = allowed_range_days(emp, request.user, df, dt, legacy_ok) if request.user.is_master else []
         restored = 0
-        day = df
-        while day <= dt:
-            if hire_date and day < hire_date:
-                day += timedelta(days=1)
-                continue
-            has_assignment = EmployeeAssignment.objects.filter(
-                employee=emp, master=request.user
-            ).filter(
-                Q(end_date__isnull=True) | Q(end_date__gte=day),
-                start_date__lte=day
-            ).exists()
-            if request.user.is_master and (legacy_ok or has_assignment):
-                ts = TimesheetModel.objects.filter(date=day, employee=emp).first()
-                if ts and ts.master == request.user and ts.can_edit:
-                    ts.delete()
-                    restored += 1
-            day += timedelta(days=1)
+        if days:
+            restored, _ = TimesheetModel.objects.filter(
+                employee=emp, date__in=days, master=request.user, status='draft'
+            ).delete()
         return JsonResponse({'success': True, 'restored': restored})
     except Employee.DoesNotExist:
         return JsonResponse({'error': 'Сотрудник не найден'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'error': '; '.join(e.messages)}, status=400)
     except Exception as e:
         import traceback
         return JsonResponse({'error': str(e), 'traceback': traceback.format_exc()}, status=500)
 
 @login_required
+@serialized_write
 def submit_timesheet(request, pk):
     """Сдать табель мастером"""
     timesheet = get_object_or_404(Timesheet, pk=pk)
@@ -1602,6 +1770,7 @@ def submit_timesheet(request, pk):
 
 
 @login_required
+@serialized_write
 def bulk_submit_view(request):
     """Массовая сдача табелей"""
     if not request.user.is_master:
@@ -1648,6 +1817,7 @@ def bulk_submit_view(request):
 
 
 @login_required
+@serialized_write
 def submit_month(request):
     """Сдать все табели за месяц"""
     if not request.user.is_master:
@@ -1675,6 +1845,7 @@ def submit_month(request):
         if timesheet_type == 'itr' and request.user.is_master and not getattr(request.user, 'is_itr_master', False):
             return JsonResponse({'error': 'Нет доступа к табелю ИТР'}, status=403)
         TimesheetModel = get_timesheet_model(timesheet_type)
+        check_months_writable(TimesheetModel, month_start)
         
         # 1) Создаем отсутствующие записи по автозаполнению (для возможности сдачи «чистого» табеля)
         default_table = generate_default_table(year, month)
@@ -1697,26 +1868,40 @@ def submit_month(request):
         else:
             if hasattr(request.user, 'show_self_in_own_timesheet') and not request.user.show_self_in_own_timesheet:
                 employees = employees.exclude(user=request.user)
-        created_missing = 0
         _, last_day = calendar.monthrange(year, month)
+        employees = list(employees.select_related('user', 'master'))
+        employee_ids = [emp.id for emp in employees]
+        # Назначения мастера и уже существующие записи месяца — одним запросом каждое,
+        # значения дней по календарю — из кэша месяца
+        assigned_periods = {}
+        for employee_id, start_date, end_date in EmployeeAssignment.objects.filter(
+            employee_id__in=employee_ids, master=request.user, start_date__lte=month_end
+        ).filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=month_start)
+        ).values_list('employee_id', 'start_date', 'end_date'):
+            assigned_periods.setdefault(employee_id, []).append((start_date, end_date))
+        existing = set(TimesheetModel.objects.filter(
+            employee_id__in=employee_ids, date__range=(month_start, month_end)
+        ).values_list('employee_id', 'date'))
+        day_values = get_month_day_values(year, month)
+        missing = []
         for emp in employees:
             hire_date = getattr(emp, 'hire_date', None)
+            # Только если назначен этому мастеру в этот день или legacy-мастер
+            legacy_ok = getattr(emp, 'master_id', None) == getattr(request.user, 'id', None)
+            periods = assigned_periods.get(emp.id, [])
             for day in range(1, last_day + 1):
                 d = date(year, month, day)
                 if hire_date and d < hire_date:
                     continue
-                # Только если назначен этому мастеру в этот день или legacy-мастер
-                legacy_ok = getattr(emp, 'master_id', None) == getattr(request.user, 'id', None)
-                has_assignment = EmployeeAssignment.objects.filter(
-                    employee=emp, master=request.user
-                ).filter(
-                    Q(end_date__isnull=True) | Q(end_date__gte=d),
-                    start_date__lte=d
-                ).exists()
+                has_assignment = any(
+                    start_date <= d and (end_date is None or end_date >= d)
+                    for start_date, end_date in periods
+                )
                 if not (legacy_ok or has_assignment):
                     continue
                 # Создаем запись, если отсутствует
-                if not TimesheetModel.objects.filter(date=d, employee=emp).exists():
+                if (emp.id, d) not in existing:
                     value = default_table.get(day, '')
                     if timesheet_type == 'itr':
                         row_user = getattr(emp, 'user', None)
@@ -1747,7 +1932,7 @@ def submit_month(request):
                             allowed_weekdays = None
                             if override == 'weekdays':
                                 allowed_weekdays = parse_weekdays_csv(getattr(emp, 'ic_weekdays', '') or '')
-                            holiday_value = get_day_value(d)
+                            holiday_value = day_values[day]
                             dm_weekdays = parse_weekdays_csv(getattr(emp, 'ic_dm_weekdays', '') or '')
                             value = get_ic_day_value(d, anchor, holiday_value, force_always_8, allowed_weekdays, hours_per_day=hours_per_day, weekdays_always_8=(override == 'weekdays'), dm_weekdays=dm_weekdays, invert_week=invert_week, hour_delta=hour_delta)
                     elif timesheet_type == 'main' and getattr(request.user, 'is_foundry_master', False):
@@ -1765,33 +1950,26 @@ def submit_month(request):
                         allowed_weekdays = None
                         if override == 'weekdays':
                             allowed_weekdays = parse_weekdays_csv(getattr(emp, 'ic_weekdays', '') or '')
-                        holiday_value = get_day_value(d)
+                        holiday_value = day_values[day]
                         dm_weekdays = parse_weekdays_csv(getattr(emp, 'ic_dm_weekdays', '') or '')
                         value = get_ic_day_value(d, anchor, holiday_value, force_always_8, allowed_weekdays, hours_per_day=hours_per_day, weekdays_always_8=(override == 'weekdays'), dm_weekdays=dm_weekdays, invert_week=invert_week, hour_delta=hour_delta)
-                    TimesheetModel.objects.create(
+                    missing.append(TimesheetModel(
                         date=d,
                         employee=emp,
                         master=request.user,
                         value=value,
                         status='draft'
-                    )
-                    created_missing += 1
-        
-        # 2) Получаем все черновики мастера за месяц и сдаем их
-        timesheets = TimesheetModel.objects.filter(
-            master=request.user,
-            date__year=year,
-            date__month=month,
-            status='draft'
-        )
+                    ))
         
-        submitted_count = 0
-        for timesheet in timesheets:
-            try:
-                timesheet.submit(request.user)
-                submitted_count += 1
-            except ValueError:
-                pass
+        # 2) Сохраняем недостающие записи и сдаем все черновики мастера за месяц
+        with transaction.atomic():
+            TimesheetModel.objects.bulk_create(missing, batch_size=500)
+            submitted_count = TimesheetModel.objects.filter(
+                master=request.user,
+                date__range=(month_start, month_end),
+                status='draft'
+            ).update(status='submitted', updated_at=timezone.now())
+        created_missing = len(missing)
         
         return JsonResponse({
             'success': True,
@@ -1800,10 +1978,36 @@ def submit_month(request):
             'message': f'Сдано {submitted_count} табелей'
         })
         
+    except ValidationError as e:
+        return JsonResponse({'error': '; '.join(e.messages)}, status=400)
     except (ValueError, TypeError) as e:
         return JsonResponse({'error': 'Ошибка в параметрах месяца'}, status=400)
 
 @login_required
+@read_replica(when=is_report_reader)
+def department_rollup_view(request):
+    """
+    JSON-свод часов и категорий за месяц по отделу и его подразделениям
+    (плановый отдел и администратор; плановику — только сданные/утвержденные)
+    """
+    if not (request.user.is_planner or request.user.is_administrator):
+        return JsonResponse({'error': 'Нет прав доступа'}, status=403)
+    try:
+        year = int(request.GET.get('year', timezone.now().year))
+        month = int(request.GET.get('month', timezone.now().month))
+        date(year, month, 1)
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Ошибка в параметрах месяца'}, status=400)
+    department_id = request.GET.get('department', '')
+    department = Department.objects.filter(pk=department_id).first() if department_id.isdigit() else None
+    if department is None:
+        return JsonResponse({'error': 'Отдел не найден'}, status=404)
+    statuses = ['submitted', 'approved'] if request.user.is_planner else None
+    rows = department_rollup(department, year, month, get_timesheet_type(request), statuses)
+    return JsonResponse({'success': True, 'year': year, 'month': month, 'departments': rows})
+
+@login_required
+@read_replica(when=is_report_reader)
 def get_statistics_view(request):
     """
     Возвращает JSON с статистикой по табелям за месяц
@@ -1905,9 +2109,12 @@ def get_statistics_view(request):
         stats['overtime_hours'] = round(stats['overtime_hours'], 1)
         stats['weekend_hours'] = round(stats['weekend_hours'], 1)
         
+        # Данные из реплики: сообщаем время снимка
+        replica = getattr(request, 'read_replica', None)
         return JsonResponse({
             'success': True,
-            'statistics': stats
+            'statistics': stats,
+            'data_as_of': replica['refreshed_at'].isoformat() if replica and replica['refreshed_at'] else None,
         })
         
     except Exception as e:
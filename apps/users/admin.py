@@ -3,6 +3,15 @@ from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from .models import User, Department, Employee
+from .utils import filter_by_search
+
+class SearchTextAdminMixin:
+    """Поиск в списке админки по индексу search_text вместо icontains по search_fields"""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_by_search(queryset, search_term), False
 
 class ManagedEmployeeInline(admin.TabularInline):
     model = Employee
@@ -23,7 +32,7 @@ class ManagedEmployeeInline(admin.TabularInline):
     readonly_fields = ()
     show_change_link = True
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(SearchTextAdminMixin, UserAdmin):
     """Кастомный админ-класс для пользователей"""
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
@@ -178,7 +187,7 @@ class DepartmentAdmin(admin.ModelAdmin):
         }),
     )
 
-class EmployeeAdmin(admin.ModelAdmin):
+class EmployeeAdmin(SearchTextAdminMixin, admin.ModelAdmin):
     list_display = ('get_full_name', 'employee_id', 'master', 'hire_date', 'is_active', 'is_foundry', 'department')
     list_filter = ('master', 'is_active', 'hire_date', 'is_foundry', 'ic_schedule_override', 'ic_is_part_time', 'is_itr_employee')
     fieldsets = (
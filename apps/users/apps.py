@@ -3,4 +3,9 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.users'
-    verbose_name = 'Пользователи'
\ No newline at end of file
+    verbose_name = 'Пользователи'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from .utils import create_search_indexes
+        post_migrate.connect(create_search_indexes, sender=self, dispatch_uid='users_search_indexes')
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:55
+
+from django.db import migrations, models
+
+from apps.users.utils import build_search_text
+
+
+def fill_search_text(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Employee = apps.get_model('users', 'Employee')
+    users, user_texts = [], {}
+    for user in User.objects.all().iterator():
+        fio = ' '.join(p for p in (user.last_name, user.first_name, user.middle_name) if p)
+        user.search_text = build_search_text(fio, user.employee_id, user.position, user.username)
+        user_texts[user.pk] = build_search_text(fio, user.employee_id, user.position)
+        users.append(user)
+    User.objects.bulk_update(users, ['search_text'], batch_size=1000)
+    employees = []
+    for employee in Employee.objects.all().iterator():
+        if employee.user_id:
+            employee.search_text = user_texts.get(employee.user_id, '')
+        else:
+            employee.search_text = build_search_text(
+                employee.last_name, employee.first_name, employee.middle_name,
+                employee.employee_id_own, employee.position_own,
+            )
+        employees.append(employee)
+    Employee.objects.bulk_update(employees, ['search_text'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_employee_ic_is_disabled_group2_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='search_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=700, verbose_name='Строка поиска'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=700, verbose_name='Строка поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+    ]
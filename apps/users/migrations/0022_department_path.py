@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:58
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Department = apps.get_model('users', 'Department')
+    parents = dict(Department.objects.values_list('id', 'parent_id'))
+    departments = []
+    for dep_id in parents:
+        chain, current = [], dep_id
+        while current is not None and current not in chain:
+            chain.append(current)
+            current = parents.get(current)
+        departments.append(Department(id=dep_id, path='/' + '/'.join(str(i) for i in reversed(chain)) + '/'))
+    Department.objects.bulk_update(departments, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='Путь в иерархии'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
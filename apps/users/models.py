@@ -1,9 +1,26 @@
-from django.db import models
+from django.db import models, router
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 
+class DepartmentQuerySet(models.QuerySet):
+    def subtree(self, department=None, path=None):
+        """Отдел (объект или id) со всеми подразделениями: диапазон по индексу path"""
+        if path is None:
+            if isinstance(department, Department):
+                path = department.path
+            else:
+                try:
+                    path = Department.objects.filter(pk=int(department)).values_list('path', flat=True).first()
+                except (TypeError, ValueError):
+                    path = None
+        if not path:
+            return self.none()
+        # Все пути с префиксом /a/b/ лежат в [/a/b/, /a/b0): '0' следует за '/'
+        return self.filter(path__gte=path, path__lt=path[:-1] + '0')
+
+
 class Department(models.Model):
     """Отдел предприятия"""
     name = models.CharField('Название отдела', max_length=200)
@@ -17,6 +34,10 @@ class Department(models.Model):
         blank=True,
         default='С.В. Ефременко',
         help_text='ФИО начальника цеха, например: С.В. Ефременко')
+
+    objects = DepartmentQuerySet.as_manager()
+    # Материализованный путь от корня: /<id корня>/.../<id>/ — поддерево одним диапазоном по индексу
+    path = models.CharField('Путь в иерархии', max_length=255, blank=True, default='', editable=False, db_index=True)
     
     class Meta:
         verbose_name = 'Отдел'
@@ -26,6 +47,61 @@ class Department(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def depth(self):
+        return self.path.count('/') - 2 if self.path else 0
+
+    def clean(self):
+        if self.pk and self.parent_id:
+            parent = Department.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            if f'/{self.pk}/' in parent:
+                raise ValidationError({'parent': 'Отдел нельзя подчинить самому себе или своему подразделению'})
+
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        if self.pk is None:
+            super().save(*args, **kwargs)
+            args, kwargs = (), {'using': self._state.db, 'update_fields': ['path']}
+        db = kwargs.get('using') or router.db_for_write(Department, instance=self)
+        # Путь родителя — из БД: закешированный self.parent мог устареть после его переноса
+        parent_path = (
+            Department.objects.using(db).values_list('path', flat=True).get(pk=self.parent_id)
+            if self.parent_id else '/'
+        )
+        self.path = f'{parent_path}{self.pk}/'
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'path'}
+        super().save(*args, **kwargs)
+        # Перенос в другой отдел: пути потомков меняются одним UPDATE
+        if old_path and old_path != self.path:
+            from django.db.models import Value
+            from django.db.models.functions import Concat, Substr
+            Department.objects.using(db).subtree(path=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1))
+            )
+
+    @classmethod
+    def rebuild_paths(cls):
+        """Пересчитать пути всех отделов (после bulk_create/bulk_update, которые не вызывают save)"""
+        parents = dict(cls.objects.values_list('id', 'parent_id'))
+        paths = {}
+
+        def path_of(dep_id, seen=()):
+            if dep_id not in paths:
+                parent_id = parents.get(dep_id)
+                if parent_id is None or parent_id in seen:
+                    paths[dep_id] = f'/{dep_id}/'
+                else:
+                    paths[dep_id] = f'{path_of(parent_id, seen + (dep_id,))}{dep_id}/'
+            return paths[dep_id]
+
+        changed = [
+            cls(id=dep_id, path=path_of(dep_id))
+            for dep_id, path in cls.objects.values_list('id', 'path') if path != path_of(dep_id)
+        ]
+        cls.objects.bulk_update(changed, ['path'], batch_size=500)
+        return len(changed)
+
 class User(AbstractUser):
     """Пользователь системы"""
     ROLE_CHOICES = [
@@ -86,6 +162,7 @@ class User(AbstractUser):
         default=False,
         help_text='Если включено — доступен отдельный табель ИТР'
     )
+    search_text = models.CharField('Строка поиска', max_length=700, blank=True, default='', editable=False)
     allowed_masters = models.ManyToManyField(
         'self',
         verbose_name='Доступные мастера (для планового отдела)',
@@ -109,6 +186,36 @@ class User(AbstractUser):
     
     def __str__(self):
         return f"{self.get_full_name()} ({self.employee_id})"
+
+    # Поля, от которых зависит search_text пользователя и его сотрудника
+    SEARCH_FIELDS = {'last_name', 'first_name', 'middle_name', 'employee_id', 'position', 'username'}
+
+    def get_search_text(self):
+        from .utils import build_search_text
+        return build_search_text(self.get_full_name(), self.employee_id, self.position, self.username)
+
+    # Поля, влияющие на выдачу автодополнения (apps.users.utils.autocomplete_users)
+    AUTOCOMPLETE_FIELDS = SEARCH_FIELDS | {'department', 'is_active', 'role'}
+
+    def save(self, *args, **kwargs):
+        from .utils import bump_autocomplete_cache_version
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.AUTOCOMPLETE_FIELDS & set(update_fields):
+            bump_autocomplete_cache_version()
+        if update_fields is not None and not self.SEARCH_FIELDS & set(update_fields):
+            return super().save(*args, **kwargs)
+        self.search_text = self.get_search_text()
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        super().save(*args, **kwargs)
+        # Строка поиска сотрудника с учетной записью строится из полей пользователя
+        employee_text = Employee.search_text_for_user(self)
+        Employee.objects.filter(user=self).exclude(search_text=employee_text).update(search_text=employee_text)
+
+    def delete(self, *args, **kwargs):
+        from .utils import bump_autocomplete_cache_version
+        bump_autocomplete_cache_version()
+        return super().delete(*args, **kwargs)
     
     @property
     def is_administrator(self):
@@ -221,6 +328,8 @@ class Employee(models.Model):
         verbose_name='Отдел (сотрудник без учетной записи)',
         related_name='employees_without_user'
     )
+    # ФИО, табельный номер и должность в нижнем регистре (apps.users.utils.filter_by_search)
+    search_text = models.CharField('Строка поиска', max_length=700, blank=True, default='', editable=False)
     class Meta:
         verbose_name = 'Сотрудник'
         verbose_name_plural = 'Сотрудники'
@@ -228,6 +337,32 @@ class Employee(models.Model):
     
     def __str__(self):
         return self.full_name or (str(self.user) if self.user else 'Сотрудник')
+
+    @staticmethod
+    def search_text_for_user(user):
+        from .utils import build_search_text
+        return build_search_text(user.get_full_name(), user.employee_id, user.position)
+
+    def get_search_text(self):
+        if self.user:
+            return self.search_text_for_user(self.user)
+        from .utils import build_search_text
+        return build_search_text(self.full_name, self.employee_id_own, self.position_own)
+
+    def save(self, *args, **kwargs):
+        from .utils import bump_autocomplete_cache_version
+        self.search_text = self.get_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        super().save(*args, **kwargs)
+        # Привязка и отвязка учетной записи меняют выдачу автодополнения
+        bump_autocomplete_cache_version()
+
+    def delete(self, *args, **kwargs):
+        from .utils import bump_autocomplete_cache_version
+        bump_autocomplete_cache_version()
+        return super().delete(*args, **kwargs)
     
     def clean(self):
         """Гарантируем уникальность табельного номера среди пользователей и сотрудников без учетной записи"""
@@ -0,0 +1,161 @@
+"""
+Тесты пользователей и отделов: поиск по нормализованной строке search_text
+(индекс FTS5), кеш автодополнения и материализованные пути отделов.
+"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, models
+from django.test import TestCase
+from django.urls import reverse
+
+from .models import Department, Employee, User
+from .utils import autocomplete_users, filter_by_search, fts_table, has_search_index
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ivanov = Employee.objects.create(
+            last_name='Иванов', first_name='Пётр', employee_id_own='E-1', position_own='Литейщик'
+        )
+        cls.petrova = Employee.objects.create(
+            last_name='Петрова', first_name='Анна', employee_id_own='E-2', position_own='Контролер'
+        )
+        cls.user = User.objects.create(
+            username='sidorov', employee_id='U-7', last_name='Сидоров', first_name='Иван', position='Токарь'
+        )
+        cls.with_user = Employee.objects.create(user=cls.user)
+
+    def found(self, term):
+        return set(filter_by_search(Employee.objects.all(), term))
+
+    def test_prefix_search_uses_fts_index(self):
+        self.assertTrue(has_search_index(connection, fts_table(Employee)))
+        self.assertEqual(self.found('иван пет'), {self.ivanov})
+        self.assertEqual(self.found('ПЁТР ИВАНОВ'), {self.ivanov})
+        self.assertEqual(self.found('пет'), {self.ivanov, self.petrova})
+        self.assertEqual(self.found('лит'), {self.ivanov})
+        self.assertEqual(self.found('u-7'), {self.with_user})
+        self.assertEqual(self.found('иван'), {self.ivanov, self.with_user})
+        self.assertEqual(self.found('нет такого'), set())
+
+    def test_index_follows_user_changes(self):
+        self.user.last_name = 'Кузнецов'
+        self.user.save()
+        self.assertEqual(self.found('кузн'), {self.with_user})
+        self.assertEqual(self.found('сидор'), set())
+        self.ivanov.delete()
+        self.assertEqual(self.found('лит'), set())
+
+    def test_fallback_without_index_matches(self):
+        with mock.patch('apps.users.utils.has_search_index', return_value=False):
+            self.assertEqual(self.found('иван'), {self.ivanov, self.with_user})
+            self.assertEqual(self.found('петр'), {self.ivanov, self.petrova})
+
+
+class AutocompleteTests(TestCase):
+    url = reverse('users:search_users_api')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.master = User.objects.create(username='master', employee_id='M-1', role='master', last_name='Мастеров')
+        cls.petrov = User.objects.create(username='petrov', employee_id='W-1', role='worker',
+                                         last_name='Петров', first_name='Павел')
+
+    def setUp(self):
+        cache.clear()
+
+    def results(self, term):
+        self.client.force_login(self.master)
+        return [row['id'] for row in self.client.get(self.url, {'q': term}).json()['results']]
+
+    def test_new_user_appears_after_cached_lookup(self):
+        self.assertEqual(self.results('пет'), [self.petrov.id])
+        newcomer = User.objects.create(username='petrenko', employee_id='W-2', role='worker', last_name='Петренко')
+        self.assertEqual(set(self.results('пет')), {self.petrov.id, newcomer.id})
+
+    def test_longer_prefix_is_served_from_cache(self):
+        autocomplete_users('пет')
+        with self.assertNumQueries(0):
+            self.assertEqual([row['id'] for row in autocomplete_users('петр')], [self.petrov.id])
+
+    def test_narrowing_does_not_depend_on_keystrokes(self):
+        painter = User.objects.create(username='vodkin', employee_id='E-00123', role='worker',
+                                      last_name='Петров-Водкин', first_name='Кузьма')
+        for typed in (['вод', 'водк'], ['00', '001'], ['петров-в', 'петров-во']):
+            with self.subTest(typed=typed):
+                cache.clear()
+                for term in typed:
+                    self.assertIn(painter.id, self.results(term), term)
+
+    def test_placed_users_drop_out(self):
+        self.assertEqual(self.results('пет'), [self.petrov.id])
+        self.petrov.department = Department.objects.create(name='Цех', code='C1')
+        self.petrov.save(update_fields=['department'])
+        self.assertEqual(self.results('пет'), [])
+        self.petrov.department = None
+        self.petrov.save(update_fields=['department'])
+        self.assertEqual(self.results('пет'), [self.petrov.id])
+        Employee.objects.create(user=self.petrov)
+        self.assertEqual(self.results('пет'), [])
+
+    def test_only_masters_may_search(self):
+        self.client.force_login(self.petrov)
+        self.assertEqual(self.client.get(self.url, {'q': 'пет'}).status_code, 403)
+
+
+class DepartmentPathTests(TestCase):
+    def setUp(self):
+        self.plant = Department.objects.create(name='Завод', code='P')
+        self.shop = Department.objects.create(name='Цех', code='S', parent=self.plant)
+        self.section = Department.objects.create(name='Участок', code='SE', parent=self.shop)
+        self.other = Department.objects.create(name='Другой завод', code='O')
+
+    def subtree(self, department):
+        return set(Department.objects.subtree(department))
+
+    def test_paths_and_subtree(self):
+        self.assertEqual(self.section.path, f'/{self.plant.pk}/{self.shop.pk}/{self.section.pk}/')
+        self.assertEqual(self.section.depth, 2)
+        self.assertEqual(self.subtree(self.plant), {self.plant, self.shop, self.section})
+        self.assertEqual(self.subtree(self.shop.pk), {self.shop, self.section})
+        self.assertEqual(self.subtree(None), set())
+
+    def test_move_rewrites_descendant_paths(self):
+        self.shop.parent = self.other
+        self.shop.save()
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.path, f'/{self.other.pk}/{self.shop.pk}/{self.section.pk}/')
+        self.assertEqual(self.subtree(self.plant), {self.plant})
+        self.assertEqual(self.subtree(self.other), {self.other, self.shop, self.section})
+
+    def test_path_reads_parent_from_database(self):
+        section = Department.objects.select_related('parent').get(pk=self.section.pk)
+        self.assertEqual(section.parent.path, self.shop.path)
+        self.shop.parent = self.other
+        self.shop.save()
+        # section.parent — закешированный объект со старым путем
+        section.name = 'Участок 2'
+        section.save()
+        self.assertEqual(section.path, f'/{self.other.pk}/{self.shop.pk}/{self.section.pk}/')
+
+    def test_create_keeps_database_alias(self):
+        original = models.Model.save
+        with mock.patch.object(models.Model, 'save', autospec=True, side_effect=original) as save:
+            Department(name='Склад', code='W', parent=self.plant).save(using='default')
+        # Вторая запись (путь) идет в ту же БД, что и вставка
+        self.assertEqual([call.kwargs.get('using') for call in save.call_args_list], ['default', 'default'])
+
+    def test_cycle_is_rejected(self):
+        self.plant.parent = self.section
+        with self.assertRaises(ValidationError):
+            self.plant.clean()
+
+    def test_rebuild_paths_after_bulk_update(self):
+        Department.objects.filter(pk=self.shop.pk).update(parent=self.other)
+        self.assertEqual(Department.rebuild_paths(), 2)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.path, f'/{self.other.pk}/{self.shop.pk}/{self.section.pk}/')
+        self.assertEqual(Department.rebuild_paths(), 0)
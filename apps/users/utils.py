@@ -0,0 +1,207 @@
+"""
+Поиск сотрудников и пользователей по нормализованной строке search_text.
+
+search_text (ФИО, табельный номер, должность; нижний регистр, «ё» → «е»)
+заполняется в save() моделей и при пакетной загрузке. В SQLite по нему
+строится внешний индекс FTS5 (<таблица>_fts), который поддерживают триггеры;
+поиск — по префиксам слов: «иван пет» находит «Иванов Петр».
+
+Индекс и триггеры создаются после migrate (create_search_indexes): миграции
+Django пересоздают таблицу при изменении полей и удаляют триггеры вместе с ней.
+"""
+import logging
+import re
+
+logger = logging.getLogger('apps')
+
+SEARCH_TABLES = ('users_employee', 'users_user')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# (псевдоним, файл БД, таблица), для которых индекс FTS5 уже найден
+_known_indexes = set()
+
+
+def build_search_text(*parts):
+    """Нормализованная строка поиска из частей (пустые пропускаются)"""
+    text = ' '.join(str(p) for p in parts if p)
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def search_tokens(term):
+    return _TOKEN_RE.findall(build_search_text(term))
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def filter_by_search(queryset, term):
+    """Отбор queryset по префиксам слов term в search_text (FTS5 в SQLite)"""
+    from django.db import connections
+    from django.db.models.expressions import RawSQL
+
+    tokens = search_tokens(term)
+    if not tokens:
+        return queryset
+    connection = connections[queryset.db]
+    table = fts_table(queryset.model)
+    if connection.vendor == 'sqlite' and has_search_index(connection, table):
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM "{table}" WHERE "{table}" MATCH %s', [match]))
+    # Без FTS5 — поиск подстрок по одному нормализованному столбцу
+    for token in tokens:
+        queryset = queryset.filter(search_text__contains=token)
+    return queryset
+
+
+def has_search_index(connection, table):
+    key = (connection.alias, connection.settings_dict['NAME'], table)
+    if key not in _known_indexes and table_exists(connection, table):
+        _known_indexes.add(key)
+    return key in _known_indexes
+
+
+def table_exists(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [table])
+        return cursor.fetchone() is not None
+
+
+def _index_sql(table):
+    fts = f'{table}_fts'
+    return {
+        'table': (
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS \"{fts}\" USING fts5("
+            f"search_text, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ),
+        f'{fts}_ai': (
+            f'CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+            f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.id, new.search_text); END'
+        ),
+        f'{fts}_ad': (
+            f'CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+            f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.id, old.search_text); END'
+        ),
+        f'{fts}_au': (
+            f'CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE OF search_text ON "{table}" BEGIN '
+            f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.id, old.search_text); '
+            f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.id, new.search_text); END'
+        ),
+    }
+
+
+def ensure_search_indexes(connection):
+    """Создать недостающие индексы FTS5 и триггеры; при пересоздании — перестроить индекс"""
+    if connection.vendor != 'sqlite':
+        return
+    for table in SEARCH_TABLES:
+        if not table_exists(connection, table):
+            continue
+        fts = f'{table}_fts'
+        statements = _index_sql(table)
+        with connection.cursor() as cursor:
+            missing = [
+                name for name in statements
+                if not table_exists(connection, fts if name == 'table' else name)
+            ]
+            if not missing:
+                continue
+            for name in missing:
+                cursor.execute(statements[name])
+            cursor.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')')
+        logger.info(f"Search index {fts} rebuilt (created: {', '.join(missing)})")
+
+
+def create_search_indexes(sender, using='default', **kwargs):
+    """Обработчик post_migrate"""
+    from django.db import connections
+    try:
+        ensure_search_indexes(connections[using])
+    except Exception as e:
+        # Сборка SQLite без FTS5: поиск работает по search_text без индекса
+        logger.warning(f"Cannot create search indexes on {using}: {e}")
+
+
+# --- Автодополнение пользователей (диалог добавления сотрудника) ----------------
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_CACHE_TIMEOUT = 60
+AUTOCOMPLETE_VERSION_KEY = 'users:autocomplete_version'
+
+
+def get_autocomplete_cache_version():
+    from django.core.cache import cache
+    return cache.get_or_set(AUTOCOMPLETE_VERSION_KEY, 1, None)
+
+
+def bump_autocomplete_cache_version():
+    """
+    Сбросить кеш автодополнения после изменения пользователей или сотрудников.
+
+    Кеш локален для процесса: в других воркерах записи доживают до
+    AUTOCOMPLETE_CACHE_TIMEOUT.
+    """
+    from django.core.cache import cache
+    try:
+        return cache.incr(AUTOCOMPLETE_VERSION_KEY)
+    except ValueError:
+        cache.set(AUTOCOMPLETE_VERSION_KEY, 2, None)
+        return 2
+
+
+def _autocomplete_key(version, tokens):
+    import hashlib
+    digest = hashlib.md5(' '.join(tokens).encode('utf-8')).hexdigest()
+    return f'users:autocomplete:{version}:{digest}'
+
+
+def _matches(search_text, tokens):
+    """Та же разбивка на слова, что у запроса и у индекса FTS5: «e-00123» — это «e» и «00123»"""
+    words = _TOKEN_RE.findall(search_text)
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+
+def autocomplete_users(term, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Пользователи без отдела и без карточки сотрудника (кроме мастеров), чьи
+    слова начинаются с введенных префиксов: [{'id', 'text'}], не больше limit.
+
+    Результат кешируется по нормализованному префиксу. Если для префикса на
+    символ короче в кеше полный список (меньше limit), новый отбирается из
+    него без запроса к БД — так обычно и идет ввод.
+    """
+    from django.core.cache import cache
+    from django.db.models import Exists, OuterRef
+    from .models import Employee, User
+
+    tokens = search_tokens(term)
+    if not tokens:
+        return []
+    version = get_autocomplete_cache_version()
+    key = _autocomplete_key(version, tokens)
+    rows = cache.get(key)
+    if rows is None:
+        shorter = tokens[:-1] + [tokens[-1][:-1]] if len(tokens[-1]) > 1 else tokens[:-1]
+        narrowed = cache.get(_autocomplete_key(version, shorter)) if shorter else None
+        if narrowed is not None and len(narrowed) < limit:
+            rows = [row for row in narrowed if _matches(row['search_text'], tokens)]
+        else:
+            users = filter_by_search(User.objects.all(), term).filter(
+                department=None,
+                is_active=True,
+            ).exclude(role='master').filter(
+                ~Exists(Employee.objects.filter(user=OuterRef('pk')))
+            ).only(
+                'id', 'last_name', 'first_name', 'middle_name', 'employee_id', 'position', 'search_text'
+            )[:limit]
+            rows = [
+                {
+                    'id': user.id,
+                    'text': f"{user.get_full_name()} ({user.employee_id}) - {user.position or 'Без должности'}",
+                    'search_text': user.search_text,
+                }
+                for user in users
+            ]
+        cache.set(key, rows, AUTOCOMPLETE_CACHE_TIMEOUT)
+    return [{'id': row['id'], 'text': row['text']} for row in rows]
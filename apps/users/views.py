@@ -8,6 +8,7 @@ from django.db.models import Q
 from django.http import JsonResponse, Http404
 
 from .models import Employee
+from .utils import autocomplete_users, filter_by_search
 from .forms import AddEmployeeForm, CreateEmployeeForm, EmployeeFilterForm, EmployeeAssignmentForm, EmployeeMasterEditForm
 
 class MasterMixin(UserPassesTestMixin):
@@ -44,15 +45,7 @@ class EmployeeListView(MasterMixin, ListView):
         is_active = self.request.GET.get('is_active')
         
         if search:
-            queryset = queryset.filter(
-                Q(user__first_name__icontains=search) |
-                Q(user__last_name__icontains=search) |
-                Q(user__employee_id__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(middle_name__icontains=search) |
-                Q(employee_id_own__icontains=search)
-            )
+            queryset = filter_by_search(queryset, search)
         
         if is_active == 'active':
             queryset = queryset.filter(is_active=True)
@@ -245,35 +238,8 @@ def search_users_api(request):
     if len(search_term) < 2:
         return JsonResponse({'results': []})
     
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-    from .models import Employee
-    
-    # Ищем пользователей без отдела и не привязанных к сотрудникам
-    existing_employee_users = Employee.objects.values_list('user_id', flat=True)
-    
-    users = User.objects.filter(
-        Q(first_name__icontains=search_term) |
-        Q(last_name__icontains=search_term) |
-        Q(username__icontains=search_term) |
-        Q(employee_id__icontains=search_term)
-    ).filter(
-        department=None,
-        is_active=True
-    ).exclude(
-        id__in=existing_employee_users
-    ).exclude(
-        role='master'
-    )[:10]
-    
-    results = []
-    for user in users:
-        results.append({
-            'id': user.id,
-            'text': f"{user.get_full_name()} ({user.employee_id}) - {user.position or 'Без должности'}"
-        })
-    
-    return JsonResponse({'results': results})
+    # Пользователи без отдела и не привязанные к сотрудникам (кеш по префиксу)
+    return JsonResponse({'results': autocomplete_users(search_term)})
 
 @login_required
 def profile_view(request):
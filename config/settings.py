@@ -1,4 +1,6 @@
 import os
+import sys
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -56,6 +58,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'apps.core.context_processors.read_replica',
             ],
         },
     },
@@ -85,6 +88,110 @@ if SQLITE_ENV_PATH:
         pass
     DATABASES['default']['NAME'] = SQLITE_ENV_PATH
 
+# Архив табелей (команда archive_months): отдельный файл SQLite, подключаемый
+# к каждому соединению как схема archive.
+# DJANGO_SQLITE_ARCHIVE_PATH — путь к файлу архива (например, рядом с основной БД); пусто — выключено
+SQLITE_ARCHIVE_PATH = os.getenv('DJANGO_SQLITE_ARCHIVE_PATH', '')
+
+# Реплика только для чтения (apps.core.replica): отчеты плановика, печатная форма,
+# экспорт и статистика читают из снимка основной БД.
+# DJANGO_SQLITE_REPLICA_PATH   — файл снимка (обновляется командой refresh_replica); пусто — выключено
+# DJANGO_READ_REPLICA_MAX_LAG  — максимальная давность снимка, с; старше — чтение из основной БД
+# DJANGO_READ_REPLICA_EXCLUDE  — имена представлений через запятую, которые всегда читают основную БД
+SQLITE_REPLICA_PATH = os.getenv('DJANGO_SQLITE_REPLICA_PATH', '')
+if SQLITE_REPLICA_PATH:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SQLITE_REPLICA_PATH,
+        'TEST': {'MIRROR': 'default'},
+    }
+READ_REPLICA = {
+    'ALIAS': 'replica',
+    'MAX_LAG': int(os.getenv('DJANGO_READ_REPLICA_MAX_LAG', '600')),
+    'EXCLUDE_VIEWS': [v.strip() for v in os.getenv('DJANGO_READ_REPLICA_EXCLUDE', '').split(',') if v.strip()],
+}
+DATABASE_ROUTERS = ['apps.core.routers.ReadReplicaRouter', 'apps.core.routers.ArchiveRouter']
+
+# Профиль SQLite: PRAGMA, выполняемые для каждого нового соединения (apps.core.db)
+# DJANGO_SQLITE_JOURNAL_MODE — WAL (по умолчанию), DELETE, TRUNCATE...
+# DJANGO_SQLITE_SYNCHRONOUS  — NORMAL (по умолчанию, безопасно в режиме WAL), FULL, OFF
+# DJANGO_SQLITE_BUSY_TIMEOUT — ожидание блокировки записи, мс
+# DJANGO_SQLITE_MMAP_SIZE    — размер memory-mapped I/O, байт (0 — отключить)
+# DJANGO_SQLITE_CACHE_SIZE   — кеш страниц; отрицательное значение — в КиБ
+# DJANGO_SQLITE_TEMP_STORE   — MEMORY (по умолчанию), FILE, DEFAULT
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('DJANGO_SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('DJANGO_SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('DJANGO_SQLITE_BUSY_TIMEOUT', '5000')),
+    'mmap_size': int(os.getenv('DJANGO_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': int(os.getenv('DJANGO_SQLITE_CACHE_SIZE', '-65536')),
+    'temp_store': os.getenv('DJANGO_SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+# Очередь записи (apps.core.write_queue): изменяющие представления выполняются
+# одним потоком-писателем на процесс. DJANGO_SQLITE_WRITE_QUEUE=true — включить.
+SQLITE_WRITE_QUEUE = {
+    'ENABLED': os.getenv('DJANGO_SQLITE_WRITE_QUEUE', 'False').lower() == 'true',
+    'MAX_SIZE': int(os.getenv('DJANGO_SQLITE_WRITE_QUEUE_SIZE', '200')),
+    'BATCH_SIZE': int(os.getenv('DJANGO_SQLITE_WRITE_QUEUE_BATCH', '20')),
+    'TIMEOUT': float(os.getenv('DJANGO_SQLITE_WRITE_QUEUE_TIMEOUT', '10')),
+    'RETRY_AFTER': 2,
+}
+
+# Профилирование запросов (apps.core.profiling, LoggingMiddleware): число SQL-запросов,
+# время в БД и шаблонах, заголовок Server-Timing.
+# DJANGO_REQUEST_PROFILING    — false, чтобы отключить
+# DJANGO_SERVER_TIMING        — false, чтобы не отдавать заголовок Server-Timing
+# DJANGO_QUERY_COUNT_WARNING  — порог числа запросов, после которого в журнал пишутся самые частые
+# DJANGO_SLOW_REQUEST_SECONDS — порог медленного запроса: предупреждение в журнале и выборка стеков
+# DJANGO_PROFILE_SAMPLER      — true, чтобы снимать стеки медленных запросов (выключено: пока идут
+#                               запросы, процесс обходит стеки всех потоков 100 раз в секунду)
+# DJANGO_PROFILE_ON_DEMAND    — false, чтобы запретить ?_profile=1 (cProfile) и администраторам
+# DJANGO_PROFILE_DIR          — каталог профилей (по умолчанию logs/profiles), хранится PROFILE_KEEP файлов
+REQUEST_PROFILING = {
+    'ENABLED': os.getenv('DJANGO_REQUEST_PROFILING', 'True').lower() == 'true',
+    'SERVER_TIMING': os.getenv('DJANGO_SERVER_TIMING', 'True').lower() == 'true',
+    'QUERY_COUNT_THRESHOLD': int(os.getenv('DJANGO_QUERY_COUNT_WARNING', '200')),
+    'TOP_SQL': 5,
+    'SLOW_REQUEST_SECONDS': float(os.getenv('DJANGO_SLOW_REQUEST_SECONDS', '2.0')),
+    'SAMPLER': os.getenv('DJANGO_PROFILE_SAMPLER', 'False').lower() == 'true',
+    'SAMPLE_INTERVAL': 0.01,
+    'ON_DEMAND': os.getenv('DJANGO_PROFILE_ON_DEMAND', 'True').lower() == 'true',
+    'PROFILE_DIR': os.getenv('DJANGO_PROFILE_DIR') or BASE_DIR / 'logs' / 'profiles',
+    'PROFILE_KEEP': int(os.getenv('DJANGO_PROFILE_KEEP', '50')),
+    'TOP_FUNCTIONS': 40,
+}
+
+# Метрики Prometheus (apps.core.metrics), GET /metrics: задержки и число SQL-запросов
+# по представлениям, попадания кеша, блокировки SQLite, очередь записи, ячейки табеля.
+# Воркеры сбрасывают счетчики в METRICS['DIR'], /metrics суммирует все процессы.
+# DJANGO_METRICS             — false, чтобы не собирать метрики запросов и кеша
+# DJANGO_METRICS_DIR         — каталог файлов процессов (по умолчанию logs/metrics)
+# DJANGO_METRICS_ALLOWED_IPS — адреса, которым /metrics доступен без входа, через запятую (по умолчанию
+#                              никому). За обратным прокси это адрес прокси, поэтому 127.0.0.1 открыл бы
+#                              метрики всем, кого пропускает прокси; там используйте токен
+# DJANGO_METRICS_TOKEN       — токен для заголовка Authorization: Bearer <токен>
+METRICS = {
+    'ENABLED': os.getenv('DJANGO_METRICS', 'True').lower() == 'true',
+    'DIR': os.getenv('DJANGO_METRICS_DIR') or BASE_DIR / 'logs' / 'metrics',
+    'FLUSH_INTERVAL': 5.0,
+    'ALLOWED_IPS': [ip.strip() for ip in os.getenv('DJANGO_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()],
+    'TOKEN': os.getenv('DJANGO_METRICS_TOKEN', ''),
+    'BUSINESS_MONTHS': 2,
+    'BUSINESS_CACHE_SECONDS': 60,
+}
+# manage.py test не оставляет файлов процессов в рабочем каталоге
+if sys.argv[1:2] == ['test'] and not os.getenv('DJANGO_METRICS_DIR'):
+    METRICS['DIR'] = Path(tempfile.gettempdir()) / 'worktime_tracking_test_metrics'
+
+# Локальный кеш процесса с учетом попаданий в метриках
+CACHES = {
+    'default': {
+        'BACKEND': 'apps.core.cache.InstrumentedLocMemCache',
+        'LOCATION': 'default',
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -113,8 +220,24 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
 
 # Logging
+# Запись журнала вынесена из потока запроса: логгеры пишут в очередь (apps.core.logs),
+# файл и консоль обслуживает отдельный поток.
+# DJANGO_LOG_FORMAT         — json (по умолчанию: JSON-строки для разбора) или text
+# DJANGO_LOG_LEVEL          — уровень логгера apps (по умолчанию DEBUG при DEBUG, иначе INFO)
+# DJANGO_LOG_ASYNC          — false, чтобы писать синхронно (отладка)
+# DJANGO_LOG_CONSOLE        — дублировать в консоль (по умолчанию при DEBUG)
+# DJANGO_LOG_MAX_BYTES      — ротация по размеру файла, байт (0 — выключить)
+# DJANGO_LOG_ROTATE_HOURS   — ротация по времени, ч (0 — выключить)
+# DJANGO_LOG_BACKUP_COUNT   — сколько сжатых частей app.log.N.gz хранить
+# DJANGO_LOG_DEBUG_SAMPLE   — доля DEBUG-записей, попадающих в журнал (0..1)
 LOG_DIR = BASE_DIR / 'logs'
 os.makedirs(LOG_DIR, exist_ok=True)
+LOG_FORMAT = os.getenv('DJANGO_LOG_FORMAT', 'json').lower()
+LOG_LEVEL = os.getenv('DJANGO_LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO').upper()
+LOG_ASYNC = os.getenv('DJANGO_LOG_ASYNC', 'True').lower() == 'true'
+LOG_CONSOLE = os.getenv('DJANGO_LOG_CONSOLE', str(DEBUG)).lower() == 'true'
+LOG_OUTPUTS = ['file', 'console'] if LOG_CONSOLE else ['file']
+LOG_HANDLERS = ['queue'] if LOG_ASYNC else LOG_OUTPUTS
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -123,29 +246,48 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'apps.core.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'debug_sampling': {
+            '()': 'apps.core.logs.SamplingFilter',
+            'rate': float(os.getenv('DJANGO_LOG_DEBUG_SAMPLE', '1.0')),
+        },
     },
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'apps.core.logs.CompressedRotatingFileHandler',
             'filename': LOG_DIR / 'app.log',
-            'formatter': 'verbose',
+            'max_bytes': int(os.getenv('DJANGO_LOG_MAX_BYTES', str(50 * 1024 * 1024))),
+            'rotate_seconds': int(float(os.getenv('DJANGO_LOG_ROTATE_HOURS', '24')) * 3600),
+            'backup_count': int(os.getenv('DJANGO_LOG_BACKUP_COUNT', '14')),
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
         },
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        # Имя сортируется после file/console: dictConfig создает их раньше
+        'queue': {
+            'class': 'apps.core.logs.QueueListenerHandler',
+            'handlers': [f'cfg://handlers.{name}' for name in LOG_OUTPUTS],
+            'queue_size': 10000,
+            'filters': ['debug_sampling'],
+        },
     },
     'loggers': {
         'django': {
-            'handlers': ['file', 'console'],
+            'handlers': LOG_HANDLERS,
             'level': 'INFO',
             'propagate': True,
         },
         'apps': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
+            'handlers': LOG_HANDLERS,
+            'level': LOG_LEVEL,
             'propagate': True,
         },
     },
@@ -1,18 +1,16 @@
-import pandas as pd
-from datetime import datetime
+from apps.core.spreadsheets import iter_rows, to_date
 from apps.timesheet.models import Holiday
 
 # Загружаем Excel
-df = pd.read_excel("holidays.xlsx", header=None)
-
-for row in df.iloc[1:].itertuples(index=False):
+for row in iter_rows("holidays.xlsx", skip_rows=1):
     for cell in row:  # каждая ячейка = дата
-        if pd.notna(cell):  # пропускаем пустые
-            try:
-                day = pd.to_datetime(cell).date()
-                Holiday.objects.get_or_create(
-                    date=day,
-                    defaults={"type": "holiday", "name": "Выходной"}
-                )
-            except Exception as e:
-                print(f"Ошибка для {cell}: {e}")
+        if cell in (None, ""):  # пропускаем пустые
+            continue
+        day = to_date(cell)
+        if day:
+            Holiday.objects.get_or_create(
+                date=day,
+                defaults={"type": "holiday", "name": "Выходной"}
+            )
+        else:
+            print(f"Ошибка для {cell}: не удалось распознать дату")